@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# Local stand-in for a Jenkins controller, implementing the REST endpoints bin/jenkins_cli.py uses: job listing,
+# job config get/post, create/delete/rename/enable/disable, views and builds.  Jobs, config size and latency are
+# configurable and the time spent on every request is recorded per endpoint.  Like stock Jenkins it sends no ETag
+# for config.xml unless --etags is given.  Builds wait in a queue for one of --executors executors and take
+# --build_seconds; every third job has a GIT_BRANCH parameter and every seventh job's builds fail.  With
+# --error_rate a share of requests is answered 503, as by a controller that is restarting.  With --folders every
+# fourth job is inside one of that many folders (bench-folder-N/bench-job-NNNNN).
+#
+#   python3 bench/fake_jenkins.py [--port 8080] [--jobs 1000] [--config_kb 20] [--latency 0.01] [--error_rate 0]
+#                                 [--folders 0]
+
+import re, sys
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+config_template = '''<?xml version='1.1' encoding='UTF-8'?>
+<project>
+  <description>{name} for PROJECT_NAME</description>
+  <disabled>{disabled}</disabled>
+  <scm class="hudson.plugins.git.GitSCM">
+    <userRemoteConfigs><hudson.plugins.git.UserRemoteConfig><url>GIT_REPO</url></hudson.plugins.git.UserRemoteConfig></userRemoteConfigs>
+    <branches><hudson.plugins.git.BranchSpec><name>*/GIT_BRANCH</name></hudson.plugins.git.BranchSpec></branches>
+  </scm>
+  <builders>
+{padding}  </builders>
+</project>
+'''
+
+
+def make_config(name, size_kb, disabled=False):
+    step = '    <hudson.tasks.Shell><command>echo building {} step {}</command></hudson.tasks.Shell>\n'
+    padding = []
+    size = len(config_template)
+    i = 0
+    while size < size_kb * 1024:
+        padding.append(step.format(name, i))
+        size += len(padding[-1])
+        i += 1
+    return config_template.format(name=name, disabled=str(disabled).lower(), padding=''.join(padding))
+
+
+# state of the fake controller, shared by all request handler threads
+class FakeJenkins:
+    def __init__(self, jobs=100, config_kb=20, latency=0.0, jitter=0.0, prefix='bench-job-', executors=2,
+                 build_seconds=0.0, etags=False, error_rate=0.0, folders=0):
+        self.lock = threading.Lock()
+        self.etags = etags  # stock Jenkins sends no validators for config.xml
+        self.error_rate = error_rate
+        self.random = random.Random(1)  # which requests fail, the same on every run
+        self.requests = {}  # 'METHOD path?query' => times requested, kept with error_rate only
+        self.errors = {}  # 'METHOD path?query' => times answered 503
+        self.latency = latency
+        self.jitter = jitter
+        self.executors = executors
+        self.build_seconds = build_seconds
+        self.jobs = {}  # full name (folder/job) => job
+        self.folders = set()  # full names
+        self.views = {}
+        self.queue = {}  # queue id => item, kept once the build started like Jenkins does for a while
+        self.calls = {}  # endpoint => list of seconds spent
+        for i in range(jobs):
+            name = '{}{:05d}'.format(prefix, i)
+            if folders and i % 4 == 3:
+                folder = '{}-folder-{}'.format(prefix.split('-')[0], i // 4 % folders)
+                self.folders.add(folder)
+                name = folder + '/' + name
+            disabled = i % 10 == 0
+            self.create(name, make_config(name, config_kb, disabled))
+            self.jobs[name].update({'color': 'disabled' if disabled else 'blue',
+                                    'parameters': ['GIT_BRANCH'] if i % 3 == 1 else [],
+                                    'result': 'FAILURE' if i % 7 == 5 else 'SUCCESS'})
+        self.views[prefix.split('-')[0]] = '<hudson.model.ListView><name>{}</name></hudson.model.ListView>'.format(
+            prefix.split('-')[0])
+
+    def advance(self):
+        # finishes builds whose time is up and starts queued ones on free executors; called with lock held
+        now = time.monotonic()
+        running = 0
+        for job in self.jobs.values():
+            for run in job['runs']:
+                if run['building'] and run['end'] <= now:
+                    (run['building'], run['result']) = (False, job['result'])
+                running += run['building']
+        for (id, item) in sorted(self.queue.items()):
+            if running >= self.executors:
+                break
+            if 'number' in item or item['job'] not in self.jobs:
+                continue
+            job = self.jobs[item['job']]
+            job['builds'] += 1
+            item['number'] = job['builds']
+            job['runs'].insert(0, {'number': job['builds'], 'queueId': id, 'building': True, 'result': None,
+                                   'end': now + self.build_seconds, 'duration': int(self.build_seconds * 1000),
+                                   'parameters': item['parameters']})
+            running += 1
+
+    def create(self, name, config):
+        self.jobs[name] = {'config': config, 'color': 'blue', 'builds': 0, 'runs': [], 'parameters': [],
+                           'result': 'SUCCESS'}
+
+    def url(self, base, name):
+        # 'a/b' => <base>job/a/job/b/
+        return base + 'job/' + '/job/'.join(name.split('/')) + '/'
+
+    def listing(self, folder, tree, base):
+        # jobs and folders of folder ('' for the top level) as jobs[...] lists them, folders with their items in
+        # 'jobs'; called with lock held
+        items = []
+        for (name, job) in self.jobs.items():
+            if name.rpartition('/')[0] != folder:
+                continue
+            item = {'name': name.rpartition('/')[2], 'url': self.url(base, name), 'color': job['color']}
+            if 'builds[' in tree:
+                item['builds'] = self.builds(name, tree, base)
+            if 'parameterDefinitions' in tree:
+                item['property'] = [{'parameterDefinitions': [
+                    {'name': parameter, 'defaultParameterValue': {'value': 'main'}}
+                    for parameter in job['parameters']]}] if job['parameters'] else []
+            items.append(item)
+        for name in sorted(self.folders):
+            if name.rpartition('/')[0] == folder:
+                items.append({'name': name.rpartition('/')[2], 'url': self.url(base, name),
+                              'jobs': self.listing(name, tree, base)})
+        return items
+
+    def builds(self, name, tree, base):
+        # builds of a job as a tree with builds[...]{from,to} lists them, the newest first
+        m = re.search('builds\\[[^\\]]*\\]\\{(\\d*),(\\d*)\\}', tree)
+        (first, last) = (int(m.group(1) or 0), int(m.group(2) or 100)) if m else (0, 100)
+        return [self.build_info(name, run, base) for run in self.jobs[name]['runs'][first:last]]
+
+    def build_info(self, name, run, base):
+        return {'number': run['number'], 'queueId': run['queueId'], 'building': run['building'],
+                'result': run['result'], 'duration': run['duration'],
+                'url': self.url(base, name) + '{}/'.format(run['number'])}
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.calls.setdefault(endpoint, []).append(seconds)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+            self.requests = {}
+            self.errors = {}
+
+    def fail(self, request):
+        # True when request is to be answered 503
+        if not self.error_rate:
+            return False
+        with self.lock:
+            self.requests[request] = self.requests.get(request, 0) + 1
+            if self.random.random() >= self.error_rate:
+                return False
+            self.errors[request] = self.errors.get(request, 0) + 1
+            return True
+
+    def latencies(self):
+        # per call seconds of all endpoints
+        with self.lock:
+            return [seconds for calls in self.calls.values() for seconds in calls]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like Jenkins
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body='', content_type='application/json', headers=None):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key in headers or {}:
+            self.send_header(key, headers[key])
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        start = time.monotonic()
+        fake = self.server.fake
+        if fake.latency or fake.jitter:
+            time.sleep(fake.latency + random.uniform(0, fake.jitter))
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = urllib.parse.unquote(url.path).strip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        if fake.fail('{} {}'.format(method, self.path)):
+            self.reply(503, 'Service Unavailable', 'text/plain')
+            endpoint = '503'
+        else:
+            endpoint = self.route(method, path, query, body)
+        fake.record('{} {}'.format(method, endpoint), time.monotonic() - start)
+
+    def route(self, method, path, query, body):
+        # handles the request and returns the endpoint it counts as
+        fake = self.server.fake
+        base = 'http://{}:{}/'.format(*self.server.server_address[:2])
+        tree = query.get('tree', [''])[0]
+        with fake.lock:
+            fake.advance()
+        if path == 'api/json':
+            with fake.lock:
+                jobs = fake.listing('', tree, base)
+                views = [{'name': name, 'url': base + 'view/' + name + '/'} for name in fake.views]
+            self.reply(200, json.dumps({'jobs': jobs, 'views': views, 'primaryView': {'name': 'all', 'url': base}}))
+            return path
+        if path == 'crumbIssuer/api/json':
+            self.reply(404)
+            return path
+        if path == 'createItem':
+            with fake.lock:
+                fake.create(query['name'][0], body)
+            self.reply(200)
+            return path
+        if path == 'createView':
+            with fake.lock:
+                fake.views[query['name'][0]] = body
+            self.reply(200)
+            return path
+        m = re.match('^((?:job/[^/]+/)+)(.*)$', path)
+        if m:
+            # job/a/job/b/... => a/b
+            name = '/'.join(m.group(1).split('/')[1::2])
+            if name in fake.folders:
+                return 'job/*/' + self.route_folder(method, name, m.group(2), query, body, base)
+            return 'job/*/' + self.route_job(method, name, re.sub('^\\d+/', '*/', m.group(2)),
+                                             m.group(2), query, body, base)
+        m = re.match('^view/([^/]+)/(.*)$', path)
+        if m:
+            return 'view/*/' + self.route_view(method, m.group(1), m.group(2), body)
+        m = re.match('^queue/item/(\\d+)/api/json$', path)
+        if m:
+            with fake.lock:
+                item = dict(fake.queue.get(int(m.group(1))) or {})
+            if not item:
+                self.reply(404)
+            elif 'number' not in item:
+                self.reply(200, json.dumps({'id': int(m.group(1)), 'why': 'Waiting for next available executor'}))
+            else:
+                self.reply(200, json.dumps({'id': int(m.group(1)), 'executable': {
+                    'number': item['number'], 'url': fake.url(base, item['job']) + '{}/'.format(item['number'])}}))
+            return 'queue/item/*/api/json'
+        if path == 'queue/api/json':
+            with fake.lock:
+                items = [{'id': id} for (id, item) in sorted(fake.queue.items()) if 'number' not in item]
+            self.reply(200, json.dumps({'items': items}))
+            return path
+        if path == 'computer/api/json':
+            self.reply(200, json.dumps({'totalExecutors': fake.executors}))
+            return path
+        self.reply(404)
+        return path
+
+    def route_folder(self, method, name, endpoint, query, body, base):
+        fake = self.server.fake
+        with fake.lock:
+            if endpoint == 'api/json':
+                tree = query.get('tree', [''])[0]
+                self.reply(200, json.dumps({'name': name.rpartition('/')[2], 'jobs': fake.listing(name, tree, base)}))
+            elif endpoint == 'createItem' and method == 'POST':
+                fake.create(name + '/' + query['name'][0], body)
+                self.reply(200)
+            else:
+                self.reply(404)
+        return endpoint
+
+    def route_job(self, method, name, endpoint, path, query, body, base):
+        fake = self.server.fake
+        with fake.lock:
+            job = fake.jobs.get(name)
+            if not job:
+                self.reply(404)
+                return endpoint
+            if endpoint == 'api/json':
+                info = {'name': name.rpartition('/')[2], 'fullName': name, 'color': job['color']}
+                if 'builds[' in query.get('tree', [''])[0]:
+                    info['builds'] = fake.builds(name, query['tree'][0], base)
+                self.reply(200, json.dumps(info))
+            elif endpoint == 'config.xml' and method == 'GET':
+                if not fake.etags:
+                    self.reply(200, job['config'], 'application/xml')
+                    return endpoint
+                etag = '"{}"'.format(hashlib.sha1(job['config'].encode('utf-8')).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    self.reply(304, headers={'ETag': etag})
+                else:
+                    self.reply(200, job['config'], 'application/xml', {'ETag': etag})
+            elif endpoint == 'config.xml':
+                job['config'] = body
+                self.reply(200)
+            elif endpoint in ('enable', 'disable'):
+                job['color'] = 'disabled' if endpoint == 'disable' else 'blue'
+                self.reply(200)
+            elif endpoint == 'doDelete':
+                del fake.jobs[name]
+                self.reply(200)
+            elif endpoint in ('doRename', 'confirmRename'):
+                # within the job's folder
+                fake.jobs[name.rpartition('/')[0] + name.rpartition('/')[1] + query['newName'][0]] = \
+                    fake.jobs.pop(name)
+                self.reply(200)
+            elif endpoint in ('build', 'buildWithParameters'):
+                if (endpoint == 'buildWithParameters') != bool(job['parameters']):
+                    # as Jenkins answers a job built without the parameters it has, or with some it has not
+                    self.reply(400)
+                    return endpoint
+                id = len(fake.queue) + 1
+                parameters = dict((key, values[0]) for (key, values) in query.items() if key != 'token')
+                fake.queue[id] = {'job': name, 'parameters': parameters}
+                fake.advance()
+                self.reply(201, headers={'Location': base + 'queue/item/{}/'.format(id)})
+            elif endpoint == '*/api/json':
+                number = int(path.split('/')[0])
+                runs = [run for run in job['runs'] if run['number'] == number]
+                if runs:
+                    self.reply(200, json.dumps(fake.build_info(name, runs[0], base)))
+                else:
+                    self.reply(404)
+            else:
+                self.reply(404)
+        return endpoint
+
+    def route_view(self, method, name, endpoint, body):
+        fake = self.server.fake
+        with fake.lock:
+            if name not in fake.views:
+                self.reply(404)
+            elif endpoint == 'api/json':
+                self.reply(200, json.dumps({'name': name}))
+            elif endpoint == 'config.xml' and method == 'GET':
+                self.reply(200, fake.views[name], 'application/xml')
+            elif endpoint == 'config.xml':
+                fake.views[name] = body
+                self.reply(200)
+            else:
+                self.reply(404)
+        return endpoint
+
+
+class Server(ThreadingHTTPServer):
+    # listen backlog as deep as a real controller's, so hundreds of clients connecting at once are not left
+    # waiting on SYN retransmits
+    request_queue_size = 1024
+
+
+def start(fake, port=0):
+    # serve fake on a background thread, returns the server (server.server_address has the port)
+    server = Server(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Jenkins controller')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--jobs', type=int, default=1000, help='Number of jobs')
+    parser.add_argument('--config_kb', type=int, default=20, help='Size of each job config in KB')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many random seconds added on top')
+    parser.add_argument('--executors', type=int, default=2, help='Builds running at once')
+    parser.add_argument('--etags', action='store_true',
+                        help='Send ETags with job configs and answer If-None-Match, which stock Jenkins does not')
+    parser.add_argument('--build_seconds', type=float, default=0, help='Seconds each build takes')
+    parser.add_argument('--error_rate', type=float, default=0,
+                        help='Share of requests, 0 to 1, answered 503 Service Unavailable')
+    parser.add_argument('--folders', type=int, default=0, help='Number of folders holding every fourth job')
+    args = parser.parse_args()
+
+    fake = FakeJenkins(args.jobs, args.config_kb, args.latency, args.jitter, executors=args.executors,
+                       build_seconds=args.build_seconds, etags=args.etags, error_rate=args.error_rate,
+                       folders=args.folders)
+    server = start(fake, args.port)
+    print('Fake Jenkins with {} jobs on http://127.0.0.1:{}/'.format(args.jobs, server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# End to end benchmark of bin/jenkins_cli.py against the fake Jenkins controller in bench/fake_jenkins.py.  Each
+# scenario runs jenkins_cli.py on a freshly started controller and reports jobs/s, p50/p99 latency of the calls
+# the controller served (including the injected latency) and peak RSS of the jenkins_cli.py process.  Results can
+# be saved as a baseline and later runs compared against it.  The *_cached scenarios run twice on the same
+# controller with the config cache on and measure the second run: what the cache saves against a controller that,
+# like stock Jenkins, sends no ETags (--etags for one that does; --cli_args '--cache_ttl 0' to see it without TTL);
+# update_cached and clone_cached so measure a re-run that finds nothing left to write.  Every fourth job is inside
+# one of --folders folders, so that the configs of jobs in folders are fetched, updated and cloned as well.
+# The retry scenario clones jobs from a controller answering a tenth of requests 503 and checks that every GET
+# answered so was sent again and no post that is not idempotent (creating a job, say) was.
+#
+#   python3 bench/jenkins_cli_scenarios.py [--jobs 200] [--config_kb 20] [--latency 0.01] [--workers 1]
+#                                          [--scenarios show,grep,fetch,update,clone,grep_cached,update_cached,
+#                                          clone_cached,retry] [--etags] [--folders 2] [--save FILE]
+#                                          [--baseline FILE]
+
+import os, sys
+import argparse
+import glob
+import json
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_jenkins
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+cli = os.path.join(root, 'bin', 'jenkins_cli.py')
+workdir = '/var/tmp/jenkins_cli'  # where jenkins_cli.py saves configs
+
+# scenario => jenkins_cli.py flags, jobs are named bench-job-NNNNN or bench-folder-N/bench-job-NNNNN
+scenarios = {
+    'show': ['--show_jobs'],
+    'grep': ['--grep_jobs', '--grep_content_pattern', 'step [0-9]*7<', '--grep_count'],
+    'fetch': ['--fetch_jobs'],
+    'update': ['--update_jobs', '--find_replace_content_pattern', 'echo building|echo BUILDING', '--diff',
+               'summary'],
+    'clone': ['--clone_jobs', '--find_replace_jobname_pattern', 'bench-job-|bench-clone-', '--diff', 'summary'],
+    'grep_cached': ['--grep_jobs', '--grep_content_pattern', 'step [0-9]*7<', '--grep_count'],
+    'update_cached': ['--update_jobs', '--find_replace_content_pattern', 'echo building|echo BUILDING', '--diff',
+                      'summary'],
+    'clone_cached': ['--clone_jobs', '--find_replace_jobname_pattern', 'bench-job-|bench-clone-', '--diff',
+                     'summary'],
+    # with workers a job that fails does not stop the run, as it does in serial mode
+    'retry': ['--clone_jobs', '--find_replace_jobname_pattern', 'bench-job-|bench-retry-', '--retries', '5',
+              '--workers', '4'],
+}
+error_rates = {'retry': 0.1}  # share of requests the controller answers 503 in a scenario
+
+
+def check_retries(fake):
+    # what is wrong with the retries jenkins_cli.py made, None when nothing is; every request is
+    # 'METHOD path?query'
+    idempotent_posts = ('config.xml', 'enable', 'disable')
+    failed_gets = [request for request in fake.errors if request.startswith('GET ')]
+    failed_posts = [request for request in fake.errors if request.startswith('POST ') and
+                    not request.split('?')[0].endswith(idempotent_posts)]
+    if not failed_gets or not failed_posts:
+        return 'no GET or no post that is not idempotent was answered 503, try more --jobs'
+    not_retried = [request for request in failed_gets if fake.requests[request] <= fake.errors[request]]
+    if not_retried:
+        return '{} GETs answered 503 were not retried, e.g. {}'.format(len(not_retried), not_retried[0])
+    retried = [request for request in failed_posts if fake.requests[request] > 1]
+    if retried:
+        return '{} posts that are not idempotent were retried, e.g. {}'.format(len(retried), retried[0])
+    print('retry: {} GETs answered 503 were retried, {} posts that are not idempotent were not'.format(
+        len(failed_gets), len(failed_posts)))
+    return None
+
+
+# scenario => check of the controller's state after it, returning what went wrong or None.  jenkins_cli.py may
+# exit with an error in these, since some of their requests are meant to fail.
+checks = {'retry': check_retries}
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def run_scenario(name, args, env):
+    # (seconds, per call seconds, peak RSS KB, exit status, what its check found wrong) of one run of scenario name
+    fake = fake_jenkins.FakeJenkins(args.jobs, args.config_kb, args.latency, args.jitter, etags=args.etags,
+                                    error_rate=error_rates.get(name, args.error_rate), folders=args.folders)
+    server = fake_jenkins.start(fake)
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    cached = name.endswith('_cached')
+    # folders left there by an earlier run would hide a failure to make those of jobs in folders
+    for folder in glob.glob(os.path.join(workdir, 'bench-folder-*')):
+        shutil.rmtree(folder)
+    cmd = [sys.executable, cli, '--src_jenkins_url', url, '--jobname_regex', '(^|/)bench-job-', '--user', 'bench',
+           '--password', 'bench', '--workers', str(args.workers)] + scenarios[name]
+    if not cached:
+        cmd.append('--no_cache')
+    cmd += shlex.split(args.cli_args)
+    # in a scratch directory, since --fetch_jobs writes configs to the current one
+    with tempfile.TemporaryDirectory() as dir:
+        try:
+            if cached:
+                # fills the cache, unmeasured; its exit status counts like the measured run's
+                filled = subprocess.call(cmd, env=env, cwd=dir, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+                fake.reset_calls()
+            start = time.perf_counter()
+            proc = subprocess.Popen(cmd, env=env, cwd=dir, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=None if args.verbose else subprocess.DEVNULL)
+            # wait4() rather than wait() for the resource usage of this one child
+            (pid, status, usage) = os.wait4(proc.pid, 0)
+            seconds = time.perf_counter() - start
+            proc.returncode = (cached and filled) or os.waitstatus_to_exitcode(status)
+        finally:
+            server.shutdown()
+            server.server_close()
+    problem = checks[name](fake) if name in checks else None
+    return seconds, fake.latencies(), usage.ru_maxrss, proc.returncode, problem
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark jenkins_cli.py against a fake Jenkins controller')
+    parser.add_argument('--jobs', type=int, default=200, help='Number of jobs on the controller')
+    parser.add_argument('--config_kb', type=int, default=20, help='Size of each job config in KB')
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds the controller adds to every request')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many random seconds added on top')
+    parser.add_argument('--workers', type=int, default=1, help='Value of jenkins_cli.py --workers')
+    parser.add_argument('--etags', action='store_true',
+                        help='Have the controller send ETags for job configs, which stock Jenkins does not')
+    parser.add_argument('--error_rate', type=float, default=0,
+                        help='Share of requests, 0 to 1, the controller answers 503 in scenarios without their own')
+    parser.add_argument('--folders', type=int, default=2,
+                        help='Number of folders on the controller, holding every fourth job')
+    parser.add_argument('--runs', type=int, default=1, help='Runs of each scenario, the median run is reported')
+    parser.add_argument('--scenarios', default=','.join(scenarios),
+                        help='Comma separated scenarios out of ' + ', '.join(scenarios))
+    parser.add_argument('--cli_args', default='', help='Extra flags passed to jenkins_cli.py')
+    parser.add_argument('--save', help='Write results to this JSON file, to be used as --baseline later')
+    parser.add_argument('--baseline', help='Compare jobs/s against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help='Percent drop in jobs/s against --baseline counted as a regression')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show stderr of jenkins_cli.py')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)['results']
+
+    print('{} jobs, {} KB configs, {} s latency, {} workers'.format(args.jobs, args.config_kb, args.latency,
+                                                                      args.workers))
+    print('{:<14} {:>8} {:>9} {:>7} {:>9} {:>9} {:>10} {:>10}'.format(
+        'scenario', 'seconds', 'jobs/s', 'calls', 'p50 ms', 'p99 ms', 'RSS MB', 'baseline'))
+    results = {}
+    ok = True
+    for name in args.scenarios.split(','):
+        if name not in scenarios:
+            print('ERROR: unknown scenario {}'.format(name))
+            exit(1)
+        runs = sorted((run_scenario(name, args, env) for i in range(args.runs)), key=lambda run: run[0])
+        (seconds, latencies, rss, status, problem) = runs[len(runs) // 2]
+        if status and name not in checks:
+            print('ERROR: jenkins_cli.py exited with {} in scenario {}'.format(status, name))
+            ok = False
+        for run in runs:
+            if run[4]:
+                print('ERROR: {} in scenario {}'.format(run[4], name))
+                ok = False
+        result = {'seconds': seconds, 'jobs_per_second': args.jobs / seconds, 'calls': len(latencies),
+                  'p50_ms': percentile(latencies, 50) * 1000, 'p99_ms': percentile(latencies, 99) * 1000,
+                  'rss_mb': rss / 1024.0}
+        results[name] = result
+        compared = ''
+        if name in baseline:
+            change = (result['jobs_per_second'] / baseline[name]['jobs_per_second'] - 1) * 100
+            compared = '{:+.1f}%'.format(change)
+            if change < -args.tolerance:
+                compared += ' !'
+                ok = False
+        print('{:<14} {:>8.2f} {:>9.1f} {:>7} {:>9.1f} {:>9.1f} {:>10.1f} {:>10}'.format(
+            name, seconds, result['jobs_per_second'], result['calls'], result['p50_ms'], result['p99_ms'],
+            result['rss_mb'], compared))
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump({'settings': {'jobs': args.jobs, 'config_kb': args.config_kb, 'latency': args.latency,
+                                    'jitter': args.jitter, 'workers': args.workers, 'cli_args': args.cli_args,
+                                    'etags': args.etags, 'error_rate': args.error_rate},
+                       'results': results}, fh, indent=1, sort_keys=True)
+    if not ok:
+        print('FAIL: a scenario failed or is more than {}% slower than the baseline'.format(args.tolerance))
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
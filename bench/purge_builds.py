@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Generate a synthetic JENKINS_HOME and time BuildPurger on it: a dry run, a real purge and an incremental rerun,
+# checking that the newest build, "keep forever" builds and the lastStableBuild target survive, that the rerun
+# purges nothing and that a job created again under the same name is purged from build 1 again.
+#
+#   python3 bench/purge_builds.py [--jobs 200] [--builds 100] [--days 30]
+
+import os, sys
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.jmon_utils import BuildPurger
+
+
+keep_forever = 5  # build marked "keep this build forever" in every job
+last_stable = 10  # build lastStableBuild points to
+
+
+def make_job(job_dir, builds):
+    # builds of the job are one day apart, the newest one made half a day ago
+    now = time.time()
+    for b in range(1, builds + 1):
+        build_dir = os.path.join(job_dir, 'builds', str(b))
+        os.makedirs(os.path.join(build_dir, 'archive'))
+        for name in ('build.xml', 'log', 'changelog.xml', 'archive/artifact.txt'):
+            with open(os.path.join(build_dir, name), 'w') as fh:
+                fh.write('x' * 512)
+        if b == keep_forever:
+            with open(os.path.join(build_dir, 'build.xml'), 'w') as fh:
+                fh.write('<build><keepLog>true</keepLog></build>')
+        mtime = now - (builds - b) * 86400 - 43200
+        os.utime(os.path.join(build_dir, 'build.xml'), (mtime, mtime))
+    os.symlink(str(builds), os.path.join(job_dir, 'builds', 'lastSuccessfulBuild'))
+    if builds >= last_stable:
+        os.symlink(str(last_stable), os.path.join(job_dir, 'builds', 'lastStableBuild'))
+
+
+def make_jenkins_home(home, jobs, builds, folders):
+    dirs = []
+    for j in range(jobs):
+        folder = 'jobs/folder{}/'.format(j % folders) if folders else ''
+        dirs.append(os.path.join(home, folder, 'jobs', 'job{}'.format(j)))
+        make_job(dirs[-1], builds)
+    return dirs
+
+
+def check(ok, message):
+    if not ok:
+        print('ERROR: {}'.format(message))
+        exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark build purge on a synthetic JENKINS_HOME')
+    parser.add_argument('--jobs', type=int, default=200, help='Number of jobs')
+    parser.add_argument('--builds', type=int, default=100, help='Number of builds per job, one per day')
+    parser.add_argument('--folders', type=int, default=4, help='Number of folders jobs are spread across')
+    parser.add_argument('--days', type=float, default=30, help='Purge builds older than this many days')
+    parser.add_argument('--workers', type=int, default=8, help='Number of workers')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='jenkins_home.')
+    state_file = os.path.join(home, 'purge_state.json')
+    try:
+        start = time.time()
+        job_dirs = make_jenkins_home(home, args.jobs, args.builds, args.folders)
+        print('Generated {} jobs x {} builds in {:.1f}s'.format(args.jobs, args.builds, time.time() - start))
+        # builds 1..old are older than --days, except the newest which is always kept
+        old = max(0, min(args.builds - 1, args.builds - int(args.days)))
+        kept = [b for b in (keep_forever, last_stable) if b <= old]
+        expected = args.jobs * (old - len(kept))
+
+        def purge(title, dryrun=False):
+            purger = BuildPurger(home, args.days, state_file=state_file, workers=args.workers, dryrun=dryrun)
+            start = time.time()
+            totals = purger.run()
+            print('{}: {:.2f}s, {} builds'.format(title, time.time() - start, totals['builds']))
+            return totals['builds']
+
+        check(purge('Dry run', True) == expected, 'Expected {} builds in the dry run'.format(expected))
+        check(purge('Purge') == expected, 'Expected {} builds purged'.format(expected))
+        for job_dir in job_dirs:
+            left = sorted(int(name) for name in os.listdir(os.path.join(job_dir, 'builds')) if name.isdigit())
+            check(left == kept + list(range(old + 1, args.builds + 1)),
+                  '{} kept builds {}, expected the newest, keep forever and lastStableBuild ones'.format(job_dir,
+                                                                                                        left))
+        check(purge('Incremental rerun') == 0, 'Expected nothing purged by the incremental rerun')
+
+        # the first job created again with 3 old builds, the second one deleted
+        shutil.rmtree(job_dirs[0])
+        make_job(job_dirs[0], 3)
+        shutil.rmtree(job_dirs[1])
+        expected = len([b for b in (1, 2) if 3 - b + 0.5 > args.days])
+        check(purge('Recreated job') == expected, 'Expected {} builds of the recreated job purged'.format(expected))
+        with open(state_file) as fh:
+            state = json.load(fh)
+        check(os.path.relpath(job_dirs[1], home) not in state, 'State of the deleted job was kept')
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Startup benchmark: time for bin/jenkins_cli.py to reach argument validation (no action flag given, so it stops
+# there without touching the network), for 'import lib' and for 'from lib import *', over a bare interpreter.  The
+# slowest imports of each are listed from -X importtime.
+#
+#   python3 bench/startup.py [--runs 10] [--target_ms 100]
+
+import os, sys
+import argparse
+import statistics
+import subprocess
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+cli = os.path.join(root, 'bin', 'jenkins_cli.py')
+
+cases = [
+    ('python3 -c pass', [sys.executable, '-c', 'pass']),
+    ('jenkins_cli.py argument validation', [sys.executable, cli, '--src_jenkins_url', 'http://localhost/',
+                                            '--jobname_regex', '.']),
+    ('import lib', [sys.executable, '-c', 'import lib']),
+    ('from lib import *', [sys.executable, '-c', 'from lib import *']),
+]
+
+
+def run(cmd, env):
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def slowest_imports(cmd, env, count):
+    # (cumulative us, module) of top level imports of cmd, leaving out interpreter startup ('site')
+    proc = subprocess.run([cmd[0], '-X', 'importtime'] + cmd[1:], env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in proc.stderr.split('\n'):
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (self_us, cumulative, module) = line[len('import time:'):].split('|')
+        # nested imports are indented, only count the top level ones
+        if not module.startswith('  ') and module.strip() != 'site':
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark startup time of jenkins_cli and lib')
+    parser.add_argument('--runs', type=int, default=10, help='Number of runs of each case')
+    parser.add_argument('--target_ms', type=float, default=100,
+                        help='Most milliseconds each case may add over a bare interpreter')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest imports listed')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+
+    medians = []
+    for (name, cmd) in cases:
+        times = [run(cmd, env) for i in range(args.runs)]
+        medians.append(statistics.median(times))
+    baseline = medians[0]
+    print('{:<40} {:>10} {:>10}'.format('', 'median ms', 'added ms'))
+    ok = True
+    for ((name, cmd), median) in zip(cases, medians):
+        added = median - baseline
+        print('{:<40} {:>10.1f} {:>10.1f}'.format(name, median, added))
+        if cmd is not cases[0][1] and added > args.target_ms:
+            ok = False
+    for (name, cmd) in cases[1:]:
+        print('Slowest imports of {}:'.format(name))
+        for (cumulative, module) in slowest_imports(cmd, env, args.top):
+            print('  {:>8.1f} ms  {}'.format(cumulative / 1000.0, module))
+
+    if not ok:
+        print('FAIL: startup adds more than {} ms'.format(args.target_ms))
+        exit(1)
+    print('OK: startup adds less than {} ms'.format(args.target_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Benchmark of the incremental static export (lib/static_export.py) on a generated site: the first export, a
+# re-export with nothing changed and one with --change_pct of the files changed, against copying the whole tree
+# the way a plain export does.
+#
+#   python3 bench/static_export.py [--files 5000] [--file_kb 20] [--change_pct 1] [--dir /tmp/static_export_bench]
+
+import os, sys
+import argparse
+import random
+import shutil
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.static_export import StaticExport
+
+extensions = ('.html', '.js', '.css', '.json', '.png', '.jpg')
+
+
+def make_site(dir, files, file_kb):
+    random.seed(1)
+    names = []
+    for i in range(files):
+        name = os.path.join(dir, 'section{:02d}'.format(i % 50), 'page{:05d}{}'.format(i, extensions[i % 6]))
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        write(name, file_kb)
+        names.append(name)
+    return names
+
+
+def write(name, file_kb):
+    if name.endswith(('.png', '.jpg')):
+        data = os.urandom(file_kb * 1024)
+    else:
+        words = ['<div class="item">', 'lorem', 'ipsum', 'dolor', '{}'.format(random.random()), '</div>\n']
+        data = ' '.join(random.choice(words) for i in range(file_kb * 160)).encode('utf-8')
+    with open(name, 'wb') as fh:
+        fh.write(data)
+
+
+def timed(label, function):
+    start = time.perf_counter()
+    result = function()
+    print('{:<28} {:>8.2f} s'.format(label, time.perf_counter() - start))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--file_kb', type=int, default=20)
+    parser.add_argument('--change_pct', type=float, default=1)
+    parser.add_argument('--dir', default='/tmp/static_export_bench')
+    args = parser.parse_args()
+
+    shutil.rmtree(args.dir, ignore_errors=True)
+    source = os.path.join(args.dir, 'build')
+    dest = os.path.join(args.dir, 'site')
+    names = make_site(source, args.files, args.file_kb)
+    print('{} files, {:.0f} MB'.format(args.files, args.files * args.file_kb / 1024.0))
+
+    timed('copy whole tree', lambda: shutil.copytree(source, os.path.join(args.dir, 'copy')))
+    export = StaticExport(source, dest)
+    timed('first export', export.run)
+    timed('re-export, no change', export.run)
+    changed = random.sample(names, max(1, int(len(names) * args.change_pct / 100)))
+    for name in changed:
+        write(name, args.file_kb)
+    diff = timed('re-export, {} changed'.format(len(changed)), export.run)
+    print('diff: {} added, {} changed, {} removed'.format(len(diff['added']), len(diff['changed']),
+                                                         len(diff['removed'])))
+    shutil.rmtree(args.dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
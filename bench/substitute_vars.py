@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Micro-benchmark of job config property substitution: the original one re.sub() per property
+# against the compiled single-pass Substituter in bin/jenkins_cli.py.
+#
+#   python3 bench/substitute_vars.py [--properties 60] [--config_kb 500] [--jobs 20]
+
+import re, os, sys
+import argparse
+import time
+
+# the repo root for lib, which bin/jenkins_cli.py imports, and bin for jenkins_cli itself
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+import jenkins_cli
+
+
+def substitute_vars_re(string, properties):
+    # substitute_vars() as it was before the Substituter, kept here as the reference implementation
+    for var in properties:
+        val = properties[var]
+        if var == 'IMPORT_TO_BRANCH_VALUE':
+            val = re.sub(',', ' ', val)
+            vals = re.split(r'\s+', val)
+            if len(vals) > 1:
+                val = vals[0] + '</string>'
+                for val2 in vals[1:]:
+                    if not re.match('.+string>$', val):
+                        val = val + '</string>'
+                    val = val + '\n<string>{}'.format(val2)
+        string = re.sub(var, val, string)
+    return string
+
+
+def make_properties(count):
+    properties = {'IMPORT_TO_BRANCH_VALUE': 'develop,release main'}
+    for i in range(count - 1):
+        properties['PROJECT_VAR_{:03d}'.format(i)] = 'value_{}'.format(i)
+    return properties
+
+
+def make_config(size_kb, properties):
+    names = list(properties)
+    chunks = ['<?xml version="1.1" encoding="UTF-8"?>\n<project>\n']
+    size = 0
+    i = 0
+    while size < size_kb * 1024:
+        # roughly one property reference every 20 lines, like a real job config
+        if i % 20:
+            chunk = '    <hudson.plugins.git.BranchSpec><name>*/master</name></hudson.plugins.git.BranchSpec>\n'
+        else:
+            chunk = '  <hudson.tasks.Shell><command>echo {} step {}</command></hudson.tasks.Shell>\n'.format(
+                names[(i // 20) % len(names)], i)
+        chunks.append(chunk)
+        size += len(chunk)
+        i += 1
+    chunks.append('  <strings><string>IMPORT_TO_BRANCH_VALUE</string></strings>\n</project>\n')
+    return ''.join(chunks)
+
+
+def timeit(func, configs):
+    start = time.perf_counter()
+    results = [func(config) for config in configs]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark job config property substitution')
+    parser.add_argument('--properties', type=int, default=60, help='Number of properties')
+    parser.add_argument('--config_kb', type=int, default=500, help='Size of each job config in KB')
+    parser.add_argument('--jobs', type=int, default=20, help='Number of job configs')
+    args = parser.parse_args()
+
+    properties = make_properties(args.properties)
+    configs = [make_config(args.config_kb, properties) for i in range(args.jobs)]
+    print('{} jobs, {} KB configs, {} properties'.format(args.jobs, args.config_kb, args.properties))
+
+    old_time, old = timeit(lambda config: substitute_vars_re(config, properties), configs)
+    substituter = jenkins_cli.Substituter(properties)
+    new_time, new = timeit(substituter.substitute, configs)
+    if old != new:
+        print('ERROR: Substituter output differs from re.sub() per property')
+        exit(1)
+
+    print('re.sub per property: {:8.3f}s  {:8.1f} jobs/s'.format(old_time, args.jobs / old_time))
+    print('Substituter:         {:8.3f}s  {:8.1f} jobs/s'.format(new_time, args.jobs / new_time))
+    print('Speedup:             {:8.1f}x'.format(old_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,20 @@
 # https://media.readthedocs.org/pdf/python-jenkins/latest/python-jenkins.pdf
 
 import re, os, sys
-import jenkins
 import argparse
 import subprocess
 import datetime
 import shutil
+import threading
+import hashlib
+import json
+import mmap
+import difflib
+import time
+import urllib.parse
+import contextlib
+
+from lib import profiler
 
 # globals
 script = 'jenkins_cli'
@@ -18,8 +27,13 @@ def parse_args():
     parser.add_argument('-q', '--quiet', help="Reduce verbosity of screen output", action="store_true")
     parser.add_argument('--property_file',
                         help='The file that has project properties to be substituted into job configurations')
-    parser.add_argument('--src_jenkins_url',
-                        required=True, help='Jenkins URL of source jobs')
+    parser.add_argument('--src_jenkins_url', nargs='+',
+                        required=True, help='Jenkins URL of source jobs.  More than one URL (separated by spaces '
+                                            'or commas), or a file listing one URL per line, runs the action on '
+                                            'all of these controllers concurrently, see --max_controllers.')
+    parser.add_argument('--max_controllers', type=int, default=8,
+                        help='Number of controllers processed at once when --src_jenkins_url lists more than '
+                             'one.  --workers and --rate_limit still apply to each controller.  Default is 8.')
     parser.add_argument('--dest_jenkins_url',
                         help='Jenkins URL of destination jobs.  If not specified, default value is set to '
                              'that of --src_jenkins_url.')
@@ -27,20 +41,54 @@ def parse_args():
     parser.add_argument('--show_jobs', action='store_true', help='Show jobs matching --jobname_regex')
     parser.add_argument('--update_jobs', action='store_true',
                         help='If specified, source jobs are updated in place with config content changed '
-                             'based on --find_replace_content_pattern.')
+                             'based on --find_replace_content_pattern and/or --transform_file.')
     parser.add_argument('--find_replace_content_pattern',
-                        help='Required with --update_jobs to modify job config content per <find|replace> regex.')
+                        help='Modify text and attribute values of job configs per <find|replace> regex with '
+                             '--update_jobs/--clone_jobs.  A pattern containing < or > is applied to the raw '
+                             'config text instead, so it can match tags.')
+    parser.add_argument('--transform_file', '--transform-file', metavar='FILE',
+                        help='JSON list of config transforms (substitute, set, replace and expand by XPath, see '
+                             'lib/config_transform.py) applied with --update_jobs/--clone_jobs after property '
+                             'substitution and --find_replace_content_pattern.')
     parser.add_argument('--disable_jobs', action='store_true', help='Disable jobs matching --jobname_regex')
     parser.add_argument('--enable_jobs', action='store_true', help='Enable jobs matching --jobname_regex')
     parser.add_argument('--delete_jobs', action='store_true', help='Delete jobs matching --jobname_regex')
     parser.add_argument('--build_jobs', action='store_true',
-                        help='Run jobs matching --jobname_regex.  Still WIP - not fully implement yet.')
+                        help='Build jobs matching --jobname_regex, passing parameters the jobs define with their '
+                             'values from --property_file, and wait for the results.  Builds are started as '
+                             'the controller has room for them, see --max_builds.  Prints a table of results and '
+                             'exits with 1 if any build did not succeed.')
+    parser.add_argument('--max_builds', '--max-builds', type=int, default=0,
+                        help='With --build_jobs, most builds queued or running at a time, and most items in the '
+                             'controller\'s queue for another build to start.  Default is 0: the number of '
+                             'executors of the controller.')
+    parser.add_argument('--poll_interval', '--poll-interval', type=float, default=2,
+                        help='With --build_jobs, seconds between checks of the queue and builds, doubling up to '
+                             '30 s while nothing changes.  Default is 2.')
+    parser.add_argument('--build_timeout', '--build-timeout', type=float, default=0,
+                        help='With --build_jobs, seconds a build may take from being triggered before it counts '
+                             'as failed (it is left running).  Default is 0 (no limit).')
     parser.add_argument('--fetch_jobs', action='store_true',
                         help='Download xml configs of jobs matching --jobname_regex to current directory.')
+    parser.add_argument('--export_archive', '--export-archive', metavar='FILE',
+                        help='Write configs of jobs matching --jobname_regex, and of views matching it (or the '
+                             'template views with --from_template), to a tar archive compressed per its '
+                             'extension (.tar.gz, .tar.xz, .tar.bz2, .tar.zst) with a manifest of names, hashes '
+                             'and enabled state.')
+    parser.add_argument('--import_archive', '--import-archive', metavar='FILE',
+                        help='Create or update views, and jobs matching --jobname_regex, from an '
+                             '--export_archive archive on --dest_jenkins_url (default --src_jenkins_url).')
     parser.add_argument('--grep_jobs', action='store_true',
                         help='Grep jobs for given pattern per --grep_content_pattern')
     parser.add_argument('--grep_content_pattern',
-                        help='Required with --grep_jobs to find a pattern in job config content per <pattern>')
+                        help='Required with --grep_jobs to find a pattern in job config content per <pattern> '
+                             '(Python regex)')
+    parser.add_argument('--grep_context', type=int, default=0,
+                        help='Number of lines of context shown around each --grep_jobs match')
+    parser.add_argument('--grep_count', action='store_true',
+                        help='Only show the number of matching lines of each job with --grep_jobs')
+    parser.add_argument('--json', action='store_true',
+                        help='Print --grep_jobs results as JSON on stdout; everything else goes to stderr')
     parser.add_argument('--clone_jobs', action='store_true',
                         help='If specified, source jobs are cloned.  New jobs are named based on either --from_'
                              'template flag or --find_replace_jobname_pattern <find|replace>.')
@@ -53,11 +101,54 @@ def parse_args():
                         help='If specified, source jobs are from standard template with naming format'
                              ' <PROJECT_TYPE>-<PROJECT_NAME>-<...>.  During job creation, PROJECT_TYPE is dropped '
                              'and PROJECT_NAME is replaced by its value defined in property file')
+    parser.add_argument('--diff', choices=['full', 'count', 'summary'], default='full',
+                        help='How config changes are shown with --update_jobs/--clone_jobs: full unified diff '
+                             '(default), changed line counts per job, or only the summary at the end.  '
+                             '--quiet shows only the summary.')
     parser.add_argument('--dryrun', action='store_true',
                         help="Show what would be done but do not create/update actual jobs")
     parser.add_argument('--prompt', action='store_true',
                         help="Prompt continue prior to taking action.  Useful for deleting jobs one by one"
                              " instead of all at once.")
+    parser.add_argument('--resume', action='store_true',
+                        help='Carry on from an earlier run of the same command that stopped part way: jobs it '
+                             'finished are skipped and the failed ones retried.  Every run keeps a journal of '
+                             'finished jobs under {}/journal for this.'.format(workdir))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of jobs to process concurrently.  Output of each job is still printed in '
+                             'order once the job is done.  Default is 1 (one job at a time).')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='Process jobs on one thread with the asyncio Jenkins client instead of --workers '
+                             'threads, for runs over thousands of jobs.  Output is still printed job by job.')
+    parser.add_argument('--max_inflight', '--max-inflight', type=int, default=100,
+                        help='With --asyncio, most jobs (and requests to each Jenkins instance) in flight at a '
+                             'time.  Default is 100.')
+    parser.add_argument('--cache_ttl', '--cache-ttl', type=int, default=300,
+                        help='Seconds a job config saved under {}/cache stays valid without asking Jenkins again.  '
+                             'Only used by actions that do not write jobs back (--grep_jobs, --fetch_jobs, '
+                             '--dryrun).  Stock Jenkins sends no ETag or Last-Modified for config.xml, so past '
+                             'this age a config is downloaded again in full; 0 always downloads.  Default is '
+                             '300.'.format(workdir))
+    parser.add_argument('--no_cache', '--no-cache', action='store_true',
+                        help='Always download job configs instead of using the local config cache')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Seconds to wait for Jenkins to connect or respond.  Default is 30.')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Times a read-only request is retried with backoff after a connection error or '
+                             'a 502/503/504 from Jenkins.  Default is 3.')
+    parser.add_argument('--rate_limit', type=float, default=0,
+                        help='Most requests per second sent to each Jenkins instance.  Default is 0 (no limit).')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Show calls, errors, retries, time and bytes per Jenkins endpoint at the end')
+    parser.add_argument('--profile', nargs='?', const=workdir + '/profile.json', metavar='FILE',
+                        help='Time each phase of the run and every Jenkins call, subprocess, config transform '
+                             'and diff in it.  At the end the slowest operations are shown and a JSON report '
+                             'is written to FILE, by default {}/profile.json.'.format(workdir))
+    parser.add_argument('--profile_top', '--profile-top', type=int, default=20,
+                        help='Number of slowest operations shown by --profile.  Default is 20.')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='Write cProfile stats of the loop over jobs to FILE, for python -m pstats FILE.  Only '
+                             'covers the main thread: use it with --workers 1 or --asyncio.')
     parser.add_argument('--user',
                         help='Login username.  If not specified at command line, you will be asked to enter '
                              'it in during runtime.')
@@ -78,23 +169,39 @@ def parse_args():
 
     if not (args.clone_jobs or args.update_jobs or args.disable_jobs or args.enable_jobs
             or args.build_jobs or args.delete_jobs or args.show_jobs or args.grep_jobs
-            or args.rename_jobs or args.fetch_jobs):
+            or args.rename_jobs or args.fetch_jobs or args.export_archive or args.import_archive):
         print(
             "Missing one of these action flags: --clone_jobs, --update_jobs, --disable_jobs, "
             "--enable_jobs, --build_jobs, --delete_jobs, --rename_jobs, --show_jobs, --grep_jobs,"
-            "--fetch_jobs")
+            "--fetch_jobs, --export_archive, --import_archive")
+        exit(0)
+    if args.export_archive and args.import_archive:
+        print("Flags --export_archive and --import_archive are mutually exclusively.  Please specify only one.")
+        exit(0)
+    if args.import_archive and not os.path.isfile(args.import_archive):
+        print("Archive {} does not exist".format(args.import_archive))
         exit(0)
 
     if args.grep_jobs and not args.grep_content_pattern:
         print("Flag --grep_jobs requires --grep_content_pattern <pattern>")
         exit(0)
+    if args.grep_content_pattern:
+        try:
+            re.compile(args.grep_content_pattern)
+        except re.error as e:
+            print("Value of --grep_content_pattern is not a valid regex: {}".format(e))
+            exit(0)
 
     if args.clone_jobs and args.update_jobs:
         print("Flags --clone_jobs and --update_jobs are mutually exclusively.  Please specify only one.")
         exit(0)
 
-    if args.update_jobs and not args.find_replace_content_pattern:
-        print("Flag --update_jobs requires --find_replace_content_pattern <some_python_substituation_regex>")
+    if args.update_jobs and not (args.find_replace_content_pattern or args.transform_file):
+        print("Flag --update_jobs requires --find_replace_content_pattern <some_python_substituation_regex> "
+              "or --transform_file <file>")
+        exit(0)
+    if args.transform_file and not os.path.isfile(args.transform_file):
+        print("Transform file {} does not exist".format(args.transform_file))
         exit(0)
     if args.clone_jobs and not (args.from_template or args.find_replace_jobname_pattern or args.dest_jenkins_url):
         print(
@@ -113,10 +220,81 @@ def parse_args():
     if args.from_template and not args.property_file:
         print("Flag --from_template requires --property_file")
         exit(0)
+    if args.cache_ttl < 0:
+        print("Value of --cache_ttl should be 0 or more")
+        exit(0)
+    if args.timeout <= 0:
+        print("Value of --timeout should be more than 0")
+        exit(0)
+    if args.retries < 0 or args.rate_limit < 0:
+        print("Values of --retries and --rate_limit should be 0 or more")
+        exit(0)
+    if args.workers < 1:
+        print("Value of --workers should be 1 or more")
+        exit(0)
+    args.controllers = controller_urls(args.src_jenkins_url)
+    if not args.controllers:
+        print("No Jenkins URL found in --src_jenkins_url {}".format(' '.join(args.src_jenkins_url)))
+        exit(0)
+    if len(args.controllers) > 1:
+        if args.max_controllers < 1:
+            print("Value of --max_controllers should be 1 or more")
+            exit(0)
+        if args.dest_jenkins_url:
+            print("Flag --dest_jenkins_url only works with a single --src_jenkins_url")
+            exit(0)
+        if args.prompt:
+            print("Flag --prompt only works with a single --src_jenkins_url")
+            exit(0)
+        if args.cprofile:
+            print("Flag --cprofile only works with a single --src_jenkins_url")
+            exit(0)
+    if args.resume and (args.show_jobs or args.grep_jobs or args.export_archive):
+        print("Flag --resume does not work with --show_jobs, --grep_jobs or --export_archive")
+        exit(0)
+    if args.profile_top < 1:
+        print("Value of --profile_top should be 1 or more")
+        exit(0)
+    if args.max_inflight < 1:
+        print("Value of --max_inflight should be 1 or more")
+        exit(0)
+    if args.max_builds < 0 or args.poll_interval <= 0 or args.build_timeout < 0:
+        print("Values of --max_builds and --build_timeout should be 0 or more, --poll_interval more than 0")
+        exit(0)
+    if args.workers > 1 and args.prompt:
+        print("Note: --prompt confirms jobs one by one, ignoring --workers {}".format(args.workers))
+        args.workers = 1
     return args
 
 
-def create_server_instances(args):
+def controller_urls(values):
+    # Jenkins URLs out of --src_jenkins_url values, each a URL, comma separated URLs or a file of URLs
+    urls = []
+    for value in values:
+        if os.path.isfile(value):
+            lines = [line.split('#', 1)[0].strip() for line in open(value, 'r')]
+        else:
+            lines = value.split(',')
+        for url in lines:
+            url = url.strip()
+            if url and url not in urls:
+                urls.append(url)
+    return urls
+
+
+def controller_name(url):
+    # host[:port][/path] of a controller URL, used to label its output and name its work directory
+    parts = urllib.parse.urlsplit(url)
+    return (parts.netloc + parts.path.rstrip('/')) or url
+
+
+def transport_options(args):
+    return {'timeout': args.timeout, 'retries': args.retries, 'rate': args.rate_limit,
+            'pool_size': max(10, args.workers)}
+
+
+def read_credentials(args):
+    # (user, password) from ~/.jenkins_cli, the command line or a prompt, read once for all controllers
     uname = args.user
     pw = args.password
     pwfile = os.environ['HOME'] + '/.' + script
@@ -136,10 +314,17 @@ def create_server_instances(args):
         uname = input("Login name: ")
     if not pw:
         pw = input("Login password: ")
+    return uname, pw
+
 
-    url = args.src_jenkins_url
+def create_server_instances(args, url, credentials):
+    # imported here rather than at the top: jenkins (and requests, which it pulls in) take longer to import
+    # than everything else put together and are only needed once an action talks to Jenkins
+    from lib.jenkins_transport import JenkinsTransport
+
+    (uname, pw) = credentials
     print("Creating source Jenkins instance {}".format(url))
-    server_src = jenkins.Jenkins(url, uname, pw)
+    server_src = JenkinsTransport(url, uname, pw, **transport_options(args))
     if not server_src:
         print("ERROR: Failed creating source Jenkins instance {}".format(url))
         exit(1)
@@ -147,7 +332,7 @@ def create_server_instances(args):
     if not url_dest:
         return server_src, server_src
     print("Creating destination Jenkins instance {}".format(url_dest))
-    server_dest = jenkins.Jenkins(url_dest, uname, pw)
+    server_dest = JenkinsTransport(url_dest, uname, pw, **transport_options(args))
     if not server_dest:
         print("ERROR: Failed creating destination Jenkins instance {}".format(url_dest))
         exit(1)
@@ -166,23 +351,87 @@ def read_property_file(file):
     return properties
 
 
+def expand_property(var, val):
+    # special handling for IMPORT_TO_BRANCH_VALUES
+    if var == 'IMPORT_TO_BRANCH_VALUE':
+        val = re.sub(',', ' ', val)
+        vals = re.split('\s+', val)
+        # if there is more than one values, do special handling
+        # ie. puttng each val into its own xml 'string' element
+        if len(vals) > 1:
+            val = vals[0] + '</string>'
+            for val2 in vals[1:]:
+                if not re.match('.+string>$', val):
+                    val = val + '</string>'
+                val = val + '\n<string>{}'.format(val2)
+    return val
+
+
+class Substituter:
+    # all property names compiled into one regex so a config is rewritten in a single pass.  Names are
+    # matched literally, longest first, so PROJECT_ID never matches inside PROJECT_ID_2.  Build it once
+    # per run and reuse it for every job config and job name.  expand=False leaves IMPORT_TO_BRANCH_VALUE as
+    # it is, for config_transform() which expands it into <string> elements itself.
+    def __init__(self, properties, expand=True):
+        self.values = {}
+        for var in properties:
+            self.values[var] = expand_property(var, properties[var]) if expand else properties[var]
+        self.pattern = None
+        if self.values:
+            names = sorted(self.values, key=len, reverse=True)
+            self.pattern = re.compile('|'.join(re.escape(name) for name in names))
+
+    def replace(self, match):
+        return self.values[match.group(0)]
+
+    def substitute(self, string):
+        if not self.pattern:
+            return string
+        return self.pattern.sub(self.replace, string)
+
+
 def substitute_vars(string, properties):
-    for var in properties:
-        val = properties[var]
-        # special handling for IMPORT_TO_BRANCH_VALUES
-        if var == 'IMPORT_TO_BRANCH_VALUE':
-            val = re.sub(',', ' ', val)
-            vals = re.split('\s+', val)
-            # if there is more than one values, do special handling
-            # ie. puttng each val into its own xml 'string' element
-            if len(vals) > 1:
-                val = vals[0] + '</string>'
-                for val2 in vals[1:]:
-                    if not re.match('.+string>$', val):
-                        val = val + '</string>'
-                    val = val + '\n<string>{}'.format(val2)
-        string = re.sub(var, val, string)
-    return string
+    return Substituter(properties).substitute(string)
+
+
+def config_transform(args, properties, tname=None):
+    # property substitution, --find_replace_content_pattern, --transform_file and, for template clones, removal
+    # of the project type as one pipeline, applied to each job config with a single parse
+    from lib.config_transform import ConfigTransform, Expand, Substitute, load_operations
+
+    transform = ConfigTransform()
+    branches = properties.get('IMPORT_TO_BRANCH_VALUE')
+    if branches:
+        # each branch into a <string> element of its own
+        transform.add(Expand('.//string', 'IMPORT_TO_BRANCH_VALUE', branches))
+    substituter = Substituter(properties, expand=False)
+    if substituter.pattern:
+        transform.add(Substitute(substituter.pattern, substituter.replace))
+    if args.find_replace_content_pattern:
+        (find, replace) = args.find_replace_content_pattern.split('|', 1)
+        transform.add(Substitute(find, replace, markup=re.search('[<>]', find) is not None))
+    if args.transform_file:
+        for operation in load_operations(args.transform_file):
+            transform.add(operation)
+    if tname and args.clone_jobs:
+        # get rid of any reference to project type from config
+        transform.add(Substitute(tname + '-', ''))
+    return transform
+
+
+# whitespace between two tags; CDATA sections, comments and elements holding only whitespace are matched first
+# and kept as they are, since that is text content
+between_tags = re.compile('(<!\\[CDATA\\[.*?\\]\\]>|<!--.*?-->|<([\\w.:-]+)(?:\\s[^>]*)?(?<!/)>\\s+</\\2\\s*>)|'
+                          '>\\s+(?=<)', re.S)
+
+
+def config_hash(config):
+    # sha1 of a job config with the differences Jenkins introduces when it saves a config posted to it taken
+    # out: the xml declaration, line endings and whitespace between elements.  Text content counts as it is.
+    config = re.sub('^\\s*<\\?xml[^>]*\\?>', '', config)
+    config = config.replace('\r\n', '\n').replace('\r', '\n')
+    config = between_tags.sub(lambda m: m.group(1) or '>', config)
+    return hashlib.sha1(config.strip().encode('utf-8')).hexdigest()
 
 
 def prompt_continue():
@@ -190,22 +439,94 @@ def prompt_continue():
     return True
 
 
-def is_job_disabled(job, job_list):
-    for ejob in job_list:
-        if ejob['name'] == job:
-            if ejob['color'] == 'disabled':
-                return True
-            else:
-                return False
-    print('ERROR: {} does not exist'.format(job))
-    return False
+class JobInventory:
+    # every job and folder of a Jenkins instance listed once with a minimal tree query and indexed by full
+    # name (folder/job), so exists/disabled lookups need no further requests.  Kept up to date as the run
+    # creates, renames, enables, disables and deletes jobs.
+    tree_depth = 5  # folder levels fetched per request
+
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.index = {}
+        self.url = server.server
+        self.load()
+
+    def tree(self):
+        # innermost level lists bare items, which tells deeper folders apart from empty ones
+        tree = 'jobs'
+        for i in range(self.tree_depth):
+            tree = 'jobs[name,color,{}]'.format(tree)
+        return '?tree=' + tree
+
+    def load(self):
+        info = self.server.get_info(query=self.tree() + ',primaryView[url]')
+        if info.get('primaryView'):
+            self.url = info['primaryView']['url']
+        self.index = {}
+        self.add_items('', info.get('jobs', []))
+
+    def add_items(self, folder, items):
+        if any('name' not in item for item in items):
+            # folder is deeper than the last tree query reached, list it on its own
+            info = self.server.get_info(item='job/' + '/job/'.join(folder.rstrip('/').split('/')),
+                                        query=self.tree())
+            items = info.get('jobs', [])
+        for item in items:
+            name = folder + item['name']
+            is_folder = 'jobs' in item
+            self.index[name] = {'color': item.get('color'), 'folder': is_folder}
+            if is_folder:
+                self.add_items(name + '/', item['jobs'])
+
+    def jobs(self):
+        with self.lock:
+            return [name for name, entry in self.index.items() if not entry['folder']]
+
+    def exists(self, job):
+        with self.lock:
+            return job in self.index
+
+    def is_disabled(self, job):
+        with self.lock:
+            entry = self.index.get(job)
+        if entry is None:
+            print('ERROR: {} does not exist'.format(job))
+            return False
+        return entry['color'] == 'disabled'
+
+    def add(self, job, disabled=False):
+        with self.lock:
+            self.index[job] = {'color': 'disabled' if disabled else 'notbuilt', 'folder': False}
+
+    def remove(self, job):
+        with self.lock:
+            self.index.pop(job, None)
+
+    def rename(self, job, job2):
+        with self.lock:
+            entry = self.index.pop(job, None)
+            if entry:
+                self.index[job2] = entry
+
+    def set_disabled(self, job, disabled):
+        with self.lock:
+            entry = self.index.get(job)
+            if entry:
+                # keep the build status color of an enabled job, it only matters whether it is 'disabled'
+                if disabled:
+                    entry['color'] = 'disabled'
+                elif entry['color'] == 'disabled':
+                    entry['color'] = 'notbuilt'
 
 
 def run_cmd(cmd):
     timestamp = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now())
     print("%s: %s" % (timestamp, cmd))
+    start = time.monotonic()
     proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     (out, err) = proc.communicate()
+    profiler.record('subprocess', cmd, time.monotonic() - start, len(out) + len(err), cmd.split(' ', 1)[0])
     if out:
         out = str(out, 'utf-8').rstrip('\n')
         print(out)
@@ -215,46 +536,1090 @@ def run_cmd(cmd):
     return proc.returncode
 
 
-def main():
-    # first parse arguments
-    args = parse_args()
+class JobConfigCache:
+    # job configs saved as <workdir>/cache/<controller>/<job>.xml, with an index of when each one was fetched,
+    # its sha1 and any validators (ETag/Last-Modified) Jenkins sent along for conditional requests.  Controllers
+    # with jobs of the same name each keep their own copy.
+    index_version = 2
 
+    def __init__(self, dir, ttl=0):
+        self.dir = dir
+        self.ttl = ttl
+        self.index_file = dir + '/' + 'cache_index.json'
+        self.index = {}  # controller URL => job => entry
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'not_modified': 0, 'fetched': 0}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as fh:
+                data = json.load(fh)
+        except ValueError:
+            print('Note: Ignoring corrupt cache index {}'.format(self.index_file))
+            return
+        if data.get('version') == self.index_version:
+            self.index = data.get('jobs', {})
+
+    def save(self):
+        from lib.utils import write_json
+
+        with self.lock:
+            write_json(self.index_file, {'version': self.index_version, 'jobs': self.index})
+
+    def file(self, server, job):
+        return self.dir + '/cache/' + re.sub('[^\\w.-]+', '_', controller_name(server.server)) + '/' + job + '.xml'
+
+    def read(self, server, job, entry):
+        # cached config, or None if the file is gone or was changed behind our back
+        try:
+            with open(self.file(server, job), 'r') as fh:
+                config = fh.read()
+        except (IOError, OSError):
+            return None
+        if hashlib.sha1(config.encode('utf-8')).hexdigest() != entry.get('sha1'):
+            return None
+        return config
+
+    def get_job_config(self, server, job, use_ttl=False):
+        return run_steps(self.job_config_steps(server, job, use_ttl))
+
+    def job_config_steps(self, server, job, use_ttl=False):
+        # get_job_config() as steps for job_steps(), yielding the one Jenkins call it needs, if any
+        with self.lock:
+            entry = self.index.get(server.server, {}).get(job)
+        config = None
+        if entry:
+            config = self.read(server, job, entry)
+        if config is not None and use_ttl and time.time() - entry['fetched'] < self.ttl:
+            self.count('hit')
+            return config
+
+        headers = {}
+        if config is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        (status, fetched, response_headers) = yield call(server, 'fetch_job_config', job, headers)
+        if status == 304 and config is not None:
+            self.count('not_modified')
+        else:
+            self.count('fetched')
+            config = fetched
+            # jobs inside folders are saved in matching sub-directories
+            os.makedirs(os.path.dirname(self.file(server, job)), exist_ok=True)
+            with open(self.file(server, job), 'w') as fh:
+                fh.write(config)
+            entry = {'sha1': hashlib.sha1(config.encode('utf-8')).hexdigest(), 'etag': response_headers.get('ETag'),
+                     'last_modified': response_headers.get('Last-Modified')}
+        entry['fetched'] = time.time()
+        with self.lock:
+            self.index.setdefault(server.server, {})[job] = entry
+        return config
+
+    def invalidate(self, server, job):
+        with self.lock:
+            self.index.get(server.server, {}).pop(job, None)
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def summary(self):
+        return 'Config cache: {} served from cache, {} not modified, {} downloaded'.format(
+            self.stats['hit'], self.stats['not_modified'], self.stats['fetched'])
+
+
+class RunJournal:
+    # append-only journal of the jobs a run finished, one JSON line each, so that --resume can skip what an
+    # interrupted run already did.  Lines are written as jobs finish and fsync'ed in batches.
+    sync_lines = 100
+    sync_seconds = 2.0
+
+    def __init__(self, file, resume=False):
+        self.file = file
+        self.lock = threading.Lock()
+        self.done = {}  # controller URL => jobs finished without error
+        if resume:
+            self.load()
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | (0 if resume else os.O_TRUNC)
+        self.fd = os.open(file, flags, 0o600)
+        self.unsynced = 0
+        self.synced = time.monotonic()
+        self.write({'resumed' if resume else 'started': time.time(), 'argv': masked_argv()})
+
+    def load(self):
+        try:
+            fh = open(self.file, 'r')
+        except FileNotFoundError:
+            return
+        with fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # cut short when the run died
+                if 'job' not in entry:
+                    continue
+                done = self.done.setdefault(entry['controller'], set())
+                if entry['ok']:
+                    done.add(entry['job'])
+                else:
+                    done.discard(entry['job'])
+
+    def completed(self, controller):
+        return self.done.get(controller, set())
+
+    def write(self, entry):
+        with self.lock:
+            os.write(self.fd, (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8'))
+            self.unsynced += 1
+            if self.unsynced >= self.sync_lines or time.monotonic() - self.synced >= self.sync_seconds:
+                self.sync()
+
+    def record(self, controller, job, ok):
+        self.write({'controller': controller, 'job': job, 'ok': ok, 'time': time.time()})
+
+    def sync(self):
+        os.fsync(self.fd)
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.fd is None:
+                return
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
+
+
+def masked_argv():
+    # sys.argv with the value of --password hidden
+    argv = list(sys.argv)
+    for (i, arg) in enumerate(argv):
+        if arg == '--password' and i + 1 < len(argv):
+            argv[i + 1] = '***'
+        elif arg.startswith('--password='):
+            argv[i] = '--password=***'
+    return argv
+
+
+def journal_file(args):
+    # runs doing the same thing to the same jobs share a journal, found by a hash of the parsed command line
+    # without the flags that only change how the run goes, and of the size and age of the files it reads
+    ignored = ('resume', 'workers', 'asyncio', 'max_inflight', 'max_controllers', 'prompt', 'quiet', 'diff',
+               'json', 'metrics', 'profile', 'profile_top', 'cprofile', 'timeout', 'retries', 'rate_limit',
+               'cache_ttl', 'no_cache', 'max_builds', 'poll_interval', 'build_timeout', 'user', 'password')
+    key = dict((name, value) for (name, value) in vars(args).items() if name not in ignored)
+    for name in ('property_file', 'transform_file', 'import_archive'):
+        if key.get(name) and os.path.isfile(key[name]):
+            stat = os.stat(key[name])
+            key[name + '_stat'] = [stat.st_size, stat.st_mtime_ns]
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return workdir + '/journal/' + digest + '.jsonl'
+
+
+class ConfigGrep:
+    # --grep_content_pattern compiled once and matched in-process against saved job configs, one result per
+    # matching line like grep -n.  Large configs are memory mapped instead of read in.
+    mmap_size = 1024 * 1024
+
+    def __init__(self, pattern, context=0):
+        self.pattern = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+        self.context = context
+        self.lock = threading.Lock()
+        self.results = {}  # job => list of matches
+
+    def search(self, job, file):
+        with open(file, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size >= self.mmap_size:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    matches = self.scan(data)
+            else:
+                matches = self.scan(fh.read())
+        with self.lock:
+            self.results[job] = matches
+        return matches
+
+    def scan(self, data):
+        # list of {'line': <number>, 'text': <line>, 'before'/'after': [<context lines>]}
+        matches = []
+        lineno = 1
+        counted = 0  # offset up to which newlines are counted into lineno
+        pos = 0
+        while pos < len(data):
+            m = self.pattern.search(data, pos)
+            if not m:
+                break
+            start = data.rfind(b'\n', 0, m.start()) + 1
+            end = data.find(b'\n', m.start())
+            if end < 0:
+                end = len(data)
+            lineno += data[counted:start].count(b'\n')
+            counted = start
+            match = {'line': lineno, 'text': decode(data[start:end])}
+            if self.context:
+                match['before'] = self.lines_before(data, start)
+                match['after'] = self.lines_after(data, end)
+            matches.append(match)
+            # one match per line
+            pos = end + 1
+        return matches
+
+    def lines_before(self, data, start):
+        lines = []
+        end = start - 1
+        while end >= 0 and len(lines) < self.context:
+            start = data.rfind(b'\n', 0, end) + 1
+            lines.insert(0, decode(data[start:end]))
+            end = start - 1
+        return lines
+
+    def lines_after(self, data, end):
+        lines = []
+        start = end + 1
+        while start < len(data) and len(lines) < self.context:
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = len(data)
+            lines.append(decode(data[start:end]))
+            start = end + 1
+        return lines
+
+    def print_matches(self, job, matches, count_only=False):
+        if count_only:
+            print('{}:{}'.format(job, len(matches)))
+            return
+        if not matches:
+            print('No match found')
+        for match in matches:
+            for i, line in enumerate(match.get('before', [])):
+                print('{}-{}-{}'.format(job, match['line'] - len(match['before']) + i, line))
+            print('{}:{}:{}'.format(job, match['line'], match['text']))
+            for i, line in enumerate(match.get('after', [])):
+                print('{}-{}-{}'.format(job, match['line'] + 1 + i, line))
+
+    def summary(self):
+        found = [job for job in self.results if self.results[job]]
+        return 'Grep: {} matching lines in {} of {} jobs'.format(
+            sum(len(matches) for matches in self.results.values()), len(found), len(self.results))
+
+    def report(self, jobs, count_only=False):
+        # JSON report of all jobs searched, in job order
+        return json.dumps(self.entries(jobs, count_only), indent=1)
+
+    def entries(self, jobs, count_only=False):
+        report = []
+        for job in jobs:
+            if job not in self.results:
+                continue
+            entry = {'job': job, 'count': len(self.results[job])}
+            if not count_only:
+                entry['matches'] = self.results[job]
+            report.append(entry)
+        return report
+
+
+def decode(line):
+    return line.decode('utf-8', errors='replace').rstrip('\r')
+
+
+class ConfigDiff:
+    # shows how substitution changed a config, in-process, and tallies changes over the whole run.  Configs
+    # that come out of substitution unchanged are caught with a plain string compare and reported as no-ops.
+    def __init__(self, mode='full'):
+        self.mode = mode  # 'full', 'count' or 'summary'
+        self.lock = threading.Lock()
+        self.stats = {'changed': 0, 'unchanged': 0, 'added': 0, 'removed': 0}
+
+    def diff(self, name, old, new, file=None, file2=None):
+        # returns True if new differs from old
+        if old == new:
+            self.count(unchanged=1)
+            if self.mode != 'summary':
+                print('No change in {}'.format(name))
+            return False
+        old_lines = old.splitlines(True)
+        new_lines = new.splitlines(True)
+        added = 0
+        removed = 0
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != 'equal':
+                removed += i2 - i1
+                added += j2 - j1
+        self.count(changed=1, added=added, removed=removed)
+        if self.mode == 'full':
+            for line in self.unified(matcher, old_lines, new_lines, file or name, file2 or name):
+                print(line if line.endswith('\n') else line + '\n', end='')
+        elif self.mode == 'count':
+            print('Changed {}: +{} -{} lines'.format(name, added, removed))
+        return True
+
+    @staticmethod
+    def unified(matcher, old_lines, new_lines, file, file2):
+        # the lines of difflib.unified_diff(), made from the opcodes matcher already worked out rather than
+        # matching the lines all over again
+        def lines(start, stop):
+            # 'first,count' of a hunk's lines, just 'first' for one line; an empty range starts before it
+            if stop - start == 1:
+                return '{}'.format(start + 1)
+            return '{},{}'.format(start + 1 if stop > start else start, stop - start)
+
+        yield '--- {}\n'.format(file)
+        yield '+++ {}\n'.format(file2)
+        for group in matcher.get_grouped_opcodes(3):
+            yield '@@ -{} +{} @@\n'.format(lines(group[0][1], group[-1][2]), lines(group[0][3], group[-1][4]))
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    for line in old_lines[i1:i2]:
+                        yield ' ' + line
+                    continue
+                for line in old_lines[i1:i2]:
+                    yield '-' + line
+                for line in new_lines[j1:j2]:
+                    yield '+' + line
+
+    def count(self, **counts):
+        with self.lock:
+            for key in counts:
+                self.stats[key] += counts[key]
+
+    def summary(self):
+        return 'Diff: {} changed (+{} -{} lines), {} unchanged'.format(
+            self.stats['changed'], self.stats['added'], self.stats['removed'], self.stats['unchanged'])
+
+
+class JobContext:
+    # state shared by every job of a run, read-only once jobs start processing
+    def __init__(self, args, server_src, server_dest, inventory_src, inventory_dest, properties, tname=None,
+                 cache=None, grep=None, differ=None, transform=None, dir=workdir, journal=None):
+        self.args = args
+        self.server_src = server_src
+        self.server_dest = server_dest
+        self.inventory_src = inventory_src
+        self.inventory_dest = inventory_dest
+        self.properties = properties
+        self.substituter = Substituter(properties)
+        self.tname = tname
+        self.cache = cache
+        self.grep = grep
+        self.differ = differ
+        self.transform = transform
+        self.dir = dir  # where configs are saved, one directory per controller when there are several
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.writes = {'written': 0, 'skipped': 0}
+
+    def record(self, job, ok):
+        # outcome of a job, for --resume
+        if self.journal:
+            self.journal.record(self.server_src.server, job, ok)
+
+    def count_write(self, written):
+        with self.lock:
+            self.writes['written' if written else 'skipped'] += 1
+
+    def write_summary(self):
+        return 'Writes: {} jobs written, {} skipped as unchanged'.format(self.writes['written'],
+                                                                       self.writes['skipped'])
+
+
+class JobOutput:
+    # stand-in for sys.stdout which buffers what worker threads print so that output of each job stays
+    # grouped together; the main thread keeps writing straight through
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def start(self, buffer=None):
+        # output goes to buffer (a list) until stop(), or to a new one
+        self.local.buffer = [] if buffer is None else buffer
+
+    def stop(self):
+        buffer = getattr(self.local, 'buffer', None)
+        self.local.buffer = None
+        return ''.join(buffer or [])
+
+    def write(self, string):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(string)
+        buffer.append(string)
+        return len(string)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class PrefixedOutput:
+    # stand-in for sys.stdout when several controllers run side by side: each thread names its controller
+    # with start(), and its output is written out whole lines at a time, every line prefixed with that name
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start(self, prefix):
+        self.local.prefix = prefix
+        self.local.partial = ''
+
+    def stop(self):
+        if getattr(self.local, 'partial', None):
+            self.write('\n')
+        self.local.prefix = None
+
+    def write(self, string):
+        prefix = getattr(self.local, 'prefix', None)
+        if prefix is None:
+            with self.lock:
+                return self.stream.write(string)
+        lines = (self.local.partial + string).split('\n')
+        self.local.partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write(''.join(prefix + line + '\n' for line in lines))
+        return len(string)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+
+def call(server, method, *args, **kwargs):
+    # a Jenkins call for job_steps() to yield: the driver makes it and sends back the result, or throws the error
+    return server, method, args, kwargs
+
+
+def run_steps(steps):
+    # drive steps to the end with the synchronous client, on the calling thread
+    try:
+        (server, method, args, kwargs) = next(steps)
+        while True:
+            try:
+                result = getattr(server, method)(*args, **kwargs)
+            except Exception as e:
+                (server, method, args, kwargs) = steps.throw(e)
+            else:
+                (server, method, args, kwargs) = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def job_steps(job, ctx):
+    # everything done to one job, as a generator yielding its Jenkins calls so the same steps run on the
+    # synchronous client (process_job) or the asyncio one (run_jobs_async)
+    args = ctx.args
     dryrun = args.dryrun
     prompt = args.prompt
-    quiet = args.quiet
     clone_jobs = args.clone_jobs
     update_jobs = args.update_jobs
     disable_jobs = args.disable_jobs
     enable_jobs = args.enable_jobs
-    build_jobs = args.build_jobs
     fetch_jobs = args.fetch_jobs
     delete_jobs = args.delete_jobs
     from_template = args.from_template
-    property_file = args.property_file
     rename_jobs = args.rename_jobs
-    show_jobs = args.show_jobs
     grep_jobs = args.grep_jobs
     find_replace_jobname_pattern = args.find_replace_jobname_pattern
-    find_replace_content_pattern = args.find_replace_content_pattern
+    server_src = ctx.server_src
+    server_dest = ctx.server_dest
+    inventory_src = ctx.inventory_src
+    inventory_dest = ctx.inventory_dest
+    server_dest_url = inventory_dest.url
+    substituter = ctx.substituter
+    cache = ctx.cache
+    grep = ctx.grep
+    differ = ctx.differ
+
+    print("Processing source job {}".format(job))
+
+    if disable_jobs:
+        print("Disabling job")
+        if dryrun:
+            print("Dryrun mode - job won't be disabled")
+        else:
+            yield call(server_src, 'disable_job', job)
+            inventory_src.set_disabled(job, True)
+        return
+
+    if enable_jobs:
+        print("Enabling job")
+        if dryrun:
+            print("Dryrun mode - job won't be enabled")
+        else:
+            yield call(server_src, 'enable_job', job)
+            inventory_src.set_disabled(job, False)
+        return
+
+    if delete_jobs:
+        print("Deleting job")
+        if prompt:
+            prompt_continue()
+        if dryrun:
+            print("Dryrun mode - job won't be deleted")
+        else:
+            yield call(server_src, 'delete_job', job)
+            inventory_src.remove(job)
+            if cache:
+                cache.invalidate(server_src, job)
+        return
+
+    # the rest is logic for either clone_jobs or update_jobs
+    # get job from source Jenkins instance
+    if cache:
+        # a cached config younger than --cache_ttl is good enough as long as nothing is written back
+        file = cache.file(server_src, job)
+        readonly = dryrun or fetch_jobs or grep_jobs
+        config = yield from cache.job_config_steps(server_src, job, use_ttl=readonly)
+    else:
+        file = ctx.dir + '/' + job + '.xml'
+        config = yield call(server_src, 'get_job_config', job)
+
+        # save raw config to file
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        fh = open(file, 'w')
+        fh.write(config)
+        fh.close()
+
+    if fetch_jobs:
+        # copy job xml to current directory
+        print("Fetching job")
+        if dryrun:
+            print("Dryrun mode - job won't be fetched to current directory")
+        else:
+            # a job inside a folder goes to a matching sub-directory
+            if os.path.dirname(job):
+                os.makedirs(os.path.dirname(job), exist_ok=True)
+            shutil.copyfile(file, job + '.xml')
+        return
+
+    if grep_jobs:
+        print("Grepping job")
+        with profiler.timed('grep', job):
+            matches = grep.search(job, file)
+        if not args.json:
+            grep.print_matches(job, matches, args.grep_count)
+        return
+
+    # job config with properties substituted and transforms applied
+    source_config = config
+    with profiler.timed('transform', job):
+        config = ctx.transform.apply(config)
 
-    (server_src, server_dest) = create_server_instances(args)
+    if update_jobs:
+        # save modified config to new file
+        file2 = ctx.dir + '/' + job + '.xml.updated'
+        os.makedirs(os.path.dirname(file2), exist_ok=True)
+        fh = open(file2, 'w')
+        fh.write(config)
+        fh.close()
+        with profiler.timed('diff', job):
+            differ.diff(job, source_config, config, file, file2)
+        # both come from the same controller, so any difference is an edit
+        if config == source_config:
+            print("Skipping job {} - config is unchanged".format(job))
+            ctx.count_write(False)
+        else:
+            print("Updating job {}".format(job))
+            ctx.count_write(True)
+            if dryrun:
+                print("Dryrun mode - job won't be updated")
+            else:
+                yield call(server_src, 'reconfig_job', job, config)
+                if cache:
+                    cache.invalidate(server_src, job)
+
+    if rename_jobs:
+        (find, replace) = find_replace_jobname_pattern.split('|', 1)
+        job2 = re.sub(find, replace, job)
+        print('Renaming job {} => {}'.format(job, job2))
+        if dryrun:
+            print("Dryrun mode - job won't be renamed")
+        else:
+            yield call(server_dest, 'rename_job', job, job2)
+            inventory_dest.rename(job, job2)
+            if cache:
+                cache.invalidate(server_dest, job)
+                cache.invalidate(server_dest, job2)
+
+    if clone_jobs:
+        if from_template:
+            (junk, job) = job.split('-', 1)
+        if find_replace_jobname_pattern:
+            (find, replace) = find_replace_jobname_pattern.split('|', 1)
+            job = re.sub(find, replace, job)
+        # cloning job has different name
+        job = substituter.substitute(job)
+        # save modified config to new file with different job name, apart from the source config (and the
+        # cache) since clones between controllers keep their names
+        file2 = ctx.dir + '/' + job + '.xml.cloned'
+        os.makedirs(os.path.dirname(file2), exist_ok=True)
+        fh = open(file2, 'w')
+        fh.write(config)
+        fh.close()
+        with profiler.timed('diff', job):
+            differ.diff(job, source_config, config, file, file2)
+        # check existence of job, create new or update existing job
+        if inventory_dest.exists(job):
+            # nothing to post (nor state to toggle) when the job already has this config
+            if cache:
+                dest_config = yield from cache.job_config_steps(server_dest, job)
+            else:
+                dest_config = yield call(server_dest, 'get_job_config', job)
+            if config_hash(config) == config_hash(dest_config):
+                print("Skipping existing job {}job/{} - config is unchanged".format(server_dest_url, job))
+                ctx.count_write(False)
+                return
+            print("Updating existing job {}job/{}".format(server_dest_url, job))
+            ctx.count_write(True)
+            if dryrun:
+                print("Dryrun mode - job won't be updated")
+            else:
+                job_is_disabled = inventory_dest.is_disabled(job)
+                yield call(server_dest, 'reconfig_job', job, config)
+                if cache:
+                    cache.invalidate(server_dest, job)
+                # leave state of build the same as it was before update
+                if job_is_disabled:
+                    yield call(server_dest, 'disable_job', job)
+                else:
+                    yield call(server_dest, 'enable_job', job)
+
+        else:
+            print("Creating new job {}job/{}".format(server_dest_url, job))
+            ctx.count_write(True)
+            if dryrun:
+                print("Dryrun mode - job won't be created")
+            else:
+                yield call(server_dest, 'create_job', job, config)
+                inventory_dest.add(job)
+                if cache:
+                    cache.invalidate(server_dest, job)
+
+
+def process_job(job, ctx):
+    run_steps(job_steps(job, ctx))
+
+
+def process_job_buffered(job, ctx, output):
+    # run in a worker thread, returns (job, ok, captured output)
+    output.start()
+    ok = True
+    try:
+        process_job(job, ctx)
+    except Exception as e:
+        print('ERROR: Failed processing job {}: {}'.format(job, e))
+        ok = False
+    return job, ok, output.stop()
+
+
+def run_jobs(jobs, ctx, workers):
+    if workers <= 1:
+        for job in jobs:
+            try:
+                process_job(job, ctx)
+            except Exception:
+                ctx.record(job, False)
+                raise
+            ctx.record(job, True)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("Processing {} jobs with {} workers".format(len(jobs), workers))
+    # with several controllers one JobOutput is already in place for all of them
+    installed = not isinstance(sys.stdout, JobOutput)
+    output = JobOutput(sys.stdout) if installed else sys.stdout
+    sys.stdout = output
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() hands back results in job order, so output is printed in the same order as serial mode
+            for job, ok, out in executor.map(lambda job: process_job_buffered(job, ctx, output), jobs):
+                output.stream.write(out)
+                output.stream.flush()
+                ctx.record(job, ok)
+                if not ok:
+                    failed.append(job)
+    finally:
+        if installed:
+            sys.stdout = output.stream
+    jobs_summary(jobs, failed)
+
+
+def run_jobs_async(jobs, ctx, credentials, limit):
+    # job_steps() of every job on one thread with the asyncio client, up to limit jobs (and requests to each
+    # controller) in flight at a time.  Output is buffered per job and printed in job order like run_jobs().
+    import asyncio
+    from lib.jenkins_async import AsyncJenkins
+
+    # --prompt asks about each job in turn, so jobs go one at a time with their output unbuffered
+    buffered = not ctx.args.prompt
+    if not buffered:
+        limit = 1
+    print("Processing {} jobs with asyncio, up to {} at a time".format(len(jobs), limit))
+    installed = not isinstance(sys.stdout, JobOutput)
+    output = JobOutput(sys.stdout) if installed else sys.stdout
+
+    async def run_job(job, clients, semaphore):
+        buffer = [] if buffered else None
+        steps = job_steps(job, ctx)
+        ok = True
+        async with semaphore:
+            (result, error) = (None, None)
+            while True:
+                # steps only print between awaits, so the thread's buffer is this job's while they run
+                if buffered:
+                    output.start(buffer)
+                try:
+                    (server, method, args, kwargs) = steps.throw(error) if error else steps.send(result)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    print('ERROR: Failed processing job {}: {}'.format(job, e))
+                    ok = False
+                    break
+                finally:
+                    if buffered:
+                        output.stop()
+                try:
+                    (result, error) = (await getattr(clients[server], method)(*args, **kwargs), None)
+                except Exception as e:
+                    (result, error) = (None, e)
+        return job, ok, ''.join(buffer or [])
+
+    async def run():
+        # one client per controller, recording into the metrics of its synchronous twin
+        clients = {}
+        for server in (ctx.server_src, ctx.server_dest):
+            if server not in clients:
+                clients[server] = AsyncJenkins.from_transport(server, *credentials, limit=limit)
+        semaphore = asyncio.Semaphore(limit)
+        failed = []
+        try:
+            tasks = [asyncio.ensure_future(run_job(job, clients, semaphore)) for job in jobs]
+            for task in tasks:
+                (job, ok, out) = await task
+                output.stream.write(out)
+                output.stream.flush()
+                ctx.record(job, ok)
+                if not ok:
+                    failed.append(job)
+        finally:
+            for client in clients.values():
+                await client.close()
+        return failed
+
+    sys.stdout = output
+    try:
+        failed = asyncio.run(run())
+    finally:
+        if installed:
+            sys.stdout = output.stream
+    jobs_summary(jobs, failed)
+
+
+def jobs_summary(jobs, failed):
+    print("Summary: {} jobs processed, {} succeeded, {} failed".format(
+        len(jobs), len(jobs) - len(failed), len(failed)))
+    for job in failed:
+        print("  FAILED: {}".format(job))
+    if failed:
+        exit(1)
+
+
+def build_jobs(jobs, ctx):
+    # builds jobs as the controller has room for them and waits for their results, True if all succeeded
+    from lib.build_runner import BuildRunner
+
+    args = ctx.args
+    runner = BuildRunner(ctx.server_src, args.max_builds, args.poll_interval, timeout=args.build_timeout)
+    if args.dryrun:
+        for (job, parameters) in runner.parameters(jobs, ctx.properties).items():
+            print("Dryrun mode - {} won't be built{}".format(job, ' (parameters {})'.format(parameters)
+                                                            if parameters else ''))
+        return True
+    builds = runner.run(jobs, ctx.properties, lambda build: ctx.record(build.job, build.passed))
+    print(runner.table(builds))
+    return all(build.passed for build in builds)
+
+
+def write_view(server, url, view, config, dryrun=False):
+    # create view or update it if it exists
+    if server.view_exists(view):
+        print("Update existing view {}view/{}".format(url, view))
+        if dryrun:
+            print("Dryrun mode - view won't be updated")
+        else:
+            server.reconfig_view(view, config)
+    else:
+        print("Creating new view {}view/{}".format(url, view))
+        if dryrun:
+            print("Dryrun mode - view won't be created")
+        else:
+            server.create_view(view, config)
+
+
+def archive_views(server, jobname_regex, jobs, from_template):
+    # views exported along with jobs: those matching --jobname_regex, plus the template views with --from_template
+    patterns = [jobname_regex]
+    if from_template:
+        (tname, junk) = jobs[0].split('-', 1)
+        patterns.append('^' + tname + '.*')
+    return [view['name'] for view in server.get_views()
+            if any(re.search(pattern, view['name']) for pattern in patterns)]
+
+
+def export_archive(file, ctx, jobs, views):
+    # job configs are fetched by --workers threads and written to the archive in job order as they come in
+    from concurrent.futures import ThreadPoolExecutor
+    from lib.job_archive import ArchiveWriter
+
+    server = ctx.server_src
+    inventory = ctx.inventory_src
+    cache = ctx.cache
+
+    def fetch(job):
+        if cache:
+            return cache.get_job_config(server, job, use_ttl=True)
+        return server.get_job_config(job)
+
+    print("Exporting {} jobs and {} views to {}".format(len(jobs), len(views), file))
+    if ctx.args.dryrun:
+        print("Dryrun mode - archive won't be written")
+        return
+    with ArchiveWriter(file, inventory.url) as archive:
+        for view in views:
+            archive.add('views', view, server.get_view_config(view))
+            print("Exported view {}".format(view))
+        with ThreadPoolExecutor(max_workers=ctx.args.workers) as executor:
+            for (job, config) in zip(jobs, executor.map(fetch, jobs)):
+                archive.add('jobs', job, config, inventory.is_disabled(job))
+                if not ctx.args.quiet:
+                    print("Exported job {}".format(job))
+    print("Exported {} jobs and {} views to {} ({:.1f} KB)".format(len(jobs), len(views), file,
+                                                                  os.path.getsize(file) / 1024.0))
+
+
+def import_job(job, config, disabled, ctx):
+    # create or update one job from an archive, returns (job, ok, output)
+    server = ctx.server_dest
+    inventory = ctx.inventory_dest
+    cache = ctx.cache
+    dryrun = ctx.args.dryrun
+    lines = []
+    try:
+        if not inventory.exists(job):
+            lines.append("Creating new job {}job/{}".format(inventory.url, job))
+            ctx.count_write(True)
+            if dryrun:
+                lines.append("Dryrun mode - job won't be created")
+            else:
+                server.create_job(job, config)
+                if disabled:
+                    server.disable_job(job)
+                inventory.add(job, bool(disabled))
+                if cache:
+                    cache.invalidate(server, job)
+            return job, True, lines
+        was_disabled = inventory.is_disabled(job)
+        if cache:
+            dest_config = cache.get_job_config(server, job)
+        else:
+            dest_config = server.get_job_config(job)
+        changed = config_hash(config) != config_hash(dest_config)
+        ctx.count_write(changed)
+        if changed:
+            lines.append("Updating existing job {}job/{}".format(inventory.url, job))
+        else:
+            lines.append("Skipping existing job {}job/{} - config is unchanged".format(inventory.url, job))
+        if dryrun:
+            if changed:
+                lines.append("Dryrun mode - job won't be updated")
+            return job, True, lines
+        if changed:
+            server.reconfig_job(job, config)
+            if cache:
+                cache.invalidate(server, job)
+        # leave the job enabled or disabled as it was when exported
+        if disabled is not None and (changed or disabled != was_disabled):
+            if disabled:
+                server.disable_job(job)
+            else:
+                server.enable_job(job)
+            inventory.set_disabled(job, disabled)
+    except Exception as e:
+        lines.append('ERROR: Failed importing job {}: {}'.format(job, e))
+        return job, False, lines
+    return job, True, lines
+
+
+def import_archive(file, ctx, jobname_regex):
+    # jobs are created or updated by --workers threads while the archive is still being read, with a few
+    # configs per worker waiting in memory at most
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from lib.job_archive import ArchiveReader
+
+    inventory = ctx.inventory_dest
+    workers = ctx.args.workers
+    reader = ArchiveReader(file)
+    pending = deque()
+    imported = {'jobs': set(), 'views': set()}
+    failed = []
+
+    def report(future):
+        (job, ok, lines) = future.result()
+        for line in lines:
+            print(line)
+        ctx.record(job, ok)
+        if not ok:
+            failed.append(job)
+
+    done = set()
+    if ctx.journal and ctx.args.resume:
+        done = ctx.journal.completed(ctx.server_src.server)
+
+    print("Importing {} to {}".format(file, inventory.url))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (kind, name, config, disabled, ok) in reader:
+            if kind == 'jobs' and not re.search(jobname_regex, name):
+                continue
+            if not ok:
+                print('ERROR: Skipping {} {} - config does not match its sha1 in the archive'.format(kind[:-1],
+                                                                                                     name))
+                failed.append(name)
+                continue
+            imported[kind].add(name)
+            if kind == 'jobs' and name in done:
+                continue
+            if kind == 'views':
+                write_view(ctx.server_dest, inventory.url, name, config, ctx.args.dryrun)
+                continue
+            pending.append(executor.submit(import_job, name, config, disabled, ctx))
+            while pending and (pending[0].done() or len(pending) > workers * 4):
+                report(pending.popleft())
+        while pending:
+            report(pending.popleft())
+
+    if reader.manifest is None:
+        print('ERROR: {} has no manifest, the archive may be truncated'.format(file))
+        failed.append(file)
+    else:
+        for kind in ('views', 'jobs'):
+            for name in reader.manifest[kind]:
+                if name not in imported[kind] and name not in failed and (
+                        kind == 'views' or re.search(jobname_regex, name)):
+                    print('ERROR: {} {} is in the manifest but not in the archive'.format(kind[:-1], name))
+                    failed.append(name)
+    print("Imported {} jobs and {} views from {}".format(len(imported['jobs']), len(imported['views']), file))
+    if done:
+        print("  of which {} jobs were imported by an earlier run".format(len(done & imported['jobs'])))
+    for name in failed:
+        print("  FAILED: {}".format(name))
+    return not failed
+
+
+@contextlib.contextmanager
+def job_loop(args, name):
+    # the loop over jobs, timed as a phase of --profile and profiled function by function with --cprofile
+    profile = None
+    if args.cprofile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        with profiler.phase(name):
+            yield
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.cprofile)
+            print("cProfile stats of the job loop written to {}".format(args.cprofile))
+
+
+def write_profile(args):
+    print(profiler.active.table(args.profile_top))
+    try:
+        profiler.active.write(args.profile)
+    except (IOError, OSError) as e:
+        print('ERROR: Cannot write profile: {}'.format(e))
+        return
+    print("Profile written to {}".format(args.profile))
+
+
+def finish_run(ctx, jobs, stdout=None):
+    # summaries at the end of a run, also printed when it stops part way.  The --json report goes to stdout,
+    # if given.
+    args = ctx.args
+    if ctx.cache:
+        ctx.cache.save()
+        print(ctx.cache.summary())
+    if args.update_jobs or args.clone_jobs:
+        print(ctx.differ.summary())
+    if args.update_jobs or args.clone_jobs or args.import_archive:
+        print(ctx.write_summary())
+    if ctx.grep:
+        print(ctx.grep.summary())
+        if args.json and stdout:
+            stdout.write(ctx.grep.report(jobs, args.grep_count) + '\n')
+    if args.metrics:
+        for server in {ctx.server_src, ctx.server_dest}:
+            print("Jenkins calls to {}".format(server.server))
+            print(server.metrics.report())
+
+
+def run_controller(args, url, credentials, properties, outcome, stdout=None, dir=workdir, journal=None):
+    # the whole run against one source controller.  outcome gets the matching jobs and the JobContext as soon as
+    # they are known, so a summary of several controllers can cover the ones that stop part way too.
+    dryrun = args.dryrun
+    quiet = args.quiet
+    from_template = args.from_template
+    show_jobs = args.show_jobs
+
+    with profiler.phase('connect'):
+        (server_src, server_dest) = create_server_instances(args, url, credentials)
     jobname_regex = args.jobname_regex
-    properties = {}
 
-    if property_file:
-        properties = read_property_file(property_file)
+    cache = None
+    if not args.no_cache:
+        cache = JobConfigCache(dir, args.cache_ttl)
 
-    jobs = []
-    for job in server_src.get_jobs():
-        job_name = job['name']
+    if args.import_archive:
+        ctx = JobContext(args, server_src, server_dest, None, JobInventory(server_dest), properties, cache=cache,
+                         dir=dir, journal=journal)
+        outcome['ctx'] = ctx
+        from lib.job_archive import ArchiveError
         try:
-            result = re.search(jobname_regex, job_name)
-        except:
-            print('ERROR: Cannot process jobname regex pattern \'{}\' - try something else.'.format(jobname_regex))
-            exit(1)
-        if result:
-            jobs.append(job_name)
+            with job_loop(args, 'import'):
+                ok = import_archive(args.import_archive, ctx, jobname_regex)
+        except ArchiveError as e:
+            print('ERROR: {}'.format(e))
+            ok = False
+        finally:
+            finish_run(ctx, [], stdout)
+        exit(0 if ok else 1)
 
+    jobs = []
+    with profiler.phase('list jobs'):
+        inventory_src = JobInventory(server_src)
+        for job_name in inventory_src.jobs():
+            try:
+                result = re.search(jobname_regex, job_name)
+            except:
+                print('ERROR: Cannot process jobname regex pattern \'{}\' - try something else.'.format(
+                    jobname_regex))
+                exit(1)
+            if result:
+                jobs.append(job_name)
+
+    outcome['jobs'] = jobs
     if jobs:
         print("Found {} matching source jobs:".format(len(jobs)))
         print(jobs)
@@ -264,9 +1629,51 @@ def main():
         print("No source job found")
         exit(0)
 
-    job_list = server_dest.get_jobs()
-    server_dest_url = server_dest.get_info().get('primaryView').get('url')
+    if journal and args.resume:
+        done = journal.completed(server_src.server)
+        remaining = [job for job in jobs if job not in done]
+        print("Resuming: skipping {} jobs finished by an earlier run, {} left".format(len(jobs) - len(remaining),
+                                                                                     len(remaining)))
+        jobs = remaining
+        outcome['jobs'] = jobs
+        if not jobs:
+            exit(0)
+
+    if args.export_archive:
+        ctx = JobContext(args, server_src, server_dest, inventory_src, inventory_src, properties, cache=cache,
+                         dir=dir)
+        outcome['ctx'] = ctx
+        from lib.job_archive import ArchiveError
+        try:
+            with job_loop(args, 'export'):
+                export_archive(args.export_archive, ctx, jobs,
+                               archive_views(server_src, jobname_regex, jobs, from_template))
+        except ArchiveError as e:
+            print('ERROR: {}'.format(e))
+            exit(1)
+        finally:
+            finish_run(ctx, jobs, stdout)
+        exit(0)
+
+    if args.build_jobs:
+        ctx = JobContext(args, server_src, server_dest, inventory_src, inventory_src, properties, dir=dir,
+                         journal=journal)
+        outcome['ctx'] = ctx
+        try:
+            with job_loop(args, 'build'):
+                ok = build_jobs(jobs, ctx)
+        finally:
+            finish_run(ctx, jobs, stdout)
+        exit(0 if ok else 1)
+
+    if server_dest is server_src:
+        inventory_dest = inventory_src
+    else:
+        inventory_dest = JobInventory(server_dest)
+    server_dest_url = inventory_dest.url
 
+    differ = ConfigDiff('summary' if quiet else args.diff)
+    tname = None
     if from_template:
         # get template name
         (tname, junk) = jobs[0].split('-', 1)
@@ -278,7 +1685,7 @@ def main():
             # assuming each template has a view
             config = server_src.get_view_config(tname)
             # save template view configuration
-            file = workdir + '/' + tname + '.xml'
+            file = dir + '/' + tname + '.xml'
             fh = open(file, 'w')
             fh.write(config)
             fh.close()
@@ -287,156 +1694,123 @@ def main():
                 print('ERROR: Template project must have PROJECT_NAME in property file')
                 exit(1)
             # save new project view configuration
+            view_config = config
             config = re.sub(tname, new_tname, config)
-            file2 = workdir + '/' + new_tname + '.xml'
+            file2 = dir + '/' + new_tname + '.xml'
             fh = open(file2, 'w')
             fh.write(config)
             fh.close()
-            if not quiet:
-                os.system('diff {} {}'.format(file, file2))
-            if server_dest.view_exists(new_tname):
-                print("Update existing view {}view/{}".format(server_dest_url, new_tname))
-                if dryrun:
-                    print("Dryrun mode - view won't be updated")
-                else:
-                    server_dest.reconfig_view(new_tname, config)
-            else:
-                print("Creating new view {}view/{}".format(server_dest_url, new_tname))
-                if dryrun:
-                    print("Dryrun mode - view won't be created")
-                else:
-                    server_dest.create_view(new_tname, config)
-    for job in jobs:
-        print("Processing source job {}".format(job))
+            differ.diff('view ' + new_tname, view_config, config, file, file2)
+            write_view(server_dest, server_dest_url, new_tname, config, dryrun)
 
-        if disable_jobs:
-            print("Disabling job")
-            if dryrun:
-                print("Dryrun mode - job won't be disabled")
-            else:
-                server_src.disable_job(job)
-            continue
-
-        if enable_jobs:
-            print("Enabling job")
-            if dryrun:
-                print("Dryrun mode - job won't be enabled")
+    grep = None
+    if args.grep_jobs:
+        grep = ConfigGrep(args.grep_content_pattern, args.grep_context)
+    try:
+        transform = config_transform(args, properties, tname)
+    except (OSError, ValueError, re.error) as e:
+        print('ERROR: {}'.format(e))
+        exit(1)
+    ctx = JobContext(args, server_src, server_dest, inventory_src, inventory_dest, properties, tname, cache, grep,
+                     differ, transform, dir, journal)
+    outcome['ctx'] = ctx
+    try:
+        with job_loop(args, 'jobs'):
+            if args.asyncio:
+                run_jobs_async(jobs, ctx, credentials, args.max_inflight)
             else:
-                server_src.enable_job(job)
-            continue
+                run_jobs(jobs, ctx, args.workers)
+    finally:
+        finish_run(ctx, jobs, stdout)
 
-        if delete_jobs:
-            print("Deleting job")
-            if prompt:
-                prompt_continue()
-            if dryrun:
-                print("Dryrun mode - job won't be deleted")
-            else:
-                server_src.delete_job(job)
-            continue
 
-        if build_jobs:
-            print("Building job")
-            if dryrun:
-                print("Dryrun mode - job won't be built")
-            else:
-                # build_jobs method needs at least one parameter to work, hence ANY_KEY
-                server_src.build_job(job, parameters={'ANY_KEY': 'ANY_VALUE'}, token=None)
-            continue
+def run_controllers(args, credentials, properties, stdout, journal=None):
+    # the same run on every controller, --max_controllers at a time, each with a work directory of its own and
+    # its output prefixed with its name; then one summary (and --json report) of them all
+    from concurrent.futures import ThreadPoolExecutor
 
-        # the rest is logic for either clone_jobs or update_jobs
-        # get job from source Jenkins instance
-        config = server_src.get_job_config(job)
+    output = JobOutput(PrefixedOutput(sys.stdout))
 
-        # save raw config to file
-        file = workdir + '/' + job + '.xml'
-        fh = open(file, 'w')
-        fh.write(config)
-        fh.close()
+    def run(url):
+        name = controller_name(url)
+        outcome = {'url': url, 'jobs': [], 'ctx': None, 'status': 0}
+        dir = workdir + '/' + re.sub('[^\\w.-]+', '_', name)
+        os.makedirs(dir, exist_ok=True)
+        output.stream.start('[{}] '.format(name))
+        start = time.time()
+        try:
+            run_controller(args, url, credentials, properties, outcome, dir=dir, journal=journal)
+        except SystemExit as e:
+            outcome['status'] = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception as e:
+            print('ERROR: {}'.format(e))
+            outcome['status'] = 1
+        finally:
+            outcome['seconds'] = time.time() - start
+            output.stream.stop()
+        return outcome
 
-        if fetch_jobs:
-            # copy job xml to current directory
-            print("Fetching job")
-            if dryrun:
-                print("Dryrun mode - job won't be fetched to current directory")
-            else:
-                shutil.copyfile(file, job + '.xml')
-            continue
+    print("Running on {} controllers, {} at a time".format(len(args.controllers),
+                                                          min(len(args.controllers), args.max_controllers)))
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=args.max_controllers) as executor:
+            results = list(executor.map(run, args.controllers))
+    finally:
+        sys.stdout = output.stream.stream
 
-        if grep_jobs:
-            print("Grepping job")
-            rc = os.system('grep {} {}'.format(args.grep_content_pattern, file))
-            if rc:
-                print('No match found')
-            continue
+    print("Summary of {} controllers:".format(len(results)))
+    print('  {:<40} {:>7} {:>7} {:>8} {:>8} {:>8}'.format('controller', 'status', 'jobs', 'written', 'skipped',
+                                                           'seconds'))
+    report = []
+    for outcome in results:
+        ctx = outcome['ctx']
+        writes = ctx.writes if ctx else {'written': 0, 'skipped': 0}
+        print('  {:<40} {:>7} {:>7} {:>8} {:>8} {:>8.1f}'.format(
+            controller_name(outcome['url']), 'FAILED' if outcome['status'] else 'ok', len(outcome['jobs']),
+            writes['written'], writes['skipped'], outcome['seconds']))
+        if ctx and ctx.grep:
+            for entry in ctx.grep.entries(outcome['jobs'], args.grep_count):
+                report.append(dict(controller=outcome['url'], **entry))
+    if args.json:
+        stdout.write(json.dumps(report, indent=1) + '\n')
+    if any(outcome['status'] for outcome in results):
+        exit(1)
 
-        # substituted job config with properties
-        config = substitute_vars(config, properties)
-        # substitute job content if <find|replace> specified
-        if find_replace_content_pattern:
-            (find, replace) = find_replace_content_pattern.split('|', 1)
-            config = re.sub(find, replace, config)
 
-        if update_jobs:
-            # save modified config to new file
-            file2 = workdir + '/' + job + '.xml.updated'
-            fh = open(file2, 'w')
-            fh.write(config)
-            fh.close()
-            if not quiet:
-                os.system('diff {} {}'.format(file, file2))
-            print("Updating job {}".format(job))
-            if dryrun:
-                print("Dryrun mode - job won't be updated")
-            else:
-                server_src.reconfig_job(job, config)
+def main():
+    # first parse arguments
+    args = parse_args()
+    # with --json only the report goes to stdout
+    stdout = sys.stdout
+    if args.json:
+        sys.stdout = sys.stderr
 
-        if rename_jobs:
-            (find, replace) = find_replace_jobname_pattern.split('|', 1)
-            job2 = re.sub(find, replace, job)
-            print('Renaming job {} => {}'.format(job, job2))
-            if dryrun:
-                print("Dryrun mode - job won't be renamed")
-            else:
-                server_dest.rename_job(job, job2)
-
-        if clone_jobs:
-            if from_template:
-                (junk, job) = job.split('-', 1)
-                # get rid of any reference to project type from config
-                config = re.sub(tname + '-', '', config)
-            if find_replace_jobname_pattern:
-                (find, replace) = find_replace_jobname_pattern.split('|', 1)
-                job = re.sub(find, replace, job)
-            # cloning job has different name
-            job = substitute_vars(job, properties)
-            # save modified config to new file with different job name
-            file2 = workdir + '/' + job + '.xml'
-            fh = open(file2, 'w')
-            fh.write(config)
-            fh.close()
-            if not quiet:
-                os.system('diff {} {}'.format(file, file2))
-            # check existence of job, create new or update existing job
-            if server_dest.job_exists(job):
-                print("Updating existing job {}job/{}".format(server_dest_url, job))
-                if dryrun:
-                    print("Dryrun mode - job won't be updated")
-                else:
-                    job_is_disabled = is_job_disabled(job, job_list)
-                    server_dest.reconfig_job(job, config)
-                    # leave state of build the same as it was before update
-                    if job_is_disabled:
-                        server_dest.disable_job(job)
-                    else:
-                        server_dest.enable_job(job)
+    credentials = read_credentials(args)
+    properties = {}
+    if args.property_file:
+        properties = read_property_file(args.property_file)
 
-            else:
-                print("Creating new job {}job/{}".format(server_dest_url, job))
-                if dryrun:
-                    print("Dryrun mode - job won't be created")
-                else:
-                    server_dest.create_job(job, config)
+    journal = None
+    if not (args.show_jobs or args.grep_jobs or args.export_archive):
+        journal = RunJournal(journal_file(args), args.resume)
+    if args.profile:
+        profiler.start(max(100, args.profile_top))
+    try:
+        if len(args.controllers) == 1:
+            run_controller(args, args.controllers[0], credentials, properties, {}, stdout, journal=journal)
+        else:
+            run_controllers(args, credentials, properties, stdout, journal)
+    except BaseException as e:
+        if journal and not (isinstance(e, SystemExit) and not e.code):
+            print("Note: Run the same command with --resume to skip the jobs it finished and retry the rest")
+        raise
+    finally:
+        # also when the run stops part way
+        if journal:
+            journal.close()
+        if args.profile:
+            write_profile(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Continuously monitor diskspace and inode usage of a Jenkins host per config/jenkins_monitoring.properties
+
+import os
+import argparse
+
+from lib.jmon_utils import Monitor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Jenkins host monitor')
+    parser.add_argument('--property_file',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config',
+                                             'jenkins_monitoring.properties'),
+                        help='Monitoring property file with INODE_THRESHOLD and DISKSPACE_THRESHOLD.  It is '
+                             're-read whenever it changes.')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between samples.  Default is 60.')
+    parser.add_argument('--history', type=int, default=60,
+                        help='Number of recent samples kept per mount point.  Default is 60.')
+    parser.add_argument('--hysteresis', type=int, default=5,
+                        help='Percent usage has to drop below a threshold before it is reported as recovered '
+                             'and can alert again.  Default is 5.')
+    parser.add_argument('--count', type=int, help='Stop after this many samples instead of running forever')
+    args = parser.parse_args()
+    if not os.path.isfile(args.property_file):
+        print("Property file {} does not exist".format(args.property_file))
+        exit(1)
+    return args
+
+
+def main():
+    args = parse_args()
+    monitor = Monitor(args.property_file, interval=args.interval, history=args.history,
+                      hysteresis=args.hysteresis)
+    try:
+        monitor.run(args.count)
+    except KeyboardInterrupt:
+        print("Stopped")
+
+
+if __name__ == "__main__":
+    main()
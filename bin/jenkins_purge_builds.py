@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Purge Jenkins builds older than JENKINS_BUILD_LOG_PURGE_DAYS from $JENKINS_HOME
+
+import os
+import argparse
+
+from lib.utils import read_properties
+from lib.jmon_utils import BuildPurger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Jenkins build purge')
+    parser.add_argument('--jenkins_home', default=os.environ.get('JENKINS_HOME'),
+                        help='Jenkins home directory.  Default is $JENKINS_HOME.')
+    parser.add_argument('--property_file',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config',
+                                             'jenkins_monitoring.properties'),
+                        help='Monitoring property file with JENKINS_BUILD_LOG_PURGE_DAYS')
+    parser.add_argument('--days', type=float,
+                        help='Purge builds older than this many days, overriding JENKINS_BUILD_LOG_PURGE_DAYS')
+    parser.add_argument('--state_file', default='/var/tmp/jenkins_build_purge.json',
+                        help='File remembering the newest purged build of each job between runs')
+    parser.add_argument('--workers', type=int, default=8, help='Number of jobs scanned/purged concurrently')
+    parser.add_argument('--batch_size', type=int, default=500, help='Number of builds deleted per batch')
+    parser.add_argument('--dryrun', action='store_true',
+                        help='Report what would be purged but do not delete anything')
+    args = parser.parse_args()
+
+    if not args.jenkins_home or not os.path.isdir(args.jenkins_home):
+        print("Jenkins home {} does not exist, set --jenkins_home or $JENKINS_HOME".format(args.jenkins_home))
+        exit(1)
+    if args.days is None:
+        days = read_properties(args.property_file).get('JENKINS_BUILD_LOG_PURGE_DAYS')
+        if not days:
+            print("Missing JENKINS_BUILD_LOG_PURGE_DAYS in {}, or specify --days".format(args.property_file))
+            exit(1)
+        args.days = float(days)
+    return args
+
+
+def main():
+    args = parse_args()
+    purger = BuildPurger(args.jenkins_home, args.days, state_file=args.state_file, workers=args.workers,
+                         batch_size=args.batch_size, dryrun=args.dryrun)
+    purger.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,48 @@
 # http://mikegrouchy.com/blog/2012/05/be-pythonic-__init__py.html
-from lib.utils import *
-from lib.jmon_utils import *
-from lib.project import Project
-from lib.webapp import Webapp
+# Submodules are only imported when one of their names is first used (PEP 562), so 'import lib' is cheap and a
+# script only pays for what it touches.  'from lib import *' imports everything but the Jenkins clients, which
+# pull in python-jenkins and requests; those are imported by name, e.g. 'from lib import JenkinsTransport'.
+import importlib
+
+# public name => submodule defining it
+_exports = {
+    'Command': 'lib.utils',
+    'Host': 'lib.utils',
+    'MacHost': 'lib.utils',
+    'UbuntuHost': 'lib.utils',
+    'Utils': 'lib.utils',
+    'create_host': 'lib.utils',
+    'exit_err': 'lib.utils',
+    'read_properties': 'lib.utils',
+    'Monitor': 'lib.jmon_utils',
+    'BuildPurger': 'lib.jmon_utils',
+    'JenkinsTransport': 'lib.jenkins_transport',
+    'AsyncJenkins': 'lib.jenkins_async',
+    'ArchiveError': 'lib.job_archive',
+    'ArchiveReader': 'lib.job_archive',
+    'ArchiveWriter': 'lib.job_archive',
+    'ConfigTransform': 'lib.config_transform',
+    'Profiler': 'lib.profiler',
+    'ScriptRunner': 'lib.script_runner',
+    'BuildGraph': 'lib.build_graph',
+    'Step': 'lib.build_graph',
+    'StaticExport': 'lib.static_export',
+    'BuildRunner': 'lib.build_runner',
+    'Project': 'lib.project',
+    'Webapp': 'lib.webapp',
+}
+# left out of 'from lib import *'
+_clients = ('JenkinsTransport', 'AsyncJenkins', 'BuildRunner')
+__all__ = [name for name in _exports if name not in _clients]
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module 'lib' has no attribute '{}'".format(name))
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
@@ -0,0 +1,184 @@
+# Build steps of a project as a dependency graph: steps whose dependencies are done run concurrently, and a step
+# is skipped when the content of its inputs and the outputs of its dependencies are the same as at its last
+# successful run and its own outputs are still as it left them.  What each step last saw is kept in a local
+# manifest (JSON), along with the size, mtime and sha1 of every file hashed so unchanged files are not read
+# again.
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+from lib import profiler
+from lib.utils import FileHashes, write_json
+
+
+class Step:
+    # function() returns True when the step worked.  inputs and outputs are files, directories (everything under
+    # them) or glob patterns ('**' matching any depth); deps are names of steps that have to run first.
+    def __init__(self, name, function, inputs=(), outputs=(), deps=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+
+
+def log(message):
+    # one write per line, so lines of steps running at once do not interleave
+    print(message + '\n', end='', flush=True)
+
+
+def expand(patterns):
+    # sorted files matching patterns
+    files = set()
+    for pattern in patterns:
+        paths = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for path in paths:
+            if os.path.isdir(path):
+                for (dir, dirs, names) in os.walk(path):
+                    files.update(os.path.join(dir, name) for name in names)
+            elif os.path.isfile(path):
+                files.add(path)
+    return sorted(files)
+
+
+class BuildGraph:
+    manifest_version = 1
+
+    def __init__(self, steps, manifest='.build_manifest.json', workers=4):
+        self.steps = dict((step.name, step) for step in steps)
+        self.manifest_file = manifest
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.hashes = FileHashes()
+        self.done = {}  # step => {'key': ..., 'outputs': ..., 'time': ...} of its last successful run
+        for step in steps:
+            for dep in step.deps:
+                if dep not in self.steps:
+                    raise ValueError('Step {} depends on unknown step {}'.format(step.name, dep))
+        self.order = self.sort()
+        self.load()
+
+    def sort(self):
+        # step names, each after its dependencies; raises ValueError on a cycle
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError('Steps depend on each other: {}'.format(' -> '.join(path + [name])))
+            state[name] = 'visiting'
+            for dep in self.steps[name].deps:
+                visit(dep, path + [name])
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.steps:
+            visit(name, [])
+        return order
+
+    def load(self):
+        try:
+            with open(self.manifest_file, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            log('Note: Ignoring corrupt build manifest {}'.format(self.manifest_file))
+            return
+        if data.get('version') == self.manifest_version:
+            self.hashes = FileHashes(data.get('files', {}))
+            self.done = data.get('steps', {})
+
+    def save(self):
+        with self.lock:
+            write_json(self.manifest_file, {'version': self.manifest_version, 'files': self.hashes.copy(),
+                                            'steps': self.done})
+
+    def digest(self, patterns):
+        # one sha1 over the paths and content of every file matching patterns
+        sha1 = hashlib.sha1()
+        for path in expand(patterns):
+            sha1.update('{}\0{}\0'.format(path, self.hashes.hash(path)).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def key(self, step):
+        # what the step's result depends on: its inputs and what its dependencies produced
+        deps = [self.done.get(dep, {}).get('outputs') for dep in step.deps]
+        return hashlib.sha1(json.dumps([step.name, self.digest(step.inputs), deps]).encode('utf-8')).hexdigest()
+
+    def run_step(self, step, force):
+        # 'built', 'cached' or 'failed'
+        key = self.key(step)
+        last = self.done.get(step.name)
+        if not force and last and last['key'] == key and last['outputs'] == self.digest(step.outputs):
+            log('Step {} is up to date'.format(step.name))
+            return 'cached'
+        log('Running step {}'.format(step.name))
+        start = time.time()
+        try:
+            with profiler.timed('step', step.name):
+                ok = step.function()
+        except Exception as e:
+            log('ERROR: Step {} failed: {}'.format(step.name, e))
+            ok = False
+        if not ok:
+            with self.lock:
+                self.done.pop(step.name, None)
+            return 'failed'
+        outputs = self.digest(step.outputs)
+        with self.lock:
+            self.done[step.name] = {'key': key, 'outputs': outputs, 'time': time.time()}
+        log('Step {} done in {:.1f} s'.format(step.name, time.time() - start))
+        return 'built'
+
+    def needed(self, targets):
+        # targets and every step they depend on, in build order
+        if not targets:
+            return list(self.order)
+        for target in targets:
+            if target not in self.steps:
+                raise ValueError('Unknown step {}'.format(target))
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.steps[name].deps)
+        return [name for name in self.order if name in needed]
+
+    def run(self, targets=None, force=False):
+        # builds targets (default: every step), returns {step: 'built'|'cached'|'failed'|'blocked'}.  Steps
+        # depending on one that failed are blocked; the others still run.
+        names = self.needed(targets)
+        results = {}
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(results) < len(names):
+                for name in names:
+                    if name in results or name in running:
+                        continue
+                    deps = [results.get(dep) for dep in self.steps[name].deps]
+                    if any(result in ('failed', 'blocked') for result in deps):
+                        log('Skipping step {} - a step it depends on failed'.format(name))
+                        results[name] = 'blocked'
+                    elif all(deps):
+                        running[name] = executor.submit(self.run_step, self.steps[name], force)
+                if not running:
+                    continue
+                finished = concurrent.futures.wait(running.values(),
+                                                   return_when=concurrent.futures.FIRST_COMPLETED)[0]
+                for name in [name for (name, future) in running.items() if future in finished]:
+                    results[name] = running.pop(name).result()
+                    # a manifest saved after every step keeps what was done when a later one is interrupted
+                    self.save()
+        counts = dict((result, list(results.values()).count(result))
+                      for result in ('built', 'cached', 'failed', 'blocked'))
+        log('Build: {built} steps built, {cached} up to date, {failed} failed, {blocked} skipped'.format(**counts))
+        return results
@@ -0,0 +1,209 @@
+# Builds many jobs of a controller without swamping it, and follows every build to its result.
+#   - builds are triggered only while those in flight (queued or running) stay under max_builds, by default the
+#     number of executors of the controller, and while the controller's whole queue stays under it too
+#   - a parameterized job gets the values of its parameters from the properties, or its first parameter's default
+#     when the properties have none of them, since a parameterized build needs at least one
+#   - each poll makes one request for the queue plus one per folder holding builds to follow, listing only the few
+#     most recent builds of its jobs with their queue id, number and result; a build that dropped out of those is
+#     asked for on its own.  Polls come every poll_interval seconds while builds start or finish and back off, up to
+#     max_poll_interval, while nothing changes.
+import time
+
+from jenkins import JenkinsException
+
+from lib import profiler
+
+
+class Build:
+    def __init__(self, job, parameters=None):
+        self.job = job
+        self.parameters = parameters
+        self.queue_id = None
+        self.number = None
+        self.url = None
+        self.result = None  # SUCCESS, UNSTABLE, FAILURE, ABORTED, NOT_BUILT, CANCELLED, TIMEOUT, LOST or ERROR
+        self.triggered = None
+        self.duration = None  # seconds the build ran, as Jenkins reports it
+        self.error = None
+
+    @property
+    def passed(self):
+        return self.result == 'SUCCESS'
+
+
+def folder_item(folder):
+    # 'a/b' => 'job/a/job/b', the get_info() item of a folder or job; '' is the top level
+    return 'job/' + '/job/'.join(folder.split('/')) if folder else ''
+
+
+class BuildRunner:
+    builds_listed = 5  # recent builds listed per job when looking for a queue id
+    build_tree = 'number,queueId,result,building,duration,url'
+
+    def __init__(self, server, max_builds=0, poll_interval=2, max_poll_interval=30, timeout=0):
+        self.server = server
+        self.max_builds = max_builds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.timeout = timeout  # seconds from trigger to result, 0 for no limit
+
+    def folder_jobs(self, jobs, tree):
+        # job => item of its folder's listing with tree, one request per folder
+        folders = {}
+        for job in jobs:
+            (folder, sep, name) = job.rpartition('/')
+            folders.setdefault(folder, []).append(job)
+        items = {}
+        for (folder, names) in folders.items():
+            info = self.server.get_info(item=folder_item(folder), query='?tree=jobs[name,{}]'.format(tree))
+            listed = dict((item['name'], item) for item in info.get('jobs', []))
+            for job in names:
+                items[job] = listed.get(job.rpartition('/')[2], {})
+        return items
+
+    def parameters(self, jobs, properties):
+        # job => parameters to build it with, None for a job without parameters
+        parameters = {}
+        items = self.folder_jobs(jobs, 'property[parameterDefinitions[name,defaultParameterValue[value]]]')
+        for job in jobs:
+            definitions = [definition for prop in items[job].get('property') or []
+                           for definition in prop.get('parameterDefinitions') or []]
+            if not definitions:
+                parameters[job] = None
+                continue
+            values = dict((d['name'], properties[d['name']]) for d in definitions if d['name'] in properties)
+            if not values:
+                default = (definitions[0].get('defaultParameterValue') or {}).get('value')
+                values = {definitions[0]['name']: '' if default is None else default}
+            parameters[job] = values
+        return parameters
+
+    def executors(self):
+        info = self.server.get_info(item='computer', query='?tree=totalExecutors')
+        return info.get('totalExecutors') or 0
+
+    def queued(self):
+        # ids of the items in the controller's queue
+        info = self.server.get_info(item='queue', query='?tree=items[id]')
+        return set(item['id'] for item in info.get('items', []))
+
+    def trigger(self, build):
+        print('Triggering build of {}{}'.format(build.job, ' with {}'.format(build.parameters)
+                                                if build.parameters else ''))
+        build.triggered = time.monotonic()
+        try:
+            build.queue_id = self.server.build_job(build.job, build.parameters)
+        except Exception as e:
+            build.result = 'ERROR'
+            build.error = str(e)
+            print('ERROR: Cannot trigger build of {}: {}'.format(build.job, e))
+
+    def update(self, builds, queued):
+        # follows builds out of the queue to their result, returns True when any of them started or finished
+        changed = False
+        left = [build for build in builds if build.queue_id not in queued]
+        if not left:
+            return False
+        # the folder listings hold every job, only those followed are looked at
+        items = self.folder_jobs(sorted(set(build.job for build in left)),
+                                 'builds[{}]{{0,{}}}'.format(self.build_tree, self.builds_listed))
+        for build in left:
+            found = [b for b in items[build.job].get('builds') or [] if b.get('queueId') == build.queue_id]
+            if found:
+                changed |= self.follow(build, found[0])
+            elif build.number is not None:
+                # more builds of the job since, asked for on its own
+                info = self.server.get_info(item='{}/{}'.format(folder_item(build.job), build.number),
+                                            query='?tree=' + self.build_tree)
+                changed |= self.follow(build, info)
+            else:
+                # out of the queue but not yet among the builds, or cancelled
+                changed |= self.follow_queue_item(build)
+        return changed
+
+    def follow(self, build, info):
+        started = build.number is None
+        build.number = info['number']
+        build.url = info.get('url')
+        if started:
+            print('Build {} #{} started'.format(build.job, build.number))
+        if info.get('building') or not info.get('result'):
+            return started
+        build.result = info['result']
+        build.duration = (info.get('duration') or 0) / 1000.0
+        return True
+
+    def follow_queue_item(self, build):
+        try:
+            item = self.server.get_queue_item(build.queue_id)
+        except JenkinsException:
+            # queue items are forgotten about five minutes after they leave the queue
+            build.result = 'LOST'
+            build.error = 'queue item {} is gone and no build of it was found'.format(build.queue_id)
+            return True
+        if item.get('cancelled'):
+            build.result = 'CANCELLED'
+            return True
+        if item.get('executable'):
+            build.number = item['executable'].get('number')
+            build.url = item['executable'].get('url')
+            print('Build {} #{} started'.format(build.job, build.number))
+            return True
+        return False
+
+    def run(self, jobs, properties, done=None):
+        # builds jobs and returns their Builds once every one has a result.  done(build) is called as each
+        # finishes.
+        builds = [Build(job, parameters) for (job, parameters) in self.parameters(jobs, properties).items()]
+        limit = self.max_builds or max(1, self.executors())
+        print('Building {} jobs, up to {} at a time'.format(len(builds), limit))
+        pending = list(builds)
+        active = []
+        interval = self.poll_interval
+        while pending or active:
+            with profiler.timed('build', 'poll'):
+                queued = self.queued()
+                changed = self.update(active, queued) if active else False
+            now = time.monotonic()
+            for build in active:
+                if not build.result and self.timeout and now - build.triggered > self.timeout:
+                    build.result = 'TIMEOUT'
+                    build.error = 'no result after {} s, the build was left running'.format(self.timeout)
+            for build in [build for build in active if build.result]:
+                active.remove(build)
+                print('Build {}{} finished: {}'.format(build.job, ' #{}'.format(build.number) if build.number
+                                                       else '', build.result))
+                if done:
+                    done(build)
+            # the whole queue counts, not only these builds: jobs of others wait in it as well
+            while pending and len(active) < limit and (len(queued) < limit or not active):
+                build = pending.pop(0)
+                self.trigger(build)
+                changed = True
+                if build.result:
+                    if done:
+                        done(build)
+                    continue
+                active.append(build)
+                queued.add(build.queue_id)
+            if not (pending or active):
+                break
+            interval = self.poll_interval if changed else min(self.max_poll_interval, interval * 2)
+            time.sleep(interval)
+        return builds
+
+    @staticmethod
+    def table(builds):
+        # results as text, failed builds with their URL or error
+        width = max([len('job')] + [len(build.job) for build in builds])
+        lines = ['{:<{}} {:>7} {:<10} {:>9}'.format('job', width, 'build', 'result', 'seconds')]
+        for build in builds:
+            lines.append('{:<{}} {:>7} {:<10} {:>9}'.format(
+                build.job, width, '#{}'.format(build.number) if build.number else '-', build.result or '-',
+                '{:.1f}'.format(build.duration) if build.duration is not None else '-'))
+        for build in builds:
+            if not build.passed:
+                lines.append('FAILED: {} {}'.format(build.job, build.error or build.url or ''))
+        passed = len([build for build in builds if build.passed])
+        lines.append('Summary: {} builds, {} passed, {} failed'.format(len(builds), passed, len(builds) - passed))
+        return '\n'.join(lines)
@@ -0,0 +1,292 @@
+# Job config transforms applied to the parsed XML rather than the raw text: each config is parsed once, the
+# operations run in order on the element tree and the config is serialised once at the end, only if something
+# changed.  Operations only ever see text and attribute values, so a pattern cannot match across elements.
+# Only the elements an operation changed are serialised again; everything else, comments, CDATA sections and
+# character references such as &#xd; included, is copied from the source as it was.
+#
+# Operations can be declared in a JSON file, a list applied in order:
+#   [{"op": "substitute", "find": "OLD_NAME", "replace": "NEW_NAME"},
+#    {"op": "set", "path": "./disabled", "value": "false"},
+#    {"op": "replace", "path": ".//hudson.plugins.git.BranchSpec/name", "find": "master", "replace": "main"},
+#    {"op": "expand", "path": ".//string", "token": "BRANCHES", "values": "develop,release main"}]
+# path is an ElementTree XPath (https://docs.python.org/3/library/xml.etree.elementtree.html#xpath-support),
+# taken from the root element; /project/... and //... forms work too.  A substitute with "markup": true works on
+# the raw config text instead, for patterns that have to match tags; those run before everything else.
+import json
+import re
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+
+# xml declaration, doctype and comments ahead of the root element, kept as they are (expat refuses the
+# version='1.1' declaration Jenkins writes)
+prolog_pattern = re.compile('(\\s*(<\\?.*?\\?>|<!--.*?-->|<!DOCTYPE[^>]*>))*\\s*', re.S)
+
+
+def escape_text(text):
+    # as xml.sax.saxutils.escape does (which costs urllib.request and http.client to import); a carriage return
+    # written as is would be read back as a newline
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#xd;')
+
+
+# a config parsed with expat into an element tree, noting where (in the UTF-8 source) each element, comment and
+# processing instruction is so that what the operations left alone can be written back byte for byte.  Tags and
+# attribute names are kept as written, prefixes and all.
+class SourceTree:
+    def __init__(self, text):
+        self.data = text.encode('utf-8')
+        self.spans = {}  # element => (start, end) offsets of its markup in data
+        self.before = {}  # element => (text, tail, attributes, children) as parsed
+        self.open = []  # start offsets of the elements being parsed
+        self.builder = ET.TreeBuilder(insert_comments=True, insert_pis=True)
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.ordered_attributes = True
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.builder.data
+        self.parser.CommentHandler = self.comment
+        self.parser.ProcessingInstructionHandler = self.pi
+        try:
+            self.parser.Parse(self.data, True)
+        except xml.parsers.expat.ExpatError as e:
+            raise ValueError('Config is not valid XML: {}'.format(e))
+        self.root = self.builder.close()
+        self.parser = None
+        self.remember(self.root)
+
+    def start(self, tag, attributes):
+        self.open.append(self.parser.CurrentByteIndex)
+        self.builder.start(tag, dict(zip(attributes[::2], attributes[1::2])) if attributes else {})
+
+    def end(self, tag):
+        start = self.open.pop()
+        index = self.parser.CurrentByteIndex
+        element = self.builder.end(tag)
+        # <tag/> is reported once past it, an end tag where it starts
+        if element.text is None and not len(element) and self.data[index - 2:index] == b'/>':
+            end = index
+        else:
+            end = self.data.index(b'>', index) + 1
+        self.spans[element] = (start, end)
+        for child in element:
+            self.remember(child)
+
+    def remember(self, element):
+        # called once element's tail is known, that is when its parent ends
+        self.before[element] = (element.text, element.tail, dict(element.attrib) if element.attrib else None,
+                                list(element))
+
+    def comment(self, text):
+        start = self.parser.CurrentByteIndex
+        self.spans[self.builder.comment(text)] = (start, self.data.index(b'-->', start) + 3)
+
+    def pi(self, target, text):
+        start = self.parser.CurrentByteIndex
+        self.spans[self.builder.pi(target, text)] = (start, self.data.index(b'?>', start) + 2)
+
+    def write(self, element, out):
+        # appends the markup of element, without its tail, to out
+        before = self.before.get(element)
+        if (not before or element.text != before[0] or (element.attrib or None) != before[2] or
+                list(element) != before[3]):
+            tail = element.tail
+            element.tail = None
+            out.append(ET.tostring(element, encoding='unicode').replace('\r', '&#xd;').encode('utf-8'))
+            element.tail = tail
+            return
+        (start, end) = self.spans[element]
+        children = before[3]
+        if not children:
+            out.append(self.data[start:end])
+            return
+        out.append(self.data[start:self.spans[children[0]][0]])
+        closing = self.data.rindex(b'</', start, end)
+        for (i, child) in enumerate(children):
+            self.write(child, out)
+            stop = self.spans[children[i + 1]][0] if i + 1 < len(children) else closing
+            if child.tail == self.before[child][1]:
+                out.append(self.data[self.spans[child][1]:stop])
+            elif child.tail:
+                out.append(escape_text(child.tail).encode('utf-8'))
+        out.append(self.data[closing:end])
+
+    def tostring(self):
+        # the source with the changes made to the tree since it was parsed
+        (start, end) = self.spans[self.root]
+        out = [self.data[:start]]
+        self.write(self.root, out)
+        out.append(self.data[end:])
+        return b''.join(out).decode('utf-8')
+
+
+def element_path(path, root):
+    # ElementTree path relative to root, None if it cannot match anything
+    if path.startswith('//'):
+        return '.' + path
+    if path.startswith('/'):
+        (first, slash, rest) = path[1:].partition('/')
+        if first not in (root.tag, '*'):
+            return None
+        return './' + rest if rest else '.'
+    return path
+
+
+def find(root, path):
+    if path is None:
+        return list(root.iter())
+    path = element_path(path, root)
+    return root.findall(path) if path else []
+
+
+# text substitution in the text, tail and attribute values of every element, or of the elements at path.  find
+# is a regex (or compiled pattern) and replace a re.sub() replacement string or function.
+class Substitute:
+    def __init__(self, find, replace, path=None, markup=False):
+        self.pattern = re.compile(find) if isinstance(find, str) else find
+        self.replace = replace
+        self.path = path
+        self.markup = markup  # applied to the raw config text by ConfigTransform
+
+    def sub(self, value):
+        if not value:
+            return value
+        return self.pattern.sub(self.replace, value)
+
+    def apply(self, root):
+        changed = False
+        for element in find(root, self.path):
+            for name in ('text', 'tail'):
+                value = getattr(element, name)
+                new = self.sub(value)
+                if new != value:
+                    setattr(element, name, new)
+                    changed = True
+            for (name, value) in element.attrib.items():
+                new = self.sub(value)
+                if new != value:
+                    element.attrib[name] = new
+                    changed = True
+        return changed
+
+
+# set the text (or attribute) of the elements at path to value
+class Set:
+    def __init__(self, path, value, attribute=None):
+        self.path = path
+        self.value = value
+        self.attribute = attribute
+
+    def apply(self, root):
+        changed = False
+        for element in find(root, self.path):
+            if self.attribute:
+                if element.get(self.attribute) != self.value:
+                    element.set(self.attribute, self.value)
+                    changed = True
+            elif element.text != self.value:
+                element.text = self.value
+                changed = True
+        return changed
+
+
+# regex find/replace in the text (or attribute) of the elements at path only
+class Replace(Substitute):
+    def __init__(self, path, find, replace, attribute=None):
+        Substitute.__init__(self, find, replace, path)
+        self.attribute = attribute
+
+    def apply(self, root):
+        changed = False
+        for element in find(root, self.path):
+            value = element.get(self.attribute) if self.attribute else element.text
+            new = self.sub(value)
+            if new == value:
+                continue
+            if self.attribute:
+                element.set(self.attribute, new)
+            else:
+                element.text = new
+            changed = True
+        return changed
+
+
+# elements at path whose whole text is token are replaced by one copy per value, eg. <string>BRANCHES</string>
+# becomes <string>develop</string><string>release</string>.  values is a list or a string split on commas and
+# whitespace.
+class Expand:
+    def __init__(self, path, token, values):
+        self.path = path
+        self.token = token
+        self.values = re.split('[,\\s]+', values.strip()) if isinstance(values, str) else list(values)
+
+    def apply(self, root):
+        targets = set(id(element) for element in find(root, self.path)
+                      if (element.text or '').strip() == self.token)
+        if not targets:
+            return False
+        for parent in root.iter():
+            children = list(parent)
+            if not any(id(child) in targets for child in children):
+                continue
+            expanded = []
+            for child in children:
+                if id(child) not in targets:
+                    expanded.append(child)
+                    continue
+                for value in self.values:
+                    copy = ET.Element(child.tag, child.attrib)
+                    copy.text = value
+                    copy.tail = child.tail
+                    expanded.append(copy)
+            parent[:] = expanded
+        return True
+
+
+operations = {'substitute': Substitute, 'set': Set, 'replace': Replace, 'expand': Expand}
+
+
+def load_operations(file):
+    # operations declared in a JSON file, raises ValueError describing the first bad one
+    with open(file) as fh:
+        try:
+            specs = json.load(fh)
+        except ValueError as e:
+            raise ValueError('{} is not valid JSON: {}'.format(file, e))
+    if not isinstance(specs, list):
+        raise ValueError('{} should hold a list of operations'.format(file))
+    loaded = []
+    for (i, spec) in enumerate(specs, 1):
+        op = operations.get(spec.pop('op', None)) if isinstance(spec, dict) else None
+        if not op:
+            raise ValueError('Operation {} in {} needs "op" set to one of {}'.format(i, file,
+                                                                                    ', '.join(operations)))
+        try:
+            loaded.append(op(**spec))
+        except (TypeError, re.error) as e:
+            raise ValueError('Operation {} in {} is not valid: {}'.format(i, file, e))
+    return loaded
+
+
+class ConfigTransform:
+    # ordered operations, built once and applied to every job config of a run
+    def __init__(self, operations=None):
+        self.operations = list(operations or [])
+
+    def add(self, operation):
+        self.operations.append(operation)
+
+    def apply(self, config):
+        operations = [operation for operation in self.operations if not getattr(operation, 'markup', False)]
+        for operation in self.operations:
+            if getattr(operation, 'markup', False):
+                config = operation.sub(config)
+        if not operations:
+            return config
+        prolog = prolog_pattern.match(config).end()
+        tree = SourceTree(config[prolog:])
+        changed = False
+        for operation in operations:
+            changed = operation.apply(tree.root) or changed
+        if not changed:
+            return config
+        return config[:prolog] + tree.tostring()
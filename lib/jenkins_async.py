@@ -0,0 +1,352 @@
+# asyncio Jenkins client for the calls bin/jenkins_cli.py makes per job, so that thousands of jobs can be in
+# flight on one thread.  It speaks HTTP/1.1 over asyncio streams itself with pooled keep-alive connections, a
+# semaphore capping requests in flight, and the same retries, backoff, rate limit and metrics as
+# JenkinsTransport.  Like the requests session under JenkinsTransport it keeps the cookies the controller sets
+# (crumbs belong to a session since Jenkins 2.176), verifies against the same CA bundle and goes through the
+# same proxy.  Method names and arguments follow python-jenkins.
+import asyncio
+import base64
+import http.cookies
+import json
+import os
+import ssl
+import time
+import urllib.parse
+
+from lib import profiler
+from lib.jenkins_transport import EndpointMetrics, RetryPolicy, TokenBucket, endpoint_name, session_settings
+
+
+class JenkinsError(Exception):
+    pass
+
+
+class NotFoundError(JenkinsError):
+    pass
+
+
+def ssl_context(verify, cert=None):
+    # context for a requests style verify (CA bundle file or directory, or False) and client certificate
+    context = ssl.create_default_context()
+    if verify is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif os.path.isdir(verify):
+        context.load_verify_locations(capath=verify)
+    else:
+        context.load_verify_locations(cafile=verify)
+    if isinstance(cert, tuple):
+        context.load_cert_chain(*cert)
+    elif cert:
+        context.load_cert_chain(cert)
+    return context
+
+
+def basic_auth(username, password):
+    token = '{}:{}'.format(username, password or '').encode('utf-8')
+    return 'Basic ' + base64.b64encode(token).decode('ascii')
+
+
+def job_path(name):
+    # 'folder/job' => 'job/folder/job/job/'
+    return ''.join('job/{}/'.format(urllib.parse.quote(part, safe='')) for part in name.split('/'))
+
+
+class AsyncJenkins(RetryPolicy):
+    def __init__(self, url, username=None, password=None, timeout=30, retries=3, backoff=0.5, max_backoff=30,
+                 rate=None, limit=100, metrics=None, session=None):
+        # session is the requests session whose CA bundle, client certificate and proxy settings to use, by
+        # default a new one (which reads them from the environment)
+        self.server = url if url.endswith('/') else url + '/'
+        parts = urllib.parse.urlsplit(self.server)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.netloc = parts.netloc.rpartition('@')[2]
+        self.base_path = parts.path
+        (verify, cert, proxy) = session_settings(self.server, session)
+        self.ssl = ssl_context(verify, cert) if parts.scheme == 'https' else None
+        self.proxy = urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy) if proxy else None
+        if self.proxy and self.proxy.scheme != 'http':
+            raise JenkinsError('Proxy {} is not supported, only http:// proxies are'.format(proxy))
+        self.proxy_auth = None
+        if self.proxy and self.proxy.username:
+            self.proxy_auth = basic_auth(urllib.parse.unquote(self.proxy.username),
+                                         urllib.parse.unquote(self.proxy.password or ''))
+        self.auth = basic_auth(username, password) if username else None
+        self.cookies = {}  # name => value of the cookies the controller set
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate) if rate else None
+        self.metrics = metrics or EndpointMetrics()
+        self.semaphore = asyncio.Semaphore(limit)
+        self.idle = []  # keep-alive connections, (reader, writer)
+        self.crumb = None
+        self.crumb_lock = asyncio.Lock()
+
+    @classmethod
+    def from_transport(cls, server, username=None, password=None, limit=100):
+        # async twin of a JenkinsTransport, with its settings and recording into its metrics
+        return cls(server.server, username, password, server.timeout, server.retries, server.backoff,
+                   server.max_backoff, server.bucket.rate if server.bucket else None, limit, server.metrics,
+                   server._session)
+
+    async def close(self):
+        while self.idle:
+            (reader, writer) = self.idle.pop()
+            writer.close()
+
+    async def read_response(self, reader, method):
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            (key, sep, value) = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+            if key.strip().lower() == 'set-cookie' and method != 'CONNECT':
+                self.set_cookie(value.strip())
+        if method in ('HEAD', 'CONNECT') or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            while (await reader.readline()).strip():  # trailers
+                pass
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            headers['connection'] = 'close'
+        return status, headers, body
+
+    def set_cookie(self, header):
+        cookie = http.cookies.SimpleCookie()
+        try:
+            cookie.load(header)
+        except http.cookies.CookieError:
+            return
+        for (name, morsel) in cookie.items():
+            if morsel['max-age'] == '0':
+                self.cookies.pop(name, None)
+                continue
+            if self.crumb and self.cookies.get(name) != morsel.value:
+                self.crumb = None  # a new session needs a crumb of its own
+            self.cookies[name] = morsel.value
+
+    async def connect(self):
+        # a new connection to the controller.  Through a proxy, https goes in a CONNECT tunnel and http requests
+        # go to the proxy with the full URL (see send()).
+        if not self.proxy:
+            return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        (reader, writer) = await asyncio.open_connection(self.proxy.hostname, self.proxy.port or 80)
+        if not self.ssl:
+            return reader, writer
+        target = '{}:{}'.format(self.host, self.port)
+        head = ['CONNECT {} HTTP/1.1'.format(target), 'Host: ' + target]
+        if self.proxy_auth:
+            head.append('Proxy-Authorization: ' + self.proxy_auth)
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            (status, headers, body) = await self.read_response(reader, 'CONNECT')
+            if status != 200:
+                raise ConnectionError('Proxy {} refused a tunnel to {}: HTTP {}'.format(self.proxy.netloc, target,
+                                                                                       status))
+            await writer.start_tls(self.ssl, server_hostname=self.host)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def send(self, method, path, body, headers):
+        # one request on a pooled connection, or a new one.  A pooled connection the server closed meanwhile
+        # fails before any response arrives, and the request goes again on a fresh connection.
+        target = self.base_path + path
+        if self.proxy and not self.ssl:
+            target = 'http://' + self.netloc + target
+        head = ['{} {} HTTP/1.1'.format(method, target), 'Host: ' + self.netloc,
+                'Content-Length: {}'.format(len(body))]
+        if self.auth:
+            head.append('Authorization: ' + self.auth)
+        if self.proxy_auth and not self.ssl:
+            head.append('Proxy-Authorization: ' + self.proxy_auth)
+        if self.cookies:
+            head.append('Cookie: ' + '; '.join('{}={}'.format(name, value) for (name, value) in self.cookies.items()))
+        head.extend('{}: {}'.format(key, value) for (key, value) in headers.items())
+        data = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+        while True:
+            reused = bool(self.idle)
+            if reused:
+                (reader, writer) = self.idle.pop()
+            else:
+                (reader, writer) = await asyncio.wait_for(self.connect(), self.timeout)
+            try:
+                writer.write(data)
+                await writer.drain()
+                response = await asyncio.wait_for(self.read_response(reader, method), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if response[1].get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self.idle.append((reader, writer))
+            return response
+
+    async def add_crumb(self, headers):
+        # CSRF crumb for posts, asked for once; controllers that do not issue crumbs answer 404
+        async with self.crumb_lock:
+            if self.crumb is None:
+                self.crumb = {}
+                try:
+                    (status, response_headers, body) = await self.request('GET', 'crumbIssuer/api/json',
+                                                                          crumb=False)
+                    crumb = json.loads(body.decode('utf-8'))
+                    self.crumb = {crumb['crumbRequestField']: crumb['crumb']}
+                except NotFoundError:
+                    pass
+        headers.update(self.crumb)
+
+    async def request(self, method, path, body=b'', headers=None, crumb=True):
+        # (status, headers, body) of a request to path under the server URL, raising NotFoundError on 404 and
+        # JenkinsError on other failures
+        headers = dict(headers or {})
+        if method == 'POST' and crumb:
+            await self.add_crumb(headers)
+        endpoint = endpoint_name(method, self.server + path, self.base_path)
+        attempts = self.attempts(method, endpoint)
+        async with self.semaphore:
+            for attempt in range(attempts):
+                if self.bucket:
+                    while True:
+                        wait = self.bucket.try_acquire()
+                        if not wait:
+                            break
+                        await asyncio.sleep(wait)
+                start = time.monotonic()
+                try:
+                    (status, response_headers, data) = await self.send(method, path, body, headers)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    seconds = time.monotonic() - start
+                    self.metrics.record(endpoint, seconds, error=True, retry=attempt > 0)
+                    profiler.record('jenkins', '{} {}{}'.format(method, self.server, path), seconds, group=endpoint)
+                    if attempt + 1 >= attempts:
+                        raise JenkinsError('{} {}{} failed: {}'.format(method, self.server, path,
+                                                                     e or type(e).__name__))
+                    await asyncio.sleep(self.delay(attempt))
+                    continue
+                seconds = time.monotonic() - start
+                self.metrics.record(endpoint, seconds, len(data), status >= 400, attempt > 0)
+                profiler.record('jenkins', '{} {}{}'.format(method, self.server, path), seconds,
+                                len(data) + len(body), endpoint)
+                if status in self.retry_statuses and attempt + 1 < attempts:
+                    await asyncio.sleep(self.delay(attempt))
+                    continue
+                break
+        if status == 404:
+            raise NotFoundError('{} {}{} not found'.format(method, self.server, path))
+        if status >= 400:
+            raise JenkinsError('{} {}{} failed: HTTP {}'.format(method, self.server, path, status))
+        return status, response_headers, data
+
+    async def post(self, path, config=None):
+        headers = {'Content-Type': 'text/xml; charset=utf-8'} if config is not None else {}
+        body = config.encode('utf-8') if config is not None else b''
+        return await self.request('POST', path, body, headers)
+
+    async def get_info(self, item='', query=None):
+        (status, headers, body) = await self.request('GET', item + ('/' if item else '') + 'api/json' +
+                                                     (query or ''))
+        return json.loads(body.decode('utf-8'))
+
+    async def job_exists(self, name):
+        try:
+            await self.request('GET', job_path(name) + 'api/json?tree=name')
+        except NotFoundError:
+            return False
+        return True
+
+    async def get_job_config(self, name):
+        (status, headers, body) = await self.request('GET', job_path(name) + 'config.xml')
+        return body.decode('utf-8')
+
+    async def fetch_job_config(self, name, headers=None):
+        # see JenkinsTransport.fetch_job_config()
+        (status, response_headers, body) = await self.request('GET', job_path(name) + 'config.xml',
+                                                               headers=headers)
+        # same header names as requests gives, for JobConfigCache
+        response_headers = {'ETag': response_headers.get('etag'),
+                            'Last-Modified': response_headers.get('last-modified')}
+        if status == 304:
+            return status, None, response_headers
+        return status, body.decode('utf-8'), response_headers
+
+    async def reconfig_job(self, name, config):
+        await self.post(job_path(name) + 'config.xml', config)
+
+    async def create_job(self, name, config):
+        (folder, sep, short_name) = name.rpartition('/')
+        path = (job_path(folder) if folder else '') + 'createItem?name=' + urllib.parse.quote(short_name, safe='')
+        await self.post(path, config)
+
+    async def delete_job(self, name):
+        await self.post(job_path(name) + 'doDelete')
+
+    async def rename_job(self, from_name, to_name):
+        short_name = to_name.rpartition('/')[2]
+        await self.post(job_path(from_name) + 'doRename?newName=' + urllib.parse.quote(short_name, safe=''))
+
+    async def enable_job(self, name):
+        await self.post(job_path(name) + 'enable')
+
+    async def disable_job(self, name):
+        await self.post(job_path(name) + 'disable')
+
+    async def build_job(self, name, parameters=None, token=None):
+        # queue item number of the build
+        query = dict(parameters or {})
+        if token:
+            query['token'] = token
+        path = job_path(name) + ('buildWithParameters' if parameters else 'build')
+        if query:
+            path += '?' + urllib.parse.urlencode(query)
+        (status, headers, body) = await self.post(path)
+        location = headers.get('location', '').rstrip('/')
+        return int(location.rsplit('/', 1)[1]) if location.rsplit('/', 1)[-1].isdigit() else None
+
+    async def get_views(self):
+        return (await self.get_info(query='?tree=views[name,url]')).get('views', [])
+
+    async def view_exists(self, name):
+        try:
+            await self.request('GET', 'view/{}/api/json?tree=name'.format(urllib.parse.quote(name, safe='')))
+        except NotFoundError:
+            return False
+        return True
+
+    async def get_view_config(self, name):
+        (status, headers, body) = await self.request('GET', 'view/{}/config.xml'.format(
+            urllib.parse.quote(name, safe='')))
+        return body.decode('utf-8')
+
+    async def reconfig_view(self, name, config):
+        await self.post('view/{}/config.xml'.format(urllib.parse.quote(name, safe='')), config)
+
+    async def create_view(self, name, config):
+        await self.post('createView?name=' + urllib.parse.quote(name, safe=''), config)
@@ -0,0 +1,166 @@
+# HTTP transport for python-jenkins: pooled keep-alive connections, timeouts, retries with backoff and a request
+# rate limit, plus call/time/byte metrics per endpoint
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+import jenkins
+import requests
+from requests.adapters import HTTPAdapter
+
+from lib import profiler
+
+
+# token bucket allowing rate requests per second on average and bursts of up to burst requests
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        # takes a token and returns 0, or returns the seconds until one is available
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+# calls, errors, retries, seconds and bytes received per endpoint ('GET job/*/config.xml')
+class EndpointMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, seconds, bytes=0, error=False, retry=False):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {'calls': 0, 'errors': 0, 'retries': 0, 'seconds': 0.0,
+                                                         'bytes': 0, 'max_seconds': 0.0})
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['retries'] += int(retry)
+            stats['seconds'] += seconds
+            stats['bytes'] += bytes
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def report(self):
+        # table of endpoints, most total time first
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        lines = ['{:<45} {:>7} {:>6} {:>7} {:>9} {:>9} {:>9} {:>10}'.format(
+            'endpoint', 'calls', 'errors', 'retries', 'total s', 'avg ms', 'max ms', 'KB')]
+        for (endpoint, stats) in endpoints:
+            lines.append('{:<45} {:>7} {:>6} {:>7} {:>9.2f} {:>9.1f} {:>9.1f} {:>10.1f}'.format(
+                endpoint, stats['calls'], stats['errors'], stats['retries'], stats['seconds'],
+                stats['seconds'] * 1000 / stats['calls'], stats['max_seconds'] * 1000, stats['bytes'] / 1024.0))
+        return '\n'.join(lines)
+
+
+def endpoint_name(method, url, base_path='/'):
+    # request url reduced to an endpoint, with job/view names and numbers replaced by '*' and jobs in folders
+    # counted with top level ones
+    path = urllib.parse.urlsplit(url).path
+    if path.startswith(base_path):
+        path = path[len(base_path):]
+    path = re.sub('(^|/)(job|view)/[^/]+', '\\1\\2/*', path)
+    path = re.sub('(job/\\*/)+', 'job/*/', path)
+    path = re.sub('(^|/)\\d+(?=/|$)', '\\1*', path)
+    return '{} {}'.format(method, path)
+
+
+def session_settings(url, session=None):
+    # (CA bundle path or False, client certificate, proxy URL or None) a requests session uses for url, from its
+    # own settings and REQUESTS_CA_BUNDLE, CURL_CA_BUNDLE, *_proxy and no_proxy in the environment
+    settings = (session or requests.Session()).merge_environment_settings(url, {}, None, None, None)
+    verify = requests.certs.where() if settings['verify'] is True else settings['verify']
+    return verify, settings['cert'], requests.utils.select_proxy(url, settings['proxies'])
+
+
+# which requests are retried and how long to wait before each retry, the same for JenkinsTransport and
+# AsyncJenkins; retries, backoff and max_backoff are set by each
+class RetryPolicy:
+    idempotent = ('GET', 'HEAD', 'OPTIONS')
+    # posts that leave the same result however often they are repeated
+    idempotent_posts = ('POST job/*/config.xml', 'POST view/*/config.xml', 'POST job/*/enable',
+                        'POST job/*/disable')
+    retry_statuses = (502, 503, 504)  # controller restarting or stuck in a GC pause
+
+    def attempts(self, method, endpoint):
+        # tries a request gets: retries only for idempotent ones
+        return 1 + (self.retries if method in self.idempotent or endpoint in self.idempotent_posts else 0)
+
+    def delay(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+# python-jenkins client with every request going through the transport above
+class JenkinsTransport(RetryPolicy, jenkins.Jenkins):
+    def __init__(self, url, username=None, password=None, timeout=30, retries=3, backoff=0.5, max_backoff=30,
+                 rate=None, pool_size=10):
+        jenkins.Jenkins.__init__(self, url, username, password, timeout=timeout)
+        self.retries = retries  # retries of idempotent requests only
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(rate) if rate else None
+        self.metrics = EndpointMetrics()
+        self.base_path = urllib.parse.urlsplit(self.server).path
+        # keep-alive connections for every worker thread instead of requests' default of 10, and no retries at
+        # the urllib3 level since they are done here
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self._session.mount(urllib.parse.urlsplit(self.server).scheme + '://', adapter)
+
+    def fetch_job_config(self, name, headers=None):
+        # (status, config, response headers) of a conditional GET of a job config, sending validators such as
+        # If-None-Match in headers; status 304 comes with no config
+        folder_url, short_name = self._get_job_folder(name)
+        request = requests.Request('GET', self._build_url(jenkins.CONFIG_JOB, locals()), headers=headers or {})
+        response = self.jenkins_request(request)
+        if response.status_code == 304:
+            return response.status_code, None, response.headers
+        return response.status_code, response.text, response.headers
+
+    def _request(self, req, stream=None):
+        method = req.method.upper()
+        endpoint = endpoint_name(method, req.url, self.base_path)
+        attempts = self.attempts(method, endpoint)
+        for attempt in range(attempts):
+            if self.bucket:
+                self.bucket.acquire()
+            retry = attempt > 0
+            start = time.monotonic()
+            try:
+                response = jenkins.Jenkins._request(self, req, stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                seconds = time.monotonic() - start
+                self.metrics.record(endpoint, seconds, error=True, retry=retry)
+                profiler.record('jenkins', '{} {}'.format(method, req.url), seconds, group=endpoint)
+                if attempt + 1 >= attempts:
+                    raise
+                time.sleep(self.delay(attempt))
+                continue
+            seconds = time.monotonic() - start
+            received = 0 if stream else len(response.content)
+            self.metrics.record(endpoint, seconds, received, response.status_code >= 400, retry)
+            # the profile counts bytes sent as well
+            sent = len(req.data) if isinstance(req.data, (bytes, str)) else 0
+            profiler.record('jenkins', '{} {}'.format(method, req.url), seconds, received + sent, endpoint)
+            if response.status_code in self.retry_statuses and attempt + 1 < attempts:
+                time.sleep(self.delay(attempt))
+                continue
+            return response
@@ -0,0 +1,270 @@
+# jenkins monitoring utilities
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import shutil
+import time
+
+from lib.utils import create_host, read_properties, write_json
+
+
+# long running monitor of a Jenkins host driven by config/jenkins_monitoring.properties
+class Monitor:
+    name = "Monitor"
+
+    def __init__(self, property_file, host=None, interval=60, history=60, hysteresis=5, alert=None):
+        print("Creating %s" % self.name)
+        self.property_file = property_file
+        self.host = host or create_host()  # detected once, not on every sample
+        self.interval = interval
+        self.hysteresis = hysteresis  # percent usage has to drop below threshold before alerting again
+        self.alert = alert or self.print_alert
+        self.properties = {}
+        self.properties_mtime = None
+        # mount point => ring buffer of (time, disk %, inode %) samples
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=history))
+        # (mount point, 'diskspace'|'inodes') => True while over threshold
+        self.alerting = {}
+
+    def load_properties(self):
+        # re-read property file whenever it changes, returns True if it was (re)loaded
+        try:
+            mtime = os.stat(self.property_file).st_mtime
+        except OSError as e:
+            print('ERROR: Keeping previous properties, cannot read {}: {}'.format(self.property_file, e))
+            return False
+        if mtime == self.properties_mtime:
+            return False
+        print("Loading monitoring properties from %s" % self.property_file)
+        self.properties = read_properties(self.property_file)
+        self.properties_mtime = mtime
+        return True
+
+    def threshold(self, name):
+        value = self.properties.get(name)
+        return int(value) if value else None
+
+    def print_alert(self, level, mount, kind, percent, threshold):
+        timestamp = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now())
+        print('{}: {}: Partition {} has {}% of {} (threshold = {}%)'.format(
+            timestamp, level, mount, percent, kind, threshold))
+
+    def check(self, mount, kind, percent, threshold):
+        # alert once when usage crosses above threshold, recover once it drops below threshold - hysteresis
+        if percent is None or threshold is None:
+            return
+        key = (mount, kind)
+        if not self.alerting.get(key) and percent > threshold:
+            self.alerting[key] = True
+            self.alert('ERROR', mount, kind, percent, threshold)
+        elif self.alerting.get(key) and percent <= threshold - self.hysteresis:
+            self.alerting[key] = False
+            self.alert('RECOVERED', mount, kind, percent, threshold)
+
+    def sample(self):
+        now = time.time()
+        disk_threshold = self.threshold('DISKSPACE_THRESHOLD')
+        inode_threshold = self.threshold('INODE_THRESHOLD')
+        partitions = self.host.partitions()
+        for part in partitions:
+            mount = part['mount']
+            self.history[mount].append((now, part['disk_percent'], part['inode_percent']))
+            self.check(mount, 'diskspace', part['disk_percent'], disk_threshold)
+            self.check(mount, 'inodes', part['inode_percent'], inode_threshold)
+        return partitions
+
+    def run(self, count=None):
+        # sample every interval seconds, count times or forever
+        i = 0
+        while count is None or i < count:
+            start = time.time()
+            self.load_properties()
+            self.sample()
+            i += 1
+            if count is None or i < count:
+                time.sleep(max(0, self.interval - (time.time() - start)))
+
+
+# purge of Jenkins builds older than JENKINS_BUILD_LOG_PURGE_DAYS under $JENKINS_HOME/jobs/**/builds.  The newest
+# purged build number of each job is remembered in state_file, so later runs only look at builds after it.
+class BuildPurger:
+    name = "BuildPurger"
+
+    def __init__(self, jenkins_home, days, state_file='/var/tmp/jenkins_build_purge.json', workers=8,
+                 batch_size=500, dryrun=False):
+        print("Creating %s" % self.name)
+        self.jenkins_home = jenkins_home
+        self.cutoff = time.time() - float(days) * 86400
+        self.state_file = state_file
+        self.workers = workers
+        self.batch_size = batch_size  # build directories deleted per batch
+        self.dryrun = dryrun
+        self.state = {}
+        if state_file and os.path.isfile(state_file):
+            with open(state_file) as fh:
+                self.state = json.load(fh)
+
+    def save_state(self):
+        if not self.state_file or self.dryrun:
+            return
+        write_json(self.state_file, self.state)
+
+    def job_dirs(self, dir=None):
+        # job directories under jobs/, descending into folders (which have a jobs/ of their own)
+        dir = dir or os.path.join(self.jenkins_home, 'jobs')
+        try:
+            entries = list(os.scandir(dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if os.path.isdir(os.path.join(entry.path, 'builds')):
+                yield entry.path
+            if os.path.isdir(os.path.join(entry.path, 'jobs')):
+                yield from self.job_dirs(os.path.join(entry.path, 'jobs'))
+
+    def state_entry(self, job):
+        # {'purged': number of the last build purged, 'kept': old builds kept} of a job; state files of earlier
+        # versions hold the number alone
+        entry = self.state.get(job)
+        if isinstance(entry, int):
+            return {'purged': entry, 'kept': []}
+        return entry or {'purged': 0, 'kept': []}
+
+    def expired_builds(self, job_dir):
+        # (job, last build purged, [(job, number, path)] of builds to purge oldest first, [numbers] of builds older
+        # than cutoff that are kept).  Kept, like Jenkins' LogRotator does, are the latest build, builds marked
+        # "keep forever" and the targets of lastSuccessfulBuild and lastStableBuild.  Builds up to the last one
+        # purged are not looked at again, except the ones kept last time.
+        job = os.path.relpath(job_dir, self.jenkins_home)
+        builds_dir = os.path.join(job_dir, 'builds')
+        builds = []
+        for entry in os.scandir(builds_dir):
+            # lastSuccessfulBuild and friends are symlinks
+            if entry.name.isdigit() and entry.is_dir(follow_symlinks=False):
+                builds.append((int(entry.name), entry.path))
+        builds.sort()
+        state = self.state_entry(job)
+        if not builds or builds[-1][0] < state['purged']:
+            # the job was deleted and created again, or its numbering restarted
+            state = {'purged': 0, 'kept': []}
+        permalinks = permalink_targets(builds_dir)
+        kept_before = set(state['kept'])
+        expired = []
+        kept = []
+        for (number, path) in builds[:-1]:
+            if number <= state['purged'] and number not in kept_before:
+                continue
+            try:
+                mtime = os.stat(os.path.join(path, 'build.xml')).st_mtime
+            except OSError:
+                mtime = os.stat(path).st_mtime
+            if mtime >= self.cutoff:
+                # builds are numbered in order, everything after this one is newer still
+                break
+            if number in permalinks or keep_log(path):
+                kept.append(number)
+            else:
+                expired.append((job, number, path))
+        return job, state['purged'], expired, kept
+
+    def delete_batch(self, batch):
+        # remove (or only count, in dry run) a batch of build directories, returns (deleted, files, bytes)
+        deleted = []
+        files = 0
+        bytes = 0
+        for (job, number, path) in batch:
+            (f, b) = dir_usage(path)
+            if not self.dryrun:
+                shutil.rmtree(path)
+            deleted.append((job, number))
+            files += f
+            bytes += b
+        return deleted, files, bytes
+
+    def run(self):
+        print('{} builds older than {:%Y-%m-%d %H:%M:%S} under {}'.format(
+            'Dryrun mode - counting' if self.dryrun else 'Purging', datetime.datetime.fromtimestamp(self.cutoff),
+            self.jenkins_home))
+        totals = {'jobs': 0, 'builds': 0, 'files': 0, 'bytes': 0}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            expired = []
+            jobs = set()
+            for (job, purged, builds, kept) in executor.map(self.expired_builds, self.job_dirs()):
+                totals['jobs'] += 1
+                jobs.add(job)
+                self.state[job] = {'purged': purged, 'kept': kept}
+                expired.extend(builds)
+            # jobs deleted since the last run
+            for job in set(self.state) - jobs:
+                del self.state[job]
+            self.save_state()
+            batches = [expired[i:i + self.batch_size] for i in range(0, len(expired), self.batch_size)]
+            for (deleted, files, bytes) in executor.map(self.delete_batch, batches):
+                for (job, number) in deleted:
+                    self.state[job]['purged'] = max(number, self.state[job]['purged'])
+                totals['builds'] += len(deleted)
+                totals['files'] += files
+                totals['bytes'] += bytes
+                print('{} {} builds, {} files, {:.1f} MB'.format('Would purge' if self.dryrun else 'Purged',
+                                                                  totals['builds'], totals['files'],
+                                                                  totals['bytes'] / 1048576.0))
+                # remember progress batch by batch, an interrupted run picks up where it stopped
+                self.save_state()
+        print('Scanned {} jobs, {} {} builds ({} files, {:.1f} MB)'.format(
+            totals['jobs'], 'would purge' if self.dryrun else 'purged', totals['builds'], totals['files'],
+            totals['bytes'] / 1048576.0))
+        return totals
+
+
+# permalinks whose builds Jenkins' LogRotator keeps
+kept_permalinks = ('lastSuccessfulBuild', 'lastStableBuild')
+
+
+def permalink_targets(builds_dir):
+    # numbers of the builds kept_permalinks point to: symlinks in builds/ on older Jenkins, lines of
+    # builds/permalinks ('lastStableBuild 42') on newer ones
+    targets = set()
+    for name in kept_permalinks:
+        try:
+            target = os.readlink(os.path.join(builds_dir, name))
+        except OSError:
+            continue
+        if target.isdigit():
+            targets.add(int(target))
+    try:
+        with open(os.path.join(builds_dir, 'permalinks')) as fh:
+            for line in fh:
+                (name, sep, number) = line.strip().partition(' ')
+                if name in kept_permalinks and number.isdigit():
+                    targets.add(int(number))
+    except OSError:
+        pass
+    return targets
+
+
+def keep_log(build_dir):
+    # whether the build is marked "keep this build forever"
+    try:
+        with open(os.path.join(build_dir, 'build.xml'), 'rb') as fh:
+            return b'<keepLog>true</keepLog>' in fh.read()
+    except OSError:
+        return False
+
+
+def dir_usage(path):
+    # (files, bytes) under path, not following symlinks
+    files = 0
+    bytes = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            (f, b) = dir_usage(entry.path)
+            files += f
+            bytes += b
+        else:
+            files += 1
+            bytes += entry.stat(follow_symlinks=False).st_size
+    return files, bytes
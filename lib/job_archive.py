@@ -0,0 +1,153 @@
+# tar archives of Jenkins job and view configs, compressed by file extension (.tar.gz, .tar.xz, .tar.bz2, or
+# .tar.zst with the zstandard package), written and read as a stream so neither side keeps the whole archive
+# in memory or extracts it to disk.  Configs are stored as jobs/<name>.xml and views/<name>.xml, with their
+# sha1 and disabled state in pax headers, so a reader can verify and apply each one as it arrives; manifest.json
+# at the end lists everything in the archive.
+import hashlib
+import io
+import json
+import lzma
+import os
+import tarfile
+import time
+
+manifest_name = 'manifest.json'
+# stored as user extended attributes, which tar tools know to skip unless asked to restore them
+pax_sha1 = 'SCHILY.xattr.user.jenkins.sha1'
+pax_disabled = 'SCHILY.xattr.user.jenkins.disabled'
+
+
+def compression(path):
+    # tarfile compression of an archive file name, 'zst' for zstandard which tarfile does not do itself
+    for (suffixes, kind) in ((('.gz', '.tgz'), 'gz'), (('.bz2', '.tbz2'), 'bz2'), (('.xz', '.txz'), 'xz'),
+                             (('.zst', '.tzst'), 'zst')):
+        if path.endswith(suffixes):
+            return kind
+    return ''
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def zstandard_module():
+    try:
+        import zstandard
+    except ImportError:
+        raise ArchiveError('.zst archives need the zstandard package (pip install zstandard)')
+    return zstandard
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class ArchiveWriter:
+    def __init__(self, path, source=None):
+        self.path = path
+        self.manifest = {'version': 1, 'source': source, 'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                         'views': {}, 'jobs': {}}
+        kind = compression(path)
+        zstandard = zstandard_module() if kind == 'zst' else None
+        try:
+            self.fh = open(path, 'wb')
+        except OSError as e:
+            raise ArchiveError('Cannot write {}: {}'.format(path, e))
+        self.zst = None
+        if zstandard:
+            self.zst = zstandard.ZstdCompressor().stream_writer(self.fh)
+            self.tar = tarfile.open(fileobj=self.zst, mode='w|', format=tarfile.PAX_FORMAT)
+        else:
+            self.tar = tarfile.open(fileobj=self.fh, mode='w|' + kind, format=tarfile.PAX_FORMAT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def add_file(self, name, data, pax_headers=None):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = 0o644
+        info.pax_headers = pax_headers or {}
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def add(self, kind, name, config, disabled=None):
+        # kind is 'jobs' or 'views'
+        data = config.encode('utf-8')
+        file = '{}/{}.xml'.format(kind, name)
+        entry = {'file': file, 'sha1': sha1(data), 'size': len(data)}
+        headers = {pax_sha1: entry['sha1']}
+        if disabled is not None:
+            entry['disabled'] = disabled
+            headers[pax_disabled] = 'true' if disabled else 'false'
+        self.add_file(file, data, headers)
+        self.manifest[kind][name] = entry
+
+    def close(self):
+        if self.tar is None:
+            return
+        self.add_file(manifest_name, json.dumps(self.manifest, indent=1, sort_keys=True).encode('utf-8'))
+        self.tar.close()
+        self.tar = None
+        if self.zst:
+            self.zst.close()  # closes self.fh as well
+        else:
+            self.fh.close()
+
+    def abort(self):
+        # remove the partly written archive rather than leave one behind that looks complete
+        if self.tar is None:
+            return
+        self.tar = None
+        (self.zst or self.fh).close()
+        os.remove(self.path)
+
+
+class ArchiveReader:
+    # iterating yields (kind, name, config, disabled, ok) in archive order, ok being False when the config
+    # does not match its sha1.  self.manifest is set once iteration reaches it.
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+
+    def __iter__(self):
+        kind = compression(self.path)
+        zstandard = zstandard_module() if kind == 'zst' else None
+        errors = (tarfile.TarError, EOFError, OSError, ValueError, lzma.LZMAError)
+        if zstandard:
+            errors += (zstandard.ZstdError,)
+        try:
+            yield from self.read(kind, zstandard)
+        except errors as e:
+            # corrupt or truncated archive, as told by tarfile or whichever decompressor
+            raise ArchiveError('Cannot read {}: {}'.format(self.path, e))
+
+    def read(self, kind, zstandard):
+        with open(self.path, 'rb') as fh:
+            if zstandard:
+                stream = zstandard.ZstdDecompressor().stream_reader(fh)
+                tar = tarfile.open(fileobj=stream, mode='r|')
+            else:
+                tar = tarfile.open(fileobj=fh, mode='r|' + kind)
+            with tar:
+                for info in tar:
+                    if not info.isfile() or '/' not in info.name and info.name != manifest_name:
+                        continue
+                    data = tar.extractfile(info).read()
+                    if info.name == manifest_name:
+                        self.manifest = json.loads(data.decode('utf-8'))
+                        continue
+                    (kind, name) = info.name.split('/', 1)
+                    if kind not in ('jobs', 'views') or not name.endswith('.xml'):
+                        continue
+                    disabled = info.pax_headers.get(pax_disabled)
+                    if disabled is not None:
+                        disabled = disabled == 'true'
+                    ok = info.pax_headers.get(pax_sha1) in (None, sha1(data))
+                    yield kind, name[:-len('.xml')], data.decode('utf-8'), disabled, ok
@@ -0,0 +1,131 @@
+# Where the time of a run goes: wall time of each phase (listing jobs, processing them, ...) and of every
+# operation inside them (each Jenkins call, subprocess, config transform, diff), with bytes transferred, kept per
+# kind and group of operation plus the slowest ones individually.  Nothing is recorded unless a profiler was
+# started, so instrumented code costs one global lookup otherwise.
+#
+#   profiler.start()
+#   with profiler.phase('list jobs'):
+#       with profiler.timed('jenkins', 'GET api/json'):
+#           ...
+#   profiler.active.write('profile.json'); print(profiler.active.table())
+import contextlib
+import copy
+import heapq
+import itertools
+import json
+import sys
+import threading
+import time
+
+active = None  # the running Profiler, if any
+
+
+def new_stats():
+    return {'count': 0, 'seconds': 0.0, 'bytes': 0, 'max_seconds': 0.0}
+
+
+def add_stats(stats, seconds, bytes=0):
+    stats['count'] += 1
+    stats['seconds'] += seconds
+    stats['bytes'] += bytes
+    stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+
+class Profiler:
+    def __init__(self, keep=100):
+        self.lock = threading.Lock()
+        self.keep = keep  # slowest operations kept individually
+        self.started = time.time()
+        self.start_clock = time.monotonic()
+        self.phases = {}  # phase => stats, phases running on several threads at once add up
+        self.kinds = {}  # kind => stats, with 'groups' => group => stats
+        self.slowest = []  # min-heap of (seconds, sequence, kind, name, bytes)
+        self.sequence = itertools.count()
+
+    def record(self, kind, name, seconds, bytes=0, group=None):
+        # an operation of kind ('jenkins', 'subprocess', ...) named name, counted under group (default: kind)
+        with self.lock:
+            stats = self.kinds.setdefault(kind, dict(new_stats(), groups={}))
+            add_stats(stats, seconds, bytes)
+            add_stats(stats['groups'].setdefault(group or kind, new_stats()), seconds, bytes)
+            item = (seconds, next(self.sequence), kind, name, bytes)
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, item)
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def record_phase(self, name, seconds):
+        with self.lock:
+            add_stats(self.phases.setdefault(name, new_stats()), seconds)
+
+    def report(self):
+        # everything recorded, as a dict ready for json.dump()
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+            return {'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.started)),
+                    'seconds': time.monotonic() - self.start_clock, 'argv': sys.argv,
+                    'phases': copy.deepcopy(self.phases), 'operations': copy.deepcopy(self.kinds),
+                    'slowest': [{'kind': kind, 'name': name, 'seconds': seconds, 'bytes': bytes}
+                                for (seconds, sequence, kind, name, bytes) in slowest]}
+
+    def write(self, file):
+        with open(file, 'w') as fh:
+            json.dump(self.report(), fh, indent=1, sort_keys=True)
+
+    def table(self, top=20):
+        # phases, operations per kind and the top slowest operations, as text
+        report = self.report()
+        lines = ['Profile of {:.2f} s'.format(report['seconds']),
+                 '{:<45} {:>7} {:>9} {:>9} {:>9} {:>10}'.format('phase / operation', 'count', 'total s', 'avg ms',
+                                                                 'max ms', 'KB')]
+        rows = [(name, stats) for (name, stats) in report['phases'].items()]
+        for (kind, stats) in sorted(report['operations'].items(), key=lambda item: -item[1]['seconds']):
+            rows.append(('  ' + kind, stats))
+            if len(stats['groups']) > 1 or kind not in stats['groups']:
+                rows.extend(('    ' + group, group_stats) for (group, group_stats) in
+                            sorted(stats['groups'].items(), key=lambda item: -item[1]['seconds']))
+        for (name, stats) in rows:
+            lines.append('{:<45} {:>7} {:>9.2f} {:>9.1f} {:>9.1f} {:>10.1f}'.format(
+                name[:45], stats['count'], stats['seconds'], stats['seconds'] * 1000 / max(1, stats['count']),
+                stats['max_seconds'] * 1000, stats['bytes'] / 1024.0))
+        lines.append('Slowest {} operations:'.format(min(top, len(report['slowest']))))
+        for op in report['slowest'][:top]:
+            lines.append('  {:>9.1f} ms  {:<11} {}'.format(op['seconds'] * 1000, op['kind'], op['name']))
+        return '\n'.join(lines)
+
+
+def start(keep=100):
+    global active
+    active = Profiler(keep)
+    return active
+
+
+def record(kind, name, seconds, bytes=0, group=None):
+    if active:
+        active.record(kind, name, seconds, bytes, group)
+
+
+@contextlib.contextmanager
+def timed(kind, name, group=None):
+    # records the time spent in the with block as an operation
+    if not active:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(kind, name, time.monotonic() - start, group=group)
+
+
+@contextlib.contextmanager
+def phase(name):
+    if not active:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if active:
+            active.record_phase(name, time.monotonic() - start)
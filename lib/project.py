@@ -1,5 +1,5 @@
 # generic project class
-from lib import *
+from lib.utils import Utils
 
 class Project:
     name = "Generic"  # placeholder only, should be defined by subclass
@@ -9,6 +9,7 @@ class Project:
         self.args = args
         self.utils = Utils(args)  # create Utils for use throughout class
         self.utils.load_properties()
+        self._runner = None
 
     def commit(self):
         print("Building (commit) %s".format(self.name))
@@ -26,14 +27,70 @@ class Project:
         print("Certifying {}".format(self.name))
         return True
 
+    def script(self, action):
+        return 'script' + '/' + self.args.project_type + '/' + action + '.py'
+
+    def executor(self):
+        # how action scripts run: 'command' (the default, a shell and interpreter per action), 'warm' or
+        # 'inprocess', see lib/script_runner.py
+        return getattr(self.args, 'executor', None) or 'command'
+
+    @property
+    def runner(self):
+        # started by the first action that needs it (a warm pool costs a few interpreters) and closed on exit
+        if not self._runner:
+            import atexit
+            from lib.script_runner import ScriptRunner
+            self._runner = ScriptRunner(self.executor(), getattr(self.args, 'executor_workers', None) or 4)
+            atexit.register(self.close)
+        return self._runner
+
+    def close(self):
+        # stops the worker interpreters of the warm executor, if started
+        if self._runner:
+            self._runner.close()
+            self._runner = None
+
     def execute(self):
         print("Executing {}".format(self.name))
         ok = True
         action = self.args.action
-        type = self.args.project_type
         if action:
             print('Perform {} action'.format(action))
-            script = 'script' + '/' + type + '/' + action + '.py'
+            script = self.script(action)
+            if self.executor() != 'command':
+                return self.runner.run(script, log_file=getattr(self.args, 'log_file', None))
             cmd = self.utils.host.cmd
-            ok = cmd.run(script)
-        return ok
\ No newline at end of file
+            # stream long running action output as it comes, optionally tee'd into a log file
+            ok = cmd.run(script, stream=getattr(self.args, 'stream', False),
+                         log_file=getattr(self.args, 'log_file', None))
+        return ok
+
+    def steps(self):
+        # build steps of the project (lib.build_graph.Step), for build(); none by default
+        return []
+
+    def build(self):
+        # every build step (or args.build_targets and what they depend on), independent steps concurrently and
+        # steps whose inputs did not change since their last successful run skipped; args.force rebuilds all
+        from lib.build_graph import BuildGraph
+
+        print("Building {}".format(self.name))
+        try:
+            graph = BuildGraph(self.steps(), getattr(self.args, 'build_manifest', None) or '.build_manifest.json',
+                               getattr(self.args, 'build_workers', None) or 4)
+            results = graph.run(getattr(self.args, 'build_targets', None), getattr(self.args, 'force', False))
+        except ValueError as e:
+            print("ERROR: {}".format(e))
+            return False
+        return all(result in ('built', 'cached') for result in results.values())
+
+    def execute_many(self, actions, limit=4):
+        # run independent actions concurrently, returns their statuses in the order given
+        print("Executing {} actions {}".format(self.name, ', '.join(actions)))
+        scripts = [self.script(action) for action in actions]
+        if self.executor() != 'command':
+            return self.runner.run_many(scripts, limit=limit, log_file=getattr(self.args, 'log_file', None))
+        cmd = self.utils.host.cmd
+        return cmd.run_many(scripts, limit=limit, stream=getattr(self.args, 'stream', False),
+                            log_file=getattr(self.args, 'log_file', None))
\ No newline at end of file
@@ -0,0 +1,306 @@
+# Runs python action scripts without paying for /bin/sh and a new python interpreter each time, which dominates
+# short actions.  Modes:
+#   'warm'      a pool of worker interpreters is started with the runner, with the lib modules already imported;
+#               each script runs in a process a worker forks for it, so it starts in milliseconds and shares
+#               nothing with other scripts or the caller.  A worker that dies is replaced, and when none can be
+#               started any more scripts run as in 'command' mode.
+#   'inprocess' each script runs in this process via runpy, one at a time, with argv, environment and current
+#               directory swapped in and restored afterwards; fastest, but modules it imports stay loaded
+#   'command'   through Command.run as before, also used for any script that is not python
+# Either way a script runs as __main__ with sys.argv = [script] + args and the caller's environment as it is at
+# the time of the call, and run() returns its exit status like Command.run does.
+import importlib
+import json
+import os
+import queue
+import runpy
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from lib import profiler
+from lib.utils import Command
+
+modes = ('warm', 'inprocess', 'command')
+preload = ['lib', 'lib.utils', 'lib.project', 'lib.webapp']
+
+
+def is_python(script):
+    if script.endswith('.py'):
+        return True
+    try:
+        with open(script, 'rb') as fh:
+            first = fh.readline(200)
+    except OSError:
+        return False
+    return first.startswith(b'#!') and b'python' in first
+
+
+def exit_status(code):
+    # exit status of a SystemExit code, the way the interpreter turns one into its own
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+class Tee:
+    # stand-in for sys.stdout/sys.stderr writing to stream and to log (a file), each line prefixed with prefix
+    def __init__(self, stream, log=None, prefix=''):
+        self.stream = stream
+        self.log = log
+        self.prefix = prefix
+        self.partial = ''
+
+    def write(self, string):
+        if self.prefix:
+            lines = (self.partial + string).split('\n')
+            self.partial = lines.pop()
+            string = ''.join(self.prefix + line + '\n' for line in lines)
+        self.stream.write(string)
+        if self.log:
+            self.log.write(string)
+        return len(string)
+
+    def flush(self):
+        if self.partial:
+            self.write('\n')
+        self.stream.flush()
+        if self.log:
+            self.log.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_main(script, args, env, cwd, log_file=None, prefix=''):
+    # script as __main__ with sys.argv, sys.path[0] and the current directory set up like 'python script args'
+    # does; raises SystemExit like the script does, SystemExit(1) once the traceback of an exception is printed
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    sys.argv = [script] + list(args)
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    log = open(log_file, 'a', buffering=1) if log_file else None
+    if log or prefix:
+        sys.stdout = Tee(sys.stdout, log, prefix)
+        sys.stderr = Tee(sys.stderr, log, prefix)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except Exception:
+        traceback.print_exc()
+        raise SystemExit(1)
+    finally:
+        if log or prefix:
+            (stdout, stderr) = (sys.stdout, sys.stderr)
+            (sys.stdout, sys.stderr) = (stdout.stream, stderr.stream)
+            stdout.flush()
+            stderr.flush()
+        if log:
+            log.close()
+
+
+def serve(requests_fd, replies_fd):
+    # main loop of a warm worker: one JSON request (run_main() arguments) per line in, the exit status of the
+    # script out.  The worker is single threaded, so forking it is safe, and the fork leaves it as it was.
+    for module in preload:
+        importlib.import_module(module)
+    replies = os.fdopen(replies_fd, 'w', buffering=1)
+    for line in os.fdopen(requests_fd, 'r'):
+        request = json.loads(line)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(requests_fd)
+                replies.close()
+                run_main(**request)
+                status = 0
+            except SystemExit as e:
+                status = exit_status(e.code)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        status = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+        # killed by a signal: 128 + signal number, like the shell
+        replies.write('{}\n'.format(status if status >= 0 else 128 - status))
+
+
+class WarmPool:
+    # size worker interpreters, started at once so they warm up while the caller goes on
+    def __init__(self, size=4):
+        self.idle = queue.Queue()  # idle workers, None once there are none left at all
+        self.workers = []
+        self.lock = threading.Lock()
+        for i in range(size):
+            self.spawn()
+
+    def spawn(self):
+        # starts a worker and adds it to the idle ones
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+        (requests_r, requests_w) = os.pipe()
+        (replies_r, replies_w) = os.pipe()
+        code = 'import sys; from lib.script_runner import serve; serve(int(sys.argv[1]), int(sys.argv[2]))'
+        try:
+            process = subprocess.Popen([sys.executable, '-c', code, str(requests_r), str(replies_w)], env=env,
+                                       pass_fds=(requests_r, replies_w))
+        except OSError:
+            for fd in (requests_r, requests_w, replies_r, replies_w):
+                os.close(fd)
+            raise
+        os.close(requests_r)
+        os.close(replies_w)
+        worker = (process, os.fdopen(requests_w, 'w', buffering=1), os.fdopen(replies_r, 'r'))
+        with self.lock:
+            self.workers.append(worker)
+        self.idle.put(worker)
+
+    def replace(self, worker, script):
+        # a worker died: another takes its place, if one can still be started
+        (process, requests, replies) = worker
+        print('ERROR: Warm worker {} died{}, exit status {}'.format(process.pid, ' running ' + script if script
+                                                                  else '', process.wait()))
+        for pipe in (requests, replies):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        with self.lock:
+            self.workers.remove(worker)
+        try:
+            self.spawn()
+        except OSError as e:
+            print('ERROR: Cannot start a warm worker: {}'.format(e))
+            with self.lock:
+                if not self.workers:
+                    self.idle.put(None)
+
+    def run(self, request):
+        # exit status of the script, run by the next idle worker; None when no worker is left to run it
+        while True:
+            worker = self.idle.get()
+            if worker is None:
+                self.idle.put(None)  # for whoever waits next
+                return None
+            (process, requests, replies) = worker
+            try:
+                requests.write(json.dumps(request) + '\n')
+            except OSError:
+                # died while idle, before the script started: it goes to the next worker
+                self.replace(worker, None)
+                continue
+            try:
+                reply = replies.readline()
+            except OSError:
+                reply = ''
+            if not reply:
+                self.replace(worker, request['script'])
+                return 1
+            self.idle.put(worker)
+            return int(reply)
+
+    def close(self):
+        # workers finish once their request pipe is closed
+        with self.lock:
+            (workers, self.workers) = (self.workers, [])
+        for (process, requests, replies) in workers:
+            try:
+                requests.close()
+            except OSError:
+                pass
+            process.wait()
+            replies.close()
+
+
+class ScriptRunner:
+    def __init__(self, mode='warm', workers=4):
+        if mode not in modes:
+            raise ValueError('Script runner mode should be one of {}, not {}'.format(', '.join(modes), mode))
+        self.mode = mode
+        self.lock = threading.Lock()  # in-process scripts share sys.argv, os.environ and the current directory
+        self.pool = WarmPool(workers) if mode == 'warm' else None
+        self.last_status = None
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+
+    def run(self, script, args=(), log_file=None, prefix=''):
+        if self.mode == 'command' or not is_python(script):
+            self.last_status = self.run_command(' '.join([script] + list(args)), log_file, prefix)
+            return self.last_status
+        print('Running {} ({})'.format(' '.join([script] + list(args)), self.mode))
+        start = time.monotonic()
+        if self.mode == 'inprocess':
+            status = self.run_inprocess(script, args, log_file, prefix)
+        else:
+            status = self.run_warm(script, args, log_file, prefix)
+        profiler.record('script', script, time.monotonic() - start, group=self.mode)
+        self.last_status = status
+        return status
+
+    def run_command(self, cmd, log_file, prefix):
+        # output streamed as it comes, like the other modes
+        command = Command()
+        if not prefix:
+            return command.run(cmd, stream=True, log_file=log_file)
+        log = open(log_file, 'a', buffering=1) if log_file else None
+
+        def callback(name, line):
+            line = prefix + line
+            print(line)
+            if log:
+                log.write(line + '\n')
+
+        try:
+            return command.run(cmd, callback=callback)
+        finally:
+            if log:
+                log.close()
+
+    def run_warm(self, script, args, log_file, prefix):
+        # what was printed so far comes before the script's output
+        sys.stdout.flush()
+        sys.stderr.flush()
+        status = self.pool.run({'script': script, 'args': list(args), 'env': dict(os.environ), 'cwd': os.getcwd(),
+                                'log_file': log_file, 'prefix': prefix})
+        if status is None:
+            print('ERROR: No warm worker is left, running scripts as commands from now on')
+            self.mode = 'command'
+            status = self.run_command(' '.join([script] + list(args)), log_file, prefix)
+        return status
+
+    def run_inprocess(self, script, args, log_file, prefix):
+        with self.lock:
+            saved = (list(sys.argv), dict(os.environ), os.getcwd(), sys.path[0], sys.stdout, sys.stderr)
+            try:
+                run_main(script, args, saved[1], saved[2], log_file, prefix)
+                status = 0
+            except SystemExit as e:
+                status = exit_status(e.code)
+            finally:
+                (sys.argv, sys.path[0], sys.stdout, sys.stderr) = (saved[0], saved[3], saved[4], saved[5])
+                os.environ.clear()
+                os.environ.update(saved[1])
+                os.chdir(saved[2])
+            return status
+
+    def run_many(self, scripts, limit=4, log_file=None):
+        # scripts concurrently (one at a time in process), returns their statuses in the order given.  Output
+        # lines are prefixed with the index of their script, like Command.run_many.
+        import concurrent.futures
+
+        if self.mode == 'inprocess':
+            limit = 1
+        elif self.pool:
+            limit = min(limit, len(self.pool.workers))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=limit) as executor:
+            return list(executor.map(lambda i: self.run(scripts[i], log_file=log_file, prefix='[{}] '.format(i)),
+                                     range(len(scripts))))
@@ -0,0 +1,188 @@
+# Incremental export of a built site tree into the directory that gets deployed.  Only files whose content changed
+# since the last export are written, so a re-export costs a stat per file plus the work for what changed:
+#   - source files are hashed (sha1) by a thread pool, a file whose size and mtime match the manifest is not read
+#   - added and changed files are copied by a thread pool, each through a temporary file so a reader of the export
+#     never sees half a file; files gone from the source are removed
+#   - compressible files get a pre-compressed .gz variant, made by a process pool (deterministic, mtime 0, so an
+#     unchanged file gives the same bytes).  Its workers come from a forkserver (or are spawned), not forked from
+#     this process, which may have threads running, e.g. when exporting is a step of a BuildGraph; as with any
+#     such pool, a script exporting with more than one process keeps its top level code under
+#     if __name__ == '__main__'.
+# The manifest (output path => sha1) is kept next to the export, as is a diff of the last export, the output paths
+# added, changed and removed, for whatever syncs the export onwards.
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from lib.utils import FileHashes, replace_file, write_json
+
+gzip_extensions = ('.html', '.htm', '.css', '.js', '.mjs', '.json', '.map', '.svg', '.xml', '.txt', '.csv', '.md',
+                   '.ico', '.wasm', '.webmanifest')
+gzip_min_size = 1024  # smaller files barely shrink
+gzip_level = 9  # made once per change and served many times
+
+
+def gzip_file(source, dest):
+    # sha1 of dest, the gzip of source; runs in a worker process
+    with open(source, 'rb') as fh:
+        data = gzip.compress(fh.read(), compresslevel=gzip_level, mtime=0)
+
+    def write(tmp):
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+
+    replace_file(dest, write)
+    return hashlib.sha1(data).hexdigest()
+
+
+def gzip_files(pairs):
+    # gzip_file() of each (source, dest), batched so a process pool task is worth sending
+    return [gzip_file(source, dest) for (source, dest) in pairs]
+
+
+class StaticExport:
+    manifest_version = 1
+
+    def __init__(self, source, dest, manifest=None, diff=None, workers=None, processes=None, gzip=True):
+        self.source = source
+        self.dest = dest
+        base = dest.rstrip(os.sep)
+        self.manifest_file = manifest or base + '.manifest.json'
+        self.diff_file = diff or base + '.diff.json'
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)  # hashing and copying mostly wait on I/O
+        self.processes = processes or os.cpu_count() or 1
+        self.gzip = gzip
+
+    def load(self):
+        # (source files => [size, mtime_ns, sha1], output paths => sha1) of the last export
+        try:
+            with open(self.manifest_file, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return {}, {}
+        except ValueError:
+            print('Note: Ignoring corrupt export manifest {}, exporting everything'.format(self.manifest_file))
+            return {}, {}
+        if data.get('version') != self.manifest_version or data.get('dest') != os.path.abspath(self.dest):
+            return {}, {}
+        return data.get('sources', {}), data.get('outputs', {})
+
+    def save(self, sources, outputs, diff):
+        manifest = {'version': self.manifest_version, 'dest': os.path.abspath(self.dest), 'sources': sources,
+                    'outputs': outputs}
+        write_json(self.manifest_file, manifest)
+        write_json(self.diff_file, diff)
+
+    def scan(self):
+        # relative path => os.stat() of every file under source
+        files = {}
+        for (dir, dirs, names) in os.walk(self.source):
+            dirs.sort()
+            for name in names:
+                path = os.path.join(dir, name)
+                files[os.path.relpath(path, self.source).replace(os.sep, '/')] = os.stat(path)
+        return files
+
+    def hash_sources(self, files, old_sources, executor):
+        # relative path => [size, mtime_ns, sha1], reading only files whose size or mtime changed
+        hashes = FileHashes(old_sources, self.source)
+        sources = {}
+        to_hash = []
+        for (name, st) in files.items():
+            sha1 = hashes.cached(name, st)
+            if sha1:
+                sources[name] = [st.st_size, st.st_mtime_ns, sha1]
+            else:
+                to_hash.append(name)
+        for (name, sha1) in zip(to_hash, executor.map(lambda name: hashes.hash(name, files[name]), to_hash)):
+            sources[name] = [files[name].st_size, files[name].st_mtime_ns, sha1]
+        return sources, hashes.read
+
+    def wants_gzip(self, name, size, names):
+        return (self.gzip and size >= gzip_min_size and name.lower().endswith(gzip_extensions) and
+                name + '.gz' not in names)
+
+    def copy(self, name):
+        replace_file(os.path.join(self.dest, name),
+                     lambda tmp: shutil.copy2(os.path.join(self.source, name), tmp))
+
+    def remove(self, name):
+        path = os.path.join(self.dest, name)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        # drop directories left empty, but not dest itself
+        dir = os.path.dirname(path)
+        while os.path.abspath(dir) != os.path.abspath(self.dest):
+            try:
+                os.rmdir(dir)
+            except OSError:
+                break
+            dir = os.path.dirname(dir)
+
+    def compress(self, names):
+        # output path of each name's .gz variant => its sha1, made in a process pool
+        if not names:
+            return {}
+        pairs = [(os.path.join(self.source, name), os.path.join(self.dest, name + '.gz')) for name in names]
+        batch = max(1, min(64, len(pairs) // (self.processes * 4)))
+        batches = [pairs[i:i + batch] for i in range(0, len(pairs), batch)]
+        processes = min(self.processes, len(batches))
+        if processes == 1:
+            results = [gzip_files(pairs) for pairs in batches]
+        else:
+            import multiprocessing
+
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                        mp_context=multiprocessing.get_context(method)) as pool:
+                results = list(pool.map(gzip_files, batches))
+        return dict(zip((name + '.gz' for name in names), (sha1 for result in results for sha1 in result)))
+
+    def run(self):
+        # exports source into dest, returns the diff: {'added': [...], 'changed': [...], 'removed': [...],
+        # 'unchanged': count} of output paths
+        start = time.time()
+        if not os.path.isdir(self.source):
+            raise FileNotFoundError('Nothing to export, {} is not a directory'.format(self.source))
+        (old_sources, old_outputs) = self.load()
+        files = self.scan()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            (sources, hashed) = self.hash_sources(files, old_sources, executor)
+            outputs = {}
+            to_copy = []
+            to_gzip = []
+            for (name, (size, mtime_ns, sha1)) in sources.items():
+                outputs[name] = sha1
+                # a file lost from dest since the last export is written again, without showing in the diff
+                written = old_outputs.get(name) == sha1
+                if not written or not os.path.isfile(os.path.join(self.dest, name)):
+                    to_copy.append(name)
+                if self.wants_gzip(name, size, sources):
+                    gz = old_outputs.get(name + '.gz')
+                    if written and gz and os.path.isfile(os.path.join(self.dest, name + '.gz')):
+                        outputs[name + '.gz'] = gz
+                    else:
+                        to_gzip.append(name)
+            # removed first: a file gone from the source may be where a new directory goes
+            removed = sorted(set(old_outputs) - set(outputs) - set(name + '.gz' for name in to_gzip))
+            for name in removed:
+                self.remove(name)
+            list(executor.map(self.copy, to_copy))
+        outputs.update(self.compress(to_gzip))
+        diff = {'added': sorted(name for name in outputs if name not in old_outputs),
+                'changed': sorted(name for name in outputs if name in old_outputs and
+                                  outputs[name] != old_outputs[name]),
+                'removed': removed}
+        diff['unchanged'] = len(outputs) - len(diff['added']) - len(diff['changed'])
+        self.save(sources, outputs, diff)
+        print('Exported {} to {} in {:.2f} s: {} added, {} changed, {} removed, {} unchanged ({} files hashed, {} '
+              'copied, {} gzipped)'.format(self.source, self.dest, time.time() - start, len(diff['added']),
+                                           len(diff['changed']), len(diff['removed']), diff['unchanged'], hashed,
+                                           len(to_copy), len(to_gzip)))
+        return diff
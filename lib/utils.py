@@ -3,85 +3,227 @@ import subprocess
 import datetime
 import os
 import re
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import json
+import queue
+import threading
+import time
+
+from lib import profiler
 
 
 # command class based on subprocess.Popen
 class Command:
+    tail_lines = 1000  # lines of output kept in last_stdout/last_stderr when streaming
+
     def __init__(self):
         print("Creating Command")
 
-    def run(self, cmd):
+    def run(self, cmd, stream=False, callback=None, log_file=None):
+        # stream (or a callback/log_file) prints output line by line as the command runs instead of all at once
+        # when it exits, only keeping the last tail_lines lines in last_stdout/last_stderr
+        if stream or callback or log_file:
+            for line in self.lines(cmd, log_file):
+                if callback:
+                    callback(*line)
+                else:
+                    print(line[1])
+            return self.last_status
+
         # reset variables for every run
         self.last_stdout = None
         self.last_stderr = None
         self.last_status = None
         timestamp = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now())
         print("%s: %s" % (timestamp, cmd))
+        start = time.monotonic()
         proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         (out, err) = proc.communicate()
+        profiler.record('subprocess', cmd, time.monotonic() - start, len(out) + len(err), cmd.split(' ', 1)[0])
         if out:
             out = str(out, 'utf-8').rstrip('\n')
             print(out)
             self.last_stdout = out
         if err:
-            err = str(err, 'utf-8').rstript('\n')
+            err = str(err, 'utf-8').rstrip('\n')
             print(err)
             self.last_stderr = err
 
         self.last_status = proc.returncode
         return self.last_status
 
+    def lines(self, cmd, log_file=None):
+        # generator of ('stdout'|'stderr', line) as the command prints them, optionally tee'd to log_file
+        self.last_stdout = None
+        self.last_stderr = None
+        self.last_status = None
+        timestamp = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now())
+        print("%s: %s" % (timestamp, cmd))
+        start = time.monotonic()
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, errors='replace')
+        tails = {'stdout': collections.deque(maxlen=self.tail_lines),
+                 'stderr': collections.deque(maxlen=self.tail_lines)}
+        lines = queue.Queue()
+
+        def reader(name, pipe):
+            for line in pipe:
+                lines.put((name, line.rstrip('\n')))
+            pipe.close()
+            lines.put((name, None))
+
+        readers = [threading.Thread(target=reader, args=('stdout', proc.stdout), daemon=True),
+                   threading.Thread(target=reader, args=('stderr', proc.stderr), daemon=True)]
+        for thread in readers:
+            thread.start()
+        log = open(log_file, 'a') if log_file else None
+        try:
+            open_pipes = len(readers)
+            while open_pipes:
+                (name, line) = lines.get()
+                if line is None:
+                    open_pipes -= 1
+                    continue
+                tails[name].append(line)
+                if log:
+                    log.write(line + '\n')
+                yield name, line
+        finally:
+            if log:
+                log.close()
+            self.last_status = proc.wait()
+            profiler.record('subprocess', cmd, time.monotonic() - start, group=cmd.split(' ', 1)[0])
+        if tails['stdout']:
+            self.last_stdout = '\n'.join(tails['stdout'])
+        if tails['stderr']:
+            self.last_stderr = '\n'.join(tails['stderr'])
+
+    def run_many(self, cmds, limit=4, stream=False, log_file=None):
+        # run cmds concurrently, at most limit at a time, and return their statuses in the same order.
+        # Streamed output lines are prefixed with the index of their command; the Command used for each
+        # one is kept in last_runs for its last_stdout/last_stderr.
+        lock = threading.Lock()
+        log = open(log_file, 'a') if log_file else None
+
+        def run_one(i, cmd):
+            def callback(name, line):
+                line = '[{}] {}'.format(i, line)
+                with lock:
+                    print(line)
+                    if log:
+                        log.write(line + '\n')
+
+            command = Command()
+            if stream or log:
+                command.run(cmd, callback=callback)
+            else:
+                command.run(cmd)
+            return command
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=limit) as executor:
+                self.last_runs = list(executor.map(run_one, range(len(cmds)), cmds))
+        finally:
+            if log:
+                log.close()
+        return [command.last_status for command in self.last_runs]
+
 
 class Host():
     name = "Generic Host"
+    mounts_file = '/proc/self/mounts'
 
     def __init__(self, cmd=None):
         print("Creating %s" % self.name)
-        if not cmd:
-            self.cmd = Command()
-        else:
-            self.cmd = cmd
+        self._cmd = cmd
 
+    @property
+    def cmd(self):
+        # Command is only created once something is run
+        if not self._cmd:
+            self._cmd = Command()
+        return self._cmd
 
-class MacHost(Host):
-    name = "Mac Host"
+    def mounts(self):
+        # list of (device, mount point, fs type); the kernel escapes spaces and the like as octal (\040)
+        mounts = []
+        with open(self.mounts_file) as fh:
+            for line in fh:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                (device, mnt, fstype) = [unescape_mount(field) for field in fields[:3]]
+                mounts.append((device, mnt, fstype))
+        return mounts
 
-    def __init__(self, cmd=None):
-        Host.__init__(self, cmd)
-
-    def check_inodes(self, threshold):
-        print('Checking % of inodes in used (threshold = {}%)'.format(threshold))
-        ok = True
-        self.cmd.run('df -i')
-        for line in self.cmd.last_stdout.split('\n'):
-            if re.match('^map', line):
+    def partitions(self):
+        # usage of every mounted filesystem with a size, like df, from one statvfs() call per mount point
+        partitions = []
+        for (device, mnt, fstype) in self.mounts():
+            try:
+                st = os.statvfs(mnt)
+            except OSError:
                 continue
-            (pt, foo, foo, foo, foo, foo, foo, piu, mnt) = re.split('\s+', line, 8)
-            if not re.match('\d+\%', piu):
+            if not st.f_blocks:
+                # pseudo filesystems (proc, sysfs, cgroup...)
                 continue
-            p = re.compile('%')
-            piu = p.sub('', piu)
-            if int(piu) > threshold:
-                print('ERROR: Partition {} has {}% of inodes'.format(pt, piu))
-                ok = False
-        return ok
+            used = st.f_blocks - st.f_bfree
+            # same rounding as df: percent of space available to non-root users, rounded up
+            disk_percent = -(-used * 100 // (used + st.f_bavail)) if used + st.f_bavail else 0
+            inode_percent = None
+            if st.f_files:
+                inode_percent = -(-(st.f_files - st.f_ffree) * 100 // st.f_files)
+            partitions.append({'device': device, 'mount': mnt, 'fstype': fstype,
+                               'disk_size': st.f_blocks * st.f_frsize, 'disk_avail': st.f_bavail * st.f_frsize,
+                               'disk_percent': disk_percent, 'inode_percent': inode_percent})
+        return partitions
+
+    def check_capacity(self, inode_threshold=None, disk_threshold=None):
+        # check inode and diskspace usage of every partition in one pass.  Returns one dict per partition with
+        # its usage plus inode_ok/disk_ok (None when that threshold is not given).
+        results = []
+        for part in self.partitions():
+            part['inode_ok'] = None
+            part['disk_ok'] = None
+            if inode_threshold is not None and part['inode_percent'] is not None:
+                part['inode_ok'] = part['inode_percent'] <= int(inode_threshold)
+                if not part['inode_ok']:
+                    print('ERROR: Partition {} has {}% of inodes'.format(part['device'], part['inode_percent']))
+            if disk_threshold is not None:
+                part['disk_ok'] = part['disk_percent'] <= int(disk_threshold)
+                if not part['disk_ok']:
+                    print('ERROR: Partition {} has {}% of diskspace'.format(part['device'], part['disk_percent']))
+            results.append(part)
+        return results
+
+    def check_inodes(self, threshold):
+        print('Checking % of inodes per partition (threshold = {}%)'.format(threshold))
+        return all(part['inode_ok'] is not False for part in self.check_capacity(inode_threshold=threshold))
 
     def check_diskspace(self, threshold):
         print('Checking % of diskspace per partition (threshold = {}%)'.format(threshold))
-        ok = True
-        self.cmd.run('df -h')
-        for line in self.cmd.last_stdout.split('\n'):
-            if re.match('^map', line):
-                continue
-            (pt, foo, foo, foo, foo, foo, foo, piu, mnt) = re.split('\s+', line, 8)
-            if not re.match('\d+\%', piu):
-                continue
-            p = re.compile('%')
-            piu = p.sub('', piu)
-            if int(piu) > threshold:
-                print('ERROR: Partition {} has {}% of diskspace'.format(pt, piu))
-                ok = False
-        return ok
+        return all(part['disk_ok'] is not False for part in self.check_capacity(disk_threshold=threshold))
+
+
+class MacHost(Host):
+    name = "Mac Host"
+
+    def __init__(self, cmd=None):
+        Host.__init__(self, cmd)
+
+    def mounts(self):
+        # no /proc on macOS, mount(8) prints "<device> on <mount point> (<fs type>, <options>)"
+        mounts = []
+        self.cmd.run('mount')
+        for line in (self.cmd.last_stdout or '').split('\n'):
+            m = re.match('^(.+) on (.+) \\((\\w+)', line)
+            # skip automounter maps, they have no capacity of their own
+            if m and not m.group(1).startswith('map '):
+                mounts.append(m.groups())
+        return mounts
 
 
 class UbuntuHost(Host):
@@ -90,56 +232,123 @@ class UbuntuHost(Host):
     def __init__(self, cmd=None):
         Host.__init__(self, cmd)
 
-    def check_inodes(self, threshold):
-        print('Checking % of inodes per partition (threshold = {}%)'.format(threshold))
-        ok = True
-        self.cmd.run('df -i')
-        for line in self.cmd.last_stdout.split('\n'):
-            (pt, foo, foo, foo, piu, mnt) = re.split('\s+', line, 5)
-            if not re.match('\d+\%', piu):
-                continue
-            p = re.compile('%')
-            piu = p.sub('', piu)
-            if int(piu) > int(threshold):
-                print('ERROR: Partition {} has {}% of inodes'.format(pt, piu))
-                ok = False
-        return ok
 
-    def check_diskspace(self, threshold):
-        print('Checking % of diskspace per partition (threshold = {}%)'.format(threshold))
-        ok = True
-        self.cmd.run('df -h')
-        for line in self.cmd.last_stdout.split('\n'):
-            (pt, foo, foo, foo, piu, mnt) = re.split('\s+', line, 5)
-            if not re.match('\d+\%', piu):
-                continue
-            p = re.compile('%')
-            piu = p.sub('', piu)
-            if int(piu) > int(threshold):
-                print('ERROR: Partition {} has {}% of diskspace'.format(pt, piu))
-                ok = False
-        return ok
+def unescape_mount(field):
+    # undo octal escapes such as '\040' (space) used in /proc/self/mounts
+    return re.sub('\\\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
 
 def exit_err(msg):
     print('ERROR: {}'.format(msg))
     exit(1)
 
 
-def create_host():
+def sha1_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class FileHashes:
+    # sha1 of files, remembered with their size and mtime so that a file is only read again once either changed.
+    # entries (key => [size, mtime_ns, sha1]) is what a manifest keeps between runs; keys are paths, relative to
+    # root when there is one.
+    def __init__(self, entries=None, root=None):
+        self.entries = dict(entries or {})
+        self.root = root
+        self.lock = threading.Lock()
+        self.read = 0  # files read, the others were unchanged
+
+    def cached(self, key, st):
+        # sha1 of the file at key if its os.stat() st matches the entry, else None
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def hash(self, key, st=None):
+        path = os.path.join(self.root, key) if self.root else key
+        st = st or os.stat(path)
+        sha1 = self.cached(key, st)
+        if sha1:
+            return sha1
+        sha1 = sha1_file(path)
+        with self.lock:
+            self.entries[key] = [st.st_size, st.st_mtime_ns, sha1]
+            self.read += 1
+        return sha1
+
+    def copy(self):
+        with self.lock:
+            return dict(self.entries)
+
+
+def replace_file(dest, write):
+    # write(tmp) makes dest's new content, which then replaces dest at once: readers see the old file or the new
+    # one, never part of it
+    os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+    tmp = '{}.tmp{}'.format(dest, os.getpid())
+    try:
+        write(tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_json(file, data):
+    # state files, manifests and indexes: written at once, so one cut short by a crash is never left behind
+    def write(tmp):
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh, indent=1, sort_keys=True)
+
+    replace_file(file, write)
+
+
+# path => (mtime, properties) of property files read so far
+property_cache = {}
+property_cache_lock = threading.Lock()
+
+
+def read_properties(file):
+    # <name>=<value> lines of a property file, '#' comment lines skipped.  A file is only parsed again once
+    # its mtime changes; callers get their own copy of the properties.
+    path = os.path.abspath(file)
+    mtime = os.stat(path).st_mtime
+    with property_cache_lock:
+        cached = property_cache.get(path)
+    if cached and cached[0] == mtime:
+        return dict(cached[1])
+    properties = {}
+    with open(path) as f:
+        for line in f:
+            if re.match(r'^\s*#', line) or '=' not in line:
+                continue
+            name, value = line.split('=', 1)
+            properties[name.strip()] = value.strip()
+    with property_cache_lock:
+        property_cache[path] = (mtime, properties)
+    return dict(properties)
+
+
+@functools.lru_cache(maxsize=None)
+def host_class():
+    # host type never changes while we run, so only work it out once per process
     print('Determining host type')
-    proc = subprocess.Popen('uname -a', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    (out, err) = proc.communicate()
-    if err:
-        exit_err('Unable to determine host type')
-    if out:
-        out = str(out, 'utf-8').rstrip('\n')  # have to convert 'byte'
-    if re.match('Linux.+Ubuntu', out):
-        host = UbuntuHost()
-    elif re.match('Darwin.+Darwin', out):
-        host = MacHost()
-    else:
-        host = Host()
-    return host
+    uname = os.uname()
+    if uname.sysname == 'Linux' and 'Ubuntu' in uname.version:
+        return UbuntuHost
+    elif uname.sysname == 'Darwin':
+        return MacHost
+    return Host
+
+
+def create_host():
+    return host_class()()
 
 
 # generic utils class
@@ -149,7 +358,14 @@ class Utils():
     def __init__(self, args):
         print("Creating %s" % self.name)
         self.args = args
-        self.host = create_host()
+        self._host = None
+
+    @property
+    def host(self):
+        # host is only created once something needs it
+        if not self._host:
+            self._host = create_host()
+        return self._host
 
     def load_properties(self, pfile=None):
         file = os.environ.get('PROPERTY_FILE')
@@ -157,28 +373,18 @@ class Utils():
             file = self.args.property_file
         if file:
             print("Loading properties from %s" % file)
-            separator = "="
-            keys = {}
-
-            with open(file) as f:
-                for line in f:
-                    if separator in line:
-                        name, value = line.split(separator, 1)
-                        # Assign key value pair to dict
-                        # strip() removes white space from the ends of strings
-                        keys[name.strip()] = value.strip()
-                print(keys)
-                for name, value in keys.items():
-                    env_value = os.environ.get(name)
-                    if env_value:
-                        print(
-                            "Not loading {} with {} as it is already set to {}".format(name, value, env_value))
-                    else:
-                        print("Loading %s as value %s" % (name, value))
-                        os.environ[name] = value
-                        # print(os.environ)
-
-    def run_script(self, script, body=None):
+            keys = read_properties(file)
+            print(keys)
+            for name, value in keys.items():
+                env_value = os.environ.get(name)
+                if env_value:
+                    print(
+                        "Not loading {} with {} as it is already set to {}".format(name, value, env_value))
+                else:
+                    print("Loading %s as value %s" % (name, value))
+                    os.environ[name] = value
+
+    def run_script(self, script, body=None, stream=False, log_file=None):
         if body:
             f = open(script, 'w')
             f.write(body)
@@ -186,7 +392,11 @@ class Utils():
             os.chmod(script, 0o755)
 
         print("Running script %s" % script)
-        self.cmd.run(script)
+        return self.host.cmd.run(script, stream=stream, log_file=log_file)
+
+    def run_scripts(self, scripts, limit=4, stream=False, log_file=None):
+        print("Running scripts %s" % ', '.join(scripts))
+        return self.host.cmd.run_many(scripts, limit=limit, stream=stream, log_file=log_file)
 
     def load_server_list(self, file):
         # list of servers and format
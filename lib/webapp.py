@@ -1,4 +1,6 @@
-from lib import *
+import os
+
+from lib.project import Project
 
 class Webapp(Project):
     name = "Webapp"
@@ -6,6 +8,24 @@ class Webapp(Project):
     def __init__(self, args):
         Project.__init__(self,args)
 
+    # directories of the build, relative to the current directory; WEBAPP_<NAME>_DIR in the properties overrides
+    dirs = {'code': 'src', 'content': 'content', 'build': 'build', 'export': 'site'}
+
+    def dir(self, name):
+        return os.environ.get('WEBAPP_{}_DIR'.format(name.upper()), self.dirs[name])
+
+    def steps(self):
+        # code and content build independently, the static export takes both
+        from lib.build_graph import Step
+
+        build = self.dir('build')
+        return [Step('code_build', self.code_build, inputs=[self.dir('code')],
+                     outputs=[os.path.join(build, 'code')]),
+                Step('content_build', self.content_build, inputs=[self.dir('content')],
+                     outputs=[os.path.join(build, 'content')]),
+                Step('static_export', self.static_export, inputs=[build], outputs=[self.dir('export')],
+                     deps=['code_build', 'content_build'])]
+
     def code_build(self):
         print("Building code {}".format(self.name))
         return True
@@ -15,7 +35,18 @@ class Webapp(Project):
         return True
 
     def static_export(self):
+        # only what changed since the last export is written; the diff (<export dir>.diff.json) tells the deploy
+        # what to sync
+        from lib.static_export import StaticExport
+
         print("Exporting static site {}".format(self.name))
+        export = StaticExport(self.dir('build'), self.dir('export'), workers=getattr(self.args, 'export_workers', None),
+                              processes=getattr(self.args, 'export_processes', None))
+        try:
+            export.run()
+        except OSError as e:
+            print("ERROR: Static export failed: {}".format(e))
+            return False
         return True
 
     def execute(self):